@@ -1,10 +1,13 @@
 from flask import Flask, g
+from redis import Redis
+import rq
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from config import Config
+from app.utils.cache_utils import init_redis
 
 db = SQLAlchemy()
 ma = Marshmallow()
@@ -12,6 +15,7 @@ login = LoginManager()
 migrate = Migrate()
 jwt = JWTManager()
 
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
@@ -20,9 +24,9 @@ def create_app(config_class=Config):
     login.init_app(app)
     migrate.init_app(app=app, db=db)
     jwt.init_app(app)
-
-    app.config.WECHAT_ACCESS_TOKEN = ''
-    app.config.WECHAT_ACCESS_TOKEN_EXPIRATION = None
+    init_redis(app)
+    app.task_queue = rq.Queue('flaskapi-tasks', connection=Redis(host=app.config['REDIS_HOST'],
+                                                                  port=int(app.config['REDIS_PORT'])))
 
     from app.api import bluePrint
     app.register_blueprint(bluePrint, url_prefix='/api/v1.0')
@@ -1,16 +1,15 @@
 from flask import jsonify, request, current_app
-from flask_jwt_extended import (
-    create_access_token, create_refresh_token,
-    get_jwt_identity, jwt_required
-)
-
-import requests
+from flask_jwt_extended import get_jwt_identity, jwt_required
 
 from app import jwt, db
 from app.api import bluePrint
 from app.models import User
-from .auth_utils import add_token_to_db, is_token_revoked, logout_user, jwt_roles_required
+from .auth_utils import issue_tokens, is_token_revoked, logout_user, revoke_tokens, jwt_roles_required, \
+    get_current_user
 from app.dbUtils.dbUtils import query_existing_phone_user, query_existing_openid_user
+from app.utils.utils import Roles
+from app.utils.http_client import wechat_http, UpstreamUnavailable
+from app.utils.concurrency_utils import wechat_login_bulkhead, BulkheadFull
 
 from app.models import ClassSession
 
@@ -31,14 +30,7 @@ def login_web():
     user = query_existing_phone_user(phone)
     if user:
         if user.check_password(password):
-            access_token = create_access_token(identity=user.to_dict())
-            refresh_token = create_refresh_token(identity=user.to_dict())
-            ret = {
-                'access_token': access_token,
-                'refresh_token': refresh_token
-            }
-            add_token_to_db(access_token, current_app.config['JWT_IDENTITY_CLAIM'])
-            add_token_to_db(refresh_token, current_app.config['JWT_IDENTITY_CLAIM'])
+            ret = issue_tokens(user)
             return jsonify(ret), 201
         else:
             return jsonify(message="Bad credentials"), 401
@@ -49,21 +41,45 @@ def login_web():
 @bluePrint.route('/auth/refresh', methods=['POST'])
 @jwt_required(refresh=True)
 def refresh_access_token():
-    current_user = get_jwt_identity()
-    access_token = create_access_token(identity=current_user)
-    add_token_to_db(access_token, current_app.config['JWT_IDENTITY_CLAIM'])
-    return jsonify({'access_token': access_token}), 201
+    # Read the user so the new access token carries the current roles and permission version.
+    user = get_current_user()
+    if not user:
+        return jsonify(message="User does not exist"), 401
+    ret = issue_tokens(user, refresh=False)
+    return jsonify(ret), 201
 
 
 @bluePrint.route('/auth/logout', methods=['DELETE'])
-@jwt_required
+@jwt_required()
 def logout():
     """
     This API revokes all the tokens including access and refresh tokens that belong to the user.
     """
     current_user = get_jwt_identity()
-    logout_user(current_user.get('id'))
-    return jsonify(message="Token revoked."), 200
+    revoked = logout_user(current_user.get('id'))
+    return jsonify(message="Token revoked.", revoked=revoked), 200
+
+
+@bluePrint.route('/auth/revoke_tokens', methods=['POST'])
+@jwt_roles_required(Roles.ADMIN)  # Only admin can revoke other users' tokens
+def revoke_users_tokens():
+    """
+    This API revokes the tokens of a list of users, e.g. after their role is revoked or their accounts are deleted.
+    token_type can be 'access' or 'refresh' to only revoke one type of token, otherwise all tokens are revoked.
+    """
+    user_ids = request.json.get('user_ids', None)
+    token_type = request.json.get('token_type', None)
+
+    if not user_ids:
+        return jsonify(message="No users given"), 400
+    if not isinstance(user_ids, list) or \
+            any(not isinstance(user_id, int) or isinstance(user_id, bool) for user_id in user_ids):
+        return jsonify(message="user_ids must be a list of user ids"), 400
+    if token_type not in (None, 'access', 'refresh'):
+        return jsonify(message="Unknown token type"), 400
+
+    revoked = revoke_tokens(user_ids, token_type)
+    return jsonify(message="Tokens revoked", revoked=revoked), 200
 
 
 # -------------------Wechat APIs--------------------------------------------------------
@@ -81,7 +97,15 @@ def login_wechat():
         'js_code': code,
         'grant_type': 'authorization_code'
     }
-    r = requests.get(wechat_code2session_url, params=payload)
+    # Only a few threads per worker may wait on wechat, the others stay free for the DB only endpoints.
+    try:
+        with wechat_login_bulkhead:
+            # A js_code can only be used once, a call that may have reached wechat is not sent again.
+            r = wechat_http.get('jscode2session', wechat_code2session_url, params=payload, idempotent=False)
+    except BulkheadFull:
+        return jsonify(message="Too many logins in progress, please try again"), 503
+    except UpstreamUnavailable:
+        return jsonify(message="Wechat is not available, please try again later"), 503
     
     if "errcode" in str(r.content):
         return jsonify(message="Something wrong with the code"), 201
@@ -95,19 +119,12 @@ def login_wechat():
     if not user:
         user = User()
 
-    user.openid = openid
-    user.session_key = session_key
-
-    db.session.add(user)
-    db.session.commit()
-
-    access_token = create_access_token(identity=user.to_dict())
-    refresh_token = create_refresh_token(identity=user.to_dict())
-    ret = {
-        'access_token': access_token,
-        'refresh_token': refresh_token
-    }
-    add_token_to_db(access_token, current_app.config['JWT_IDENTITY_CLAIM'])
-    add_token_to_db(refresh_token, current_app.config['JWT_IDENTITY_CLAIM'])
+    # Only write the user row when something changed, the tokens and the user are committed together.
+    if user.id is None or user.openid != openid or user.session_key != session_key:
+        user.openid = openid
+        user.session_key = session_key
+        db.session.add(user)
+        db.session.flush()
 
+    ret = issue_tokens(user)
     return jsonify(ret), 201
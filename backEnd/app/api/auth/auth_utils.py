@@ -1,16 +1,23 @@
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timedelta, timezone
 from functools import wraps
+from uuid import uuid4
 
-from flask import jsonify
+from flask import jsonify, current_app, g
+from sqlalchemy import and_
 from sqlalchemy.orm.exc import NoResultFound
-from flask_jwt_extended import decode_token, verify_jwt_in_request, get_jwt_identity
+from flask_jwt_extended import decode_token, verify_jwt_in_request, get_jwt_identity, get_jwt, \
+    create_access_token, create_refresh_token
 
 from app.models import TokenBlacklist, User
 
 from app import db
 
 from .exceptions import TokenNotFound
-from app.dbUtils.dbUtils import query_validated_user, query_existing_user
+from .revocation_cache import revocation_cache
+from .permission_cache import permission_cache
+from app.dbUtils.dbUtils import query_existing_user
+from app.utils.utils import VALIDATIONS
 
 
 def posix_utc_to_datetime(posix_utc):
@@ -35,25 +42,85 @@ def add_token_to_db(encoded_token, identity_claim):
     )
     db.session.add(db_token)
     db.session.commit()
+    revocation_cache.set(jti, revoked, expires)
 
 
-def is_token_revoked(jwt_header, jwt_payload):
+def load_token_revoke_status(jti):
     """
+    This function reads the revocation status and expiration of a token from the DB.
     Since we add every token to the db, so if a token is not found in the db, it is considered revoked.
     """
-    jti = jwt_payload['jti']
     try:
         token = TokenBlacklist.query.filter_by(jti=jti).one()
-        return token.revoked
+        return token.revoked, token.expires
     except NoResultFound:
-        return True
+        return True, None
+
+
+def _build_token(identity, claims, token_type):
+    """
+    This function signs one token with a jti and expiration generated here,
+    so the TokenBlacklist row can be built without decoding the token again.
+    """
+    jti = str(uuid4())
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    if token_type == 'access':
+        expires = now + current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+        encoded_token = create_access_token(identity=identity, additional_claims=dict(claims, jti=jti, exp=expires))
+    else:
+        expires = now + current_app.config['JWT_REFRESH_TOKEN_EXPIRES']
+        encoded_token = create_refresh_token(identity=identity, additional_claims=dict(claims, jti=jti, exp=expires))
+
+    db_token = TokenBlacklist(
+        jti=jti,
+        token_type=token_type,
+        user_id=identity.get('id'),
+        expires=expires,
+        revoked=False
+    )
+    return encoded_token, db_token
+
+
+def issue_tokens(user, refresh=True):
+    """
+    This function issues an access token (and a refresh token if refresh is True) for the user,
+    and stores them in the DB with a single commit.
+    Any other pending change in the session, e.g. the user row on wechat login, goes into the same commit.
+    The tokens carry the user's roles, validation status and permission version, see User.token_claims.
+    """
+    result = {}
+    db_tokens = []
+    identity = user.to_dict()
+    claims = user.token_claims()
+    token_types = ['access', 'refresh'] if refresh else ['access']
+    for token_type in token_types:
+        encoded_token, db_token = _build_token(identity, claims, token_type)
+        result[token_type + '_token'] = encoded_token
+        db_tokens.append(db_token)
+
+    # Read the values before the commit expires the objects.
+    issued = [(db_token.jti, db_token.expires) for db_token in db_tokens]
+    db.session.add_all(db_tokens)
+    db.session.commit()
+
+    revocation_cache.set_many(issued, False)
+    return result
+
+
+def is_token_revoked(jwt_header, jwt_payload):
+    """
+    This function checks the revocation status through the revocation cache, the DB is only read on a cache miss.
+    """
+    return revocation_cache.is_revoked(jwt_payload['jti'], load_token_revoke_status)
 
 
 def revoke_token(jti):
     try:
         token = TokenBlacklist.query.filter_by(jti=jti).one()
         token.revoked = True
+        token.revoke_time = datetime.utcnow()
         db.session.commit()
+        revocation_cache.set(jti, True, token.expires)
     except NoResultFound:
         raise TokenNotFound("Could not find the token")
 
@@ -81,24 +148,88 @@ def get_user_unrevoked_tokens(user_id):
         raise TokenNotFound("No token for this user")
 
 
+def revoke_tokens(user_ids, token_type=None, batch_size=1000):
+    """
+    This function revokes all the unrevoked tokens of the users in user_ids, or only those of token_type
+    ('access' or 'refresh') if it is given. It returns the number of revoked tokens.
+    Only the ids, jtis and expirations are read, then each batch of batch_size tokens is revoked by one UPDATE,
+    and once committed, the revocation cache is updated with one redis pipeline per batch.
+    """
+    if not user_ids:
+        return 0
+    query = db.session.query(TokenBlacklist.id, TokenBlacklist.jti, TokenBlacklist.expires)\
+        .filter(TokenBlacklist.user_id.in_(user_ids), TokenBlacklist.revoked == False)
+    if token_type:
+        query = query.filter(TokenBlacklist.token_type == token_type)
+    tokens = query.all()
+
+    batches = [tokens[i:i + batch_size] for i in range(0, len(tokens), batch_size)]
+    now = datetime.utcnow()
+    revoked = 0
+    for batch in batches:
+        # Revoke by id, so a token issued after the SELECT is not revoked in the DB without the cache knowing.
+        revoked += TokenBlacklist.query.filter(TokenBlacklist.id.in_([token.id for token in batch]))\
+            .update({TokenBlacklist.revoked: True, TokenBlacklist.revoke_time: now}, synchronize_session=False)
+    db.session.commit()
+
+    for batch in batches:
+        revocation_cache.set_many([(token.jti, token.expires) for token in batch], True)
+    return revoked
+
+
 def logout_user(user_id):
-    active_tokens = get_user_unrevoked_tokens(user_id)
-    if active_tokens:
-        for token in active_tokens:
-            token.revoked = True
-        db.session.commit()
+    """
+    This function revokes all the tokens of the user and returns how many were revoked.
+    """
+    return revoke_tokens([user_id])
 
 
-def prune_db():
+def prune_db(batch_size=1000, pause=0, progress=None, revoked_age=None):
     """
-    Delete all tokens that have expired
+    Delete all tokens that have expired, or that were revoked more than revoked_age seconds ago
+    (TOKEN_PRUNE_REVOKED_AGE by default).
+    A token missing from the DB is considered revoked, so deleting revoked tokens does not change any check.
+    The expired and the revoked tokens are found by two separate passes, each reading one index in its order,
+    on (expires) and on (revoked, revoke_time). The rows are deleted in batches of batch_size ids,
+    each in its own short transaction, so the table read by every request is never locked for long.
+    progress(deleted, batches) is called after each batch. The total number of deleted tokens is returned.
     """
+    if revoked_age is None:
+        revoked_age = current_app.config['TOKEN_PRUNE_REVOKED_AGE']
     now = datetime.utcnow()
-    expired_tokens = TokenBlacklist.query.filter(TokenBlacklist.expires < now).all()
-    for token in expired_tokens:
-        db.session.delete(token)
+    passes = [
+        (TokenBlacklist.expires < now, TokenBlacklist.expires),
+        (and_(TokenBlacklist.revoked == True, TokenBlacklist.revoke_time < now - timedelta(seconds=revoked_age)),
+         TokenBlacklist.revoke_time),
+    ]
+    deleted = 0
+    batches = 0
+    for condition, order in passes:
+        while True:
+            ids = [token_id for token_id, in db.session.query(TokenBlacklist.id)
+                   .filter(condition).order_by(order).limit(batch_size)]
+            if not ids:
+                break
+            deleted += TokenBlacklist.query.filter(TokenBlacklist.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            batches += 1
+            if progress:
+                progress(deleted, batches)
+            if len(ids) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    return deleted
 
-    db.session.commit()
+
+def get_current_user():
+    """
+    This function returns the User of the current token.
+    The user loaded by jwt_roles_required is reused, otherwise it is read once and kept on flask.g for the request.
+    """
+    if 'current_user' not in g:
+        g.current_user = query_existing_user(get_jwt_identity().get('id'))
+    return g.current_user
 
 
 def jwt_roles_required(roles):
@@ -107,24 +238,32 @@ def jwt_roles_required(roles):
         def decorator(*args, **kwargs):
             verify_jwt_in_request()
             user_id = get_jwt_identity().get('id')
+            claims = get_jwt()
             required_roles = roles
-            #  If everybody can access, then just query existing users.
-            # This is to accomodate the register real information of teacher API.
-            if required_roles == 0:
-                user = query_existing_user(user_id)
+            if 'perm_version' in claims and claims['perm_version'] == permission_cache.get(user_id):
+                # Nothing changed since the token was issued, so its claims are current.
+                user_roles = claims.get('roles')
+                validated = claims.get('validated')
             else:
-                user = query_validated_user(user_id)
+                # Old token or changed permissions, read the user from the DB and keep it for the handler.
+                user = query_existing_user(user_id)
+                if not user:
+                    return jsonify(msg='no such user'), 400
+                g.current_user = user
+                user_roles = user.get_role_value()
+                validated = user.validated
+
+            #  If everybody can access, then the user does not need to be validated.
+            # This is to accomodate the register real information of teacher API.
+            if required_roles != 0 and validated != VALIDATIONS.APPROVED:
+                return jsonify(msg='no such user'), 400
 
             # Check if the user is qualified for the action or resources
-            if user:
-                user_roles = user.get_role_value()
-                if user_roles >= required_roles:
-                    # If the user's role in DB is >= required roles, meaning the user has equal or above
-                    # qualification for the API
-                    return fn(*args, **kwargs)
-                else:
-                    return jsonify(msg='not qualified'), 403
+            if (user_roles or 0) >= required_roles:
+                # If the user's role is >= required roles, meaning the user has equal or above
+                # qualification for the API
+                return fn(*args, **kwargs)
             else:
-                return jsonify(msg='no such user'), 400
+                return jsonify(msg='not qualified'), 403
         return decorator
     return wrapper
@@ -0,0 +1,131 @@
+import threading
+
+import redis
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.models import User
+from app.utils.cache_utils import LocalCache, get_shared_redis, run_script
+
+# Version returned for users that are deleted or do not exist, it never matches a token claim.
+# Users are never restored, so MISSING is final and wins over any version.
+MISSING = -1
+
+# Stores ARGV[1] as the version of KEYS[1] unless the stored version is newer or MISSING, returns the stored version.
+SET_NEWER_VERSION_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]))
+local version = tonumber(ARGV[1])
+if current and version ~= -1 and (current == -1 or current >= version) then
+    return current
+end
+redis.call('SET', KEYS[1], version, 'EX', ARGV[2])
+return version
+"""
+
+
+def newer_version(current, version):
+    """
+    This function returns the version to keep when version is written over the cached version current (or None).
+    """
+    if current is None or version == MISSING:
+        return version
+    if current == MISSING or current >= version:
+        return current
+    return version
+
+
+def _set_newer_version(client, keys, args):
+    current = client.get(keys[0])
+    version = newer_version(None if current is None else int(current), int(args[0]))
+    client.set(keys[0], version, ex=int(args[1]))
+    return version
+
+
+class PermissionVersionCache:
+    """
+    This class caches the permission version of users, keyed by the user's id.
+    The version is put in every token, so while the cached version equals the token's claim,
+    the roles and validation status in the token are still current and no User row needs to be read.
+    Both layers only ever move a version forward, so a version read from the DB before a bump
+    can not replace the bumped version. Without a shared redis (the fallback mode), only the local layer is used.
+    """
+    key_prefix = 'user_perm_version:'
+
+    def __init__(self):
+        self.local = LocalCache()
+        self._local_lock = threading.Lock()
+
+    def _key(self, user_id):
+        return self.key_prefix + str(user_id)
+
+    def get(self, user_id):
+        """
+        This function returns the current permission version of the user, reading the DB only on a cache miss.
+        """
+        version = self.local.get(user_id)
+        if version is not None:
+            return version
+
+        client = get_shared_redis(current_app)
+        try:
+            value = client.get(self._key(user_id)) if client else None
+        except redis.RedisError:
+            value = None
+        if value is not None:
+            return self._store_locally(user_id, int(value))
+
+        row = db.session.query(User.perm_version).filter(User.deleted == False).filter(User.id == user_id).first()
+        version = MISSING if row is None else (row.perm_version or 0)
+        return self.set(user_id, version)
+
+    def _store_locally(self, user_id, version):
+        with self._local_lock:
+            version = newer_version(self.local.get(user_id), version)
+            self.local.set(user_id, version, ttl=current_app.config['PERMISSION_VERSION_LOCAL_TTL'])
+            return version
+
+    def set(self, user_id, version):
+        """
+        This function writes the permission version of the user to both cache layers, unless a layer holds a newer one.
+        It returns the version that is cached.
+        """
+        client = get_shared_redis(current_app)
+        if client:
+            try:
+                version = int(run_script(client, SET_NEWER_VERSION_SCRIPT, _set_newer_version, [self._key(user_id)],
+                                         [version, current_app.config['PERMISSION_VERSION_SHARED_TTL']]))
+            except redis.RedisError:
+                current_app.logger.warning('Could not update the permission version cache in redis.')
+        return self._store_locally(user_id, version)
+
+
+permission_cache = PermissionVersionCache()
+
+
+def bump_permission_version(user):
+    """
+    This function marks a change of the user's roles, validation status or deletion.
+    It must be called before the commit that saves the change, the cache is updated once that commit succeeds.
+    Tokens issued before the change then fall back to reading the User row.
+    The version is incremented by an UPDATE in the DB, so concurrent bumps of the same user never get the same version.
+    """
+    db.session.query(User).filter(User.id == user.id)\
+        .update({User.perm_version: func.coalesce(User.perm_version, 0) + 1}, synchronize_session=False)
+    version = db.session.query(User.perm_version).filter(User.id == user.id).scalar()
+    set_committed_value(user, 'perm_version', version)
+    db.session.info.setdefault('perm_versions', {})[user.id] = MISSING if user.deleted else version
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_permission_versions(session):
+    versions = session.info.pop('perm_versions', None)
+    if versions:
+        for user_id, version in versions.items():
+            permission_cache.set(user_id, version)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_permission_versions(session):
+    session.info.pop('perm_versions', None)
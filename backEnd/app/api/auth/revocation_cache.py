@@ -0,0 +1,122 @@
+from datetime import datetime
+
+import redis
+from flask import current_app
+
+from app.utils.cache_utils import LocalCache, get_shared_redis
+
+REVOKED = b'1'
+ACTIVE = b'0'
+
+
+class RevocationCache:
+    """
+    This class caches the revocation status of tokens, keyed by the token's jti.
+    A lookup goes through a per worker LocalCache first, then the shared redis store,
+    and only falls back to the DB (via the loader passed in) when both miss.
+    Revoked tokens never become active again, so they are cached for the token's lifetime.
+    Active tokens are cached for a short time only and never overwrite a cached revoked status,
+    so a status read from the DB before a revocation can not hide the revocation once it is cached.
+    A revocation done by another worker is seen after at most TOKEN_REVOCATION_LOCAL_TTL seconds.
+    Without a shared redis (the fallback mode), only the local layer is used.
+    """
+    key_prefix = 'token_revoked:'
+
+    def __init__(self):
+        self.local = LocalCache()
+
+    def _key(self, jti):
+        return self.key_prefix + jti
+
+    @staticmethod
+    def _seconds_left(expires, longest):
+        if expires is None:
+            return longest
+        if expires.tzinfo is not None:
+            expires = expires.replace(tzinfo=None) - expires.utcoffset()
+        seconds = int((expires - datetime.utcnow()).total_seconds())
+        return max(1, min(seconds, longest))
+
+    def _store_locally(self, jti, revoked):
+        """
+        This function caches the status in this worker and returns the cached status,
+        which is revoked if a revocation was cached before an active status read earlier.
+        """
+        if revoked:
+            self.local.set(jti, True, ttl=current_app.config['TOKEN_REVOCATION_SHARED_TTL'])
+            return True
+        if not self.local.add(jti, False, ttl=current_app.config['TOKEN_REVOCATION_LOCAL_TTL']):
+            return self.local.get(jti, False)
+        return False
+
+    def is_revoked(self, jti, loader):
+        """
+        This function returns whether the token is revoked.
+        loader(jti) is called on a cache miss and must return (revoked, expires).
+        """
+        revoked = self.local.get(jti)
+        if revoked is not None:
+            return revoked
+
+        client = get_shared_redis(current_app)
+        try:
+            value = client.get(self._key(jti)) if client else None
+        except redis.RedisError:
+            value = None
+        if value is not None:
+            return self._store_locally(jti, value == REVOKED)
+
+        revoked, expires = loader(jti)
+        return self.set(jti, revoked, expires)
+
+    def set(self, jti, revoked, expires=None):
+        """
+        This function writes the revocation status of one token to both cache layers and returns the cached status.
+        """
+        return self.set_many([(jti, expires)], revoked)[0]
+
+    def set_many(self, tokens, revoked):
+        """
+        This function writes the same revocation status for a list of (jti, expires) tokens to both cache layers,
+        with one redis pipeline. It returns the cached status of each token.
+        A revoked status overwrites any cached status. An active status is only added with SET NX and
+        for at most TOKEN_REVOCATION_ACTIVE_TTL seconds, a token that is already cached as revoked stays revoked.
+        """
+        if not tokens:
+            return []
+        statuses = [revoked] * len(tokens)
+        client = get_shared_redis(current_app)
+        if client:
+            try:
+                pipe = client.pipeline(transaction=False)
+                if revoked:
+                    for jti, expires in tokens:
+                        pipe.set(self._key(jti), REVOKED,
+                                 ex=self._seconds_left(expires, current_app.config['TOKEN_REVOCATION_SHARED_TTL']))
+                    pipe.execute()
+                else:
+                    for jti, expires in tokens:
+                        pipe.set(self._key(jti), ACTIVE, nx=True,
+                                 ex=self._seconds_left(expires, current_app.config['TOKEN_REVOCATION_ACTIVE_TTL']))
+                    for jti, _ in tokens:
+                        pipe.get(self._key(jti))
+                    statuses = [value == REVOKED for value in pipe.execute()[len(tokens):]]
+            except redis.RedisError:
+                # The shared store is best effort, the DB stays the source of truth.
+                current_app.logger.warning('Could not update the token revocation cache in redis.')
+        return [self._store_locally(jti, status) for (jti, _), status in zip(tokens, statuses)]
+
+    def invalidate(self, jti):
+        """
+        This function drops a token from both cache layers, so the next check reads the DB.
+        """
+        self.local.delete(jti)
+        client = get_shared_redis(current_app)
+        try:
+            if client:
+                client.delete(self._key(jti))
+        except redis.RedisError:
+            pass
+
+
+revocation_cache = RevocationCache()
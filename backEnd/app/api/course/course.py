@@ -1,4 +1,4 @@
-from flask import jsonify, request
+from flask import jsonify, request, current_app
 from dateutil.rrule import *
 from uuid import uuid4
 from datetime import timedelta
@@ -7,9 +7,17 @@ from app.models import Course, ClassSession, Teaching, TakingClass, CourseCredit
 from app.api import bluePrint
 from app.api.auth.auth_utils import jwt_roles_required
 from app.dbUtils.dbUtils import query_existing_course, query_course_credit, query_existing_taking_class, \
-    query_teacher_class_sessions, query_existing_courses_all, query_session_students
-from app.utils.utils import datetime_string_to_utc, Roles, \
-    datetime_string_to_datetime, convert_to_UTC,dt_list_to_UTC_list
+    query_teacher_class_sessions, query_existing_courses_all, enroll_students, \
+    enroll_series_students, query_series_session_ids, query_existing_class_series, query_session_students, \
+    insert_class_series, insert_lazy_class_series, set_course_credit, change_course_credit, query_credit_statement, \
+    query_credits_used, split_class_series, update_class_series, cancel_class_series, query_existing_teacher, \
+    find_schedule_conflicts, resolve_class_session, query_series_students, \
+    query_course_stats, query_existing_student
+from app.utils.recurrence_utils import parse_occurrence_id, to_naive_utc
+from app.utils.stream_utils import stream_json_list
+from app.utils.etag_utils import conditional_get
+from app.utils.utils import datetime_string_to_utc, Roles, CreditKinds, page_args, \
+    datetime_string_to_datetime, convert_to_UTC,dt_list_to_UTC_list, month_string_to_int
 from flask_jwt_extended import get_jwt_identity
 
 
@@ -32,13 +40,19 @@ def add_course():
 
 
 @bluePrint.route('/courses', methods=['GET'])
+@conditional_get('courses', private=False)
 def get_courses():
     """
     This api gets all courses from the DB.
+    The optional 'limit' and 'cursor' args page through the courses, the next page is read with the returned next_cursor.
     """
-    courses = query_existing_courses_all()
+    try:
+        cursor, limit = page_args(request.args)
+        courses, next_cursor = query_existing_courses_all(cursor, limit)
+    except ValueError:
+        return jsonify(message="Invalid cursor or limit"), 400
     if courses:
-        return jsonify(message=[course.to_dict() for course in courses]), 201
+        return jsonify(message=[Course.dict_of(course) for course in courses], next_cursor=next_cursor), 201
     else:
         return jsonify(message="No courses found"), 404
 
@@ -52,6 +66,8 @@ def add_class_session():
     The repeat wkdays from request need to be in 0, 1, 2, ... 6 for Mon, Tue, Wed, ... Sun
     This api will also add associated teaching information into DB.
     This api also adds the students taking the class session into DB.
+    The sessions of the teacher and the students that overlap the new sessions are returned as conflicts,
+    with reject_on_conflict nothing is added when there is a conflict.
     """
     one_year = timedelta(days = 365)
     course_id = request.json.get('course_id', None)
@@ -64,6 +80,7 @@ def add_class_session():
     course = query_existing_course(course_id)
     teacher_id = get_jwt_identity().get('id')
     repeat_weekly = request.json.get('repeat_weekly', None)
+    reject_on_conflict = request.json.get('reject_on_conflict', False)
 
     if duration <= 0:
         return jsonify(message="Duration must be greater than 0"), 400
@@ -81,33 +98,30 @@ def add_class_session():
                 start_time_local_list = list(rrule(WEEKLY, interval=1, until=end_time_local, 
                     wkst=MO, byweekday=repeat_wkdays, dtstart=start_time_local))
                 start_time_utc_list = dt_list_to_UTC_list(start_time_local_list)
-                for start_time_utc in start_time_utc_list:
-                    class_session = ClassSession()
-                    class_session.course = course
-                    class_session.series_id = series_id
-                    class_session.start_time = start_time_utc
-                    class_session.duration = duration
-                    class_session.info = info
-                    
-                    # Add teacher information to the class_session
-                    teaching = Teaching()
-                    teaching.class_session = class_session
-                    teaching.teacher_id = teacher_id
-                    
-                    # Add taking class info to the DB
-                    if student_ids:
-                        for student_id in student_ids:
-                            taking_class = TakingClass()
-                            taking_class.class_session = class_session
-                            taking_class.student_id = student_id
-                            db.session.add(taking_class)
-
-                    db.session.add(class_session)
-                    db.session.add(teaching)
 
+                conflicts = find_schedule_conflicts(teacher_id, student_ids, start_time_utc_list, duration)
+                if conflicts and reject_on_conflict:
+                    return jsonify(message="Class sessions conflict with existing sessions", conflicts=conflicts), 409
+
+                if request.json.get('lazy', current_app.config['LAZY_CLASS_SERIES']):
+                    # Only the rule is stored, the occurrences are expanded when the sessions are read.
+                    insert_lazy_class_series(series_id, course.id, start_time_local, end_time_local, repeat_wkdays,
+                                             duration, info, teacher_id, student_ids)
+                    db.session.commit()
+                    return jsonify(message="Recurring class sessions added successfully", series_id=series_id,
+                                   conflicts=conflicts), 201
+                # Sessions, teachings and taking classes are bulk inserted, not added one ORM object at a time.
+                session_ids = insert_class_series(series_id, course.id, start_time_utc_list, duration, info,
+                                                  teacher_id, student_ids)
                 db.session.commit()
-                return jsonify(message="Recurring class sessions added successfully"), 201
+                return jsonify(message="Recurring class sessions added successfully",
+                               series_id=series_id, session_ids=session_ids, conflicts=conflicts), 201
         else:
+            # The students are not added to a single session, so only the teacher is checked.
+            conflicts = find_schedule_conflicts(teacher_id, None, [convert_to_UTC(start_time_local)], duration)
+            if conflicts and reject_on_conflict:
+                return jsonify(message="Class session conflicts with existing sessions", conflicts=conflicts), 409
+
             class_session = ClassSession()
             class_session.course = course
             class_session.start_time = convert_to_UTC(start_time_local)
@@ -122,7 +136,7 @@ def add_class_session():
             db.session.add(class_session)
             db.session.add(teaching)
             db.session.commit()
-            return jsonify(message="Class session added successfully"), 201
+            return jsonify(message="Class session added successfully", conflicts=conflicts), 201
     else:
         return jsonify(message="Course does not exist"), 400
 
@@ -132,14 +146,22 @@ def add_class_session():
 def get_class_sessions():
     """
     This API gets all the class sessions that the teacher is teaching within a time frame
+    The optional 'limit' and 'cursor' page through the sessions in start time order.
     """
     # Get the start time and end time in UTC so we can query the DB easily.
     start_time_utc = datetime_string_to_utc(request.json.get('start_time', None))
     end_time_utc = datetime_string_to_utc(request.json.get('end_time', None))
     teacher_id = get_jwt_identity().get('id')
     
-    class_sessions = query_teacher_class_sessions(start_time_utc, end_time_utc, teacher_id)
-    return jsonify(message=[class_session.to_dict() for class_session in class_sessions]), 201
+    try:
+        cursor, limit = page_args(request.json)
+        # The sessions are merged with the occurrences of lazily expanded series that have no ClassSession row yet,
+        # without a limit they are streamed.
+        result, next_cursor = query_teacher_class_sessions(start_time_utc, end_time_utc, teacher_id, cursor, limit,
+                                                           stream=True)
+    except ValueError:
+        return jsonify(message="Invalid cursor or limit"), 400
+    return stream_json_list(result, next_cursor=next_cursor)
 
     # TODO
     # need to think about how to handle admin checking the class sessions
@@ -151,51 +173,206 @@ def update_course_credit():
     """
     This api updates the course credit of a student in the DB.
     If no previous course credit was in the DB, then a new record is created and stored.
+    The difference to the previous credit is recorded in the credit ledger as an adjustment.
     """
     course_id = request.json.get('course_id', None)
     student_id = request.json.get('student_id', None)
     credit = request.json.get('course_credit', None)
+    if not isinstance(credit, int):
+        return jsonify(message="Invalid course credit"), 400
+    if not query_existing_course(course_id):
+        return jsonify(message="Course does not exist"), 400
+    if not query_existing_student(student_id):
+        return jsonify(message="Student does not exist"), 400
 
     course_credit = query_course_credit(course_id, student_id)
+    set_course_credit(student_id, course_id, credit, get_jwt_identity().get('id'), request.json.get('comments', None))
+    db.session.commit()
 
     if course_credit:
-        course_credit.credit = credit
-        db.session.add(course_credit)
-        db.session.commit()
         return jsonify(message="Course credit updated"), 201
     else:
-        course_credit = CourseCredit()
-        course_credit.course_id = course_id
-        course_credit.student_id = student_id
-        course_credit.credit = credit
-        db.session.add(course_credit)
-        db.session.commit()
         return jsonify(message="Course credit added"), 201
 
 
+@bluePrint.route('/credit_transaction', methods=['POST'])
+@jwt_roles_required(Roles.ADMIN)  # Only admin can adjust a course credit info
+def add_credit_transaction():
+    """
+    This api adds a purchase, refund or adjustment to the course credit of a student.
+    The amount is added to the balance, a negative amount takes credits away.
+    """
+    course_id = request.json.get('course_id', None)
+    student_id = request.json.get('student_id', None)
+    amount = request.json.get('amount', None)
+    kind = request.json.get('kind', CreditKinds.PURCHASE)
+    if kind not in (CreditKinds.PURCHASE, CreditKinds.REFUND, CreditKinds.ADJUSTMENT):
+        return jsonify(message="Invalid transaction kind"), 400
+    if not isinstance(amount, int) or amount == 0:
+        return jsonify(message="Invalid amount"), 400
+    if not query_existing_course(course_id):
+        return jsonify(message="Course does not exist"), 400
+    if not query_existing_student(student_id):
+        return jsonify(message="Student does not exist"), 400
+    # Credits can be bought before the first class, but only a credit the student has can be refunded or adjusted.
+    if kind != CreditKinds.PURCHASE and not query_course_credit(course_id, student_id):
+        return jsonify(message="The student has no credit in this course"), 400
+
+    course_credit = change_course_credit(student_id, course_id, amount, kind, get_jwt_identity().get('id'),
+                                         request.json.get('comments', None))
+    db.session.commit()
+    return jsonify(message="Credit transaction added", balance=course_credit.credit), 201
+
+
+@bluePrint.route('/credit_statement', methods=['POST'])
+@jwt_roles_required(Roles.TEACHER)
+def get_credit_statement():
+    """
+    This api returns the credit transactions of a student's course within a time frame,
+    with the balances before and after them.
+    """
+    course_id = request.json.get('course_id', None)
+    student_id = request.json.get('student_id', None)
+    start_time_utc = datetime_string_to_utc(request.json.get('start_time', None))
+    end_time_utc = datetime_string_to_utc(request.json.get('end_time', None))
+    if not start_time_utc or not end_time_utc:
+        return jsonify(message="Invalid time frame"), 400
+
+    opening_balance, transactions = query_credit_statement(student_id, course_id, start_time_utc, end_time_utc)
+    closing_balance = transactions[-1].balance if transactions else opening_balance
+    return jsonify(message=[transaction.to_dict() for transaction in transactions],
+                   opening_balance=opening_balance, closing_balance=closing_balance), 201
+
+
+@bluePrint.route('/credits_used', methods=['POST'])
+@jwt_roles_required(Roles.ADMIN)
+def get_credits_used():
+    """
+    This api returns the credits each student used in each course within a time frame, e.g. a month.
+    """
+    start_time_utc = datetime_string_to_utc(request.json.get('start_time', None))
+    end_time_utc = datetime_string_to_utc(request.json.get('end_time', None))
+    if not start_time_utc or not end_time_utc:
+        return jsonify(message="Invalid time frame"), 400
+
+    result = [{"student_id": student_id, "student_name": student_name, "course_name": course_name,
+               "credits_used": int(credits_used)}
+              for student_id, student_name, course_name, credits_used in query_credits_used(start_time_utc, end_time_utc)]
+    return jsonify(message=result), 201
+
+
+@bluePrint.route('/course_stats', methods=['POST'])
+@jwt_roles_required(Roles.TEACHER)
+def get_course_stats():
+    """
+    This api returns the attendance and credit statistics of every student of a course summed
+    from 'start_month' to 'end_month' (both 'YYYY-MM'), e.g. for a term report.
+    """
+    course_id = request.json.get('course_id', None)
+    try:
+        start_month = month_string_to_int(request.json.get('start_month', None))
+        end_month = month_string_to_int(request.json.get('end_month', None))
+    except ValueError:
+        return jsonify(message="Invalid month"), 400
+
+    result = [{"student_id": student_id, "student_name": student_name, "scheduled": int(scheduled),
+               "attended": int(attended), "credits_charged": int(credits_charged)}
+              for student_id, student_name, scheduled, attended, credits_charged
+              in query_course_stats(course_id, start_month, end_month)]
+    return jsonify(message=result), 201
+
+
 @bluePrint.route('/taking_class', methods=['POST'])
 @jwt_roles_required(Roles.TEACHER)  # Only teacher and above can add a course
 def add_taking_class_session():
     """
     This api add students who are taking a class session into the DB.
+    With series_id instead of class_session_id, the students are added to every session of the series,
+    and to the occurrences of a lazily expanded series that are not materialized yet.
+    All the rows are added or updated in one transaction.
     """
     class_session_id = request.json.get('class_session_id', None)
-    student_ids = request.json.get('student_ids', None)
+    series_id = request.json.get('series_id', None)
+    student_ids = request.json.get('student_ids', None) or []
     comments = request.json.get('comments', None)
 
-    for student_id in student_ids:
-        taking_class = query_existing_taking_class(class_session_id, student_id)
-        if taking_class:
-            taking_class.comments = comments
-        else:
-            taking_class = TakingClass()
-            taking_class.session_id = class_session_id
-            taking_class.student_id = student_id
-            taking_class.comments = comments
+    if series_id:
+        session_ids = query_series_session_ids(series_id)
+        class_series = query_existing_class_series(series_id)
+        if not session_ids and not class_series:
+            return jsonify(message="Cannot find class series"), 400
+        if class_series:
+            enroll_series_students(series_id, student_ids)
+    else:
+        # The session can be an occurrence of a lazily expanded series, which then gets its ClassSession row.
+        class_session = resolve_class_session(class_session_id)
+        if not class_session:
+            return jsonify(message="Cannot find class session"), 400
+        session_ids = [class_session.id]
 
-        db.session.add(taking_class)
-        db.session.commit()
-    return jsonify(message="Taking class information added"), 201
+    added = enroll_students(session_ids, student_ids, comments)
+    db.session.commit()
+    return jsonify(message="Taking class information added", added=added), 201
+
+
+@bluePrint.route('/class_series', methods=['PUT'])
+@jwt_roles_required(Roles.TEACHER)  # Only teacher and above
+def change_class_series():
+    """
+    This api changes all the sessions of a series at once: shift_minutes moves their start times,
+    duration, info and teacher_id replace the old values.
+    With from_time, only the sessions from then on are changed, they are split into a new series
+    whose series_id is returned. Sessions that already had their attendance call are not changed.
+    """
+    series_id = request.json.get('series_id', None)
+    shift_minutes = request.json.get('shift_minutes', None)
+    duration = request.json.get('duration', None)
+    info = request.json.get('info', None)
+    teacher_id = request.json.get('teacher_id', None)
+    from_time = request.json.get('from_time', None)
+
+    if not query_series_session_ids(series_id) and not query_existing_class_series(series_id):
+        return jsonify(message="Cannot find class series"), 400
+    if shift_minutes is not None and not isinstance(shift_minutes, int):
+        return jsonify(message="Invalid shift_minutes"), 400
+    if duration is not None and (not isinstance(duration, int) or duration <= 0):
+        return jsonify(message="Invalid duration"), 400
+    if teacher_id is not None and not query_existing_teacher(teacher_id):
+        return jsonify(message="No such teacher"), 400
+    if from_time is not None:
+        from_time = datetime_string_to_utc(from_time)
+        if not from_time:
+            return jsonify(message="Invalid from_time"), 400
+        from_time = to_naive_utc(from_time)
+
+    series_id = split_class_series(series_id, from_time)
+    changed = update_class_series(series_id, shift_minutes, duration, info, teacher_id)
+    db.session.commit()
+    return jsonify(message="Class series updated", series_id=series_id, changed=changed), 201
+
+
+@bluePrint.route('/cancel_class_series', methods=['POST'])
+@jwt_roles_required(Roles.TEACHER)  # Only teacher and above
+def cancel_series():
+    """
+    This api cancels the sessions of a series from from_time on, or all of them without from_time,
+    together with their teaching and taking class information.
+    Sessions that already had their attendance call are kept.
+    """
+    series_id = request.json.get('series_id', None)
+    from_time = request.json.get('from_time', None)
+
+    if not query_series_session_ids(series_id) and not query_existing_class_series(series_id):
+        return jsonify(message="Cannot find class series"), 400
+    if from_time is not None:
+        from_time = datetime_string_to_utc(from_time)
+        if not from_time:
+            return jsonify(message="Invalid from_time"), 400
+        from_time = to_naive_utc(from_time)
+
+    cancelled = cancel_class_series(series_id, from_time)
+    db.session.commit()
+    return jsonify(message="Class series cancelled", cancelled=cancelled), 201
 
 
 @bluePrint.route('/students_taking_classes', methods=['POST'])
@@ -206,7 +383,13 @@ def get_students_of_session():
     """
     session_id = request.json.get('session_id', None)
 
-    students = query_session_students(session_id)
+    occurrence = parse_occurrence_id(session_id)
+    if occurrence:
+        # Reading the students does not materialize an occurrence of a lazily expanded series.
+        class_session = resolve_class_session(session_id, materialize=False)
+        students = query_session_students(class_session.id) if class_session else query_series_students(occurrence[0])
+    else:
+        students = query_session_students(session_id)
 
     result = []
     for _, student in students:
@@ -7,10 +7,14 @@ from flask_jwt_extended import get_jwt_identity, jwt_required
 
 from app import db
 from app.api import bluePrint
-from app.api.auth.auth_utils import jwt_roles_required
+from app.api.auth.auth_utils import jwt_roles_required, get_current_user
+from app.api.auth.permission_cache import bump_permission_version
 from app.dbUtils.dbUtils import query_existing_user, query_unvalidated_parents, query_parent_hood,\
-    query_parent_students, query_student_sessions
-from app.utils.utils import Roles, VALIDATIONS, datetime_string_to_utc
+    query_parent_students, query_student_sessions, query_student_series, expand_series, query_parent_children_credits, \
+    query_parent_children_sessions, query_parent_children_series
+from app.utils.utils import Roles, VALIDATIONS, datetime_string_to_utc, page_args
+from app.utils.stream_utils import stream_json_list
+from app.utils.etag_utils import conditional_get
 
 
 # -------------------Teachers Section--------------------------------------------------------
@@ -20,9 +24,7 @@ def register_parent():
     """
     This api adds parent's real information to the DB.
     """
-    parent_id = get_jwt_identity().get('id')
-
-    parent = query_existing_user(parent_id)
+    parent = get_current_user()
 
     if parent:
         parent.phone = request.json.get('phone', None)
@@ -35,6 +37,7 @@ def register_parent():
         parent.avatar = request.json.get('avatar', None)
         parent.roles = Roles.PARENT
         parent.register_time = datetime.utcnow()
+        bump_permission_version(parent)
         db.session.add(parent)
         db.session.commit()
         return jsonify(message="Parent created successfully"), 201
@@ -54,6 +57,7 @@ def validate_parent():
 
     if parent:
         parent.validated = decision
+        bump_permission_version(parent)
         parent.approver_id = get_jwt_identity().get('id')
         parent.approve_time = datetime.utcnow()
         db.session.add(parent)
@@ -68,15 +72,20 @@ def validate_parent():
 def get_unvalidated_parents():
     """
     This API gets a list of all existing but unvalidated parents from the DB.
+    The optional 'limit' and 'cursor' args page through the list.
     """
-    users = query_unvalidated_parents()
+    try:
+        cursor, limit = page_args(request.args)
+        users, next_cursor = query_unvalidated_parents(cursor, limit)
+    except ValueError:
+        return jsonify(message="Invalid cursor or limit"), 400
 
     if users:
         result = [user.validate_info() for user in users]
     else:
         result = []
 
-    return jsonify(message=result), 201
+    return jsonify(message=result, next_cursor=next_cursor), 201
 
 
 @bluePrint.route('/bind_parents', methods=['POST'])
@@ -92,7 +101,7 @@ def bind_parents():
 
     parent_hood = query_parent_hood(parent_id, student_id)
     # First, find the parent based on the parent_id
-    parent = query_existing_user(parent_id)
+    parent = get_current_user()
     if parent:
         # If the parent is already logged in, then add the info into db
         parent.phone = request.json.get('phone', None)
@@ -114,6 +123,7 @@ def bind_parents():
             parent.validated = VALIDATIONS.APPROVED
             parent.approve_time = datetime.utcnow()
             parent.approver_id = teacher_id
+            bump_permission_version(parent)
         db.session.add(parent)
         db.session.commit()
 
@@ -141,17 +151,15 @@ def bind_parents():
 
 @bluePrint.route('/parent_students', methods=['GET'])
 @jwt_roles_required(Roles.PARENT)
+@conditional_get('students', 'parenthoods')
 def get_parent_students():
     """
     This api gets the students of a parent.
     """
+    # jwt_roles_required already checked that the parent exists, no need to read the user again.
     parent_id = get_jwt_identity().get('id')
-    parent = query_existing_user(parent_id)
-    if parent:
-        students = query_parent_students(parent_id)
-        return jsonify(message=[student.to_dict() for student, _ in students]), 201
-    else:
-        return jsonify(message='User does not exist'), 201
+    students = query_parent_students(parent_id)
+    return jsonify(message=[student.to_dict() for student, _ in students]), 201
 
 
 @bluePrint.route('/parent_students_sessions', methods=['POST'])
@@ -167,19 +175,72 @@ def get_parent_students_sessions():
     start_time_utc = datetime_string_to_utc(start_time)
     end_time_utc = datetime_string_to_utc(end_time)
 
-    parent = query_existing_user(parent_id)
+    # jwt_roles_required already checked that the parent exists, no need to read the user again.
+    students = query_parent_students(parent_id)
 
-    result = []
-    if parent:
-        students = query_parent_students(parent_id)
+    def student_results():
+        # One student is built at a time while the response is streamed.
         for student, _ in students:
-            class_sessions = query_student_sessions(student.id, start_time_utc, end_time_utc)
+            class_sessions = query_student_sessions(student.id, start_time_utc, end_time_utc, stream=True)
             student_result = student.to_dict()
             student_result['class_sessions'] = []
             for class_session, _ in class_sessions:
                 student_result['class_sessions'].append(class_session.to_dict())
-            result.append(student_result)
+            # Occurrences of lazily expanded series that have no ClassSession row yet
+            occurrences = expand_series(query_student_series(student.id, start_time_utc, end_time_utc), start_time_utc, end_time_utc)
+            for series, course_name, occurrence_time in occurrences:
+                student_result['class_sessions'].append(series.occurrence_dict(occurrence_time, course_name))
+            student_result['class_sessions'].sort(key=lambda session: session['start_time_utc'])
+            yield student_result
+
+    return stream_json_list(student_results())
+
+
+@bluePrint.route('/parent_dashboard', methods=['POST'])
+@jwt_roles_required(Roles.PARENT)
+def get_parent_dashboard():
+    """
+    This api returns everything the parent's home screen shows in one payload: each of the parent's students
+    with the remaining credits of their courses, and their sessions within the time frame with the attendance flags.
+    The data is read with one query for the credits and one for the sessions (plus the lazily expanded series),
+    instead of a few queries per student.
+    """
+    parent_id = get_jwt_identity().get('id')
+    start_time_utc = datetime_string_to_utc(request.json.get('start_time', None))
+    end_time_utc = datetime_string_to_utc(request.json.get('end_time', None))
+    if not start_time_utc or not end_time_utc:
+        return jsonify(message="Invalid time frame"), 400
+
+    students = {}
+    for student, course_name, credit in query_parent_children_credits(parent_id):
+        if student.id not in students:
+            students[student.id] = student.to_dict()
+            students[student.id]['credits'] = []
+            students[student.id]['class_sessions'] = []
+        if course_name is not None:
+            students[student.id]['credits'].append({"course_name": course_name, "course_credit": credit})
+
+    for student_id, class_session, attended in query_parent_children_sessions(parent_id, start_time_utc, end_time_utc):
+        if student_id in students:
+            session = class_session.to_dict()
+            session['attended'] = bool(attended)
+            students[student_id]['class_sessions'].append(session)
+
+    # Occurrences of lazily expanded series that have no ClassSession row yet
+    series_list = query_parent_children_series(parent_id, start_time_utc, end_time_utc)
+    series_students = {}
+    for series, course_name, student_id in series_list:
+        series_students.setdefault(series.id, []).append(student_id)
+    unique_series = {series.id: (series, course_name) for series, course_name, _ in series_list}
+    for series, course_name, occurrence_time in expand_series(list(unique_series.values()), start_time_utc, end_time_utc):
+        for student_id in series_students[series.id]:
+            if student_id in students:
+                session = series.occurrence_dict(occurrence_time, course_name)
+                session['attended'] = False
+                students[student_id]['class_sessions'].append(session)
+    if series_list:
+        for student in students.values():
+            student['class_sessions'].sort(key=lambda session: session['start_time_utc'])
+
+    return jsonify(message=list(students.values())), 201
 
-        return jsonify(message=result), 201
-    else:
-        return jsonify(message='User does not exist'), 201
\ No newline at end of file
@@ -1,15 +1,23 @@
-from flask import jsonify, request
+from flask import jsonify, request, current_app
 from app import db
 from app.models import Student, ParentHood
 from app.api import bluePrint
-from app.api.auth.auth_utils import jwt_roles_required
+from app.api.auth.auth_utils import jwt_roles_required, get_current_user
 from datetime import date, datetime
 from flask_jwt_extended import get_jwt_identity
-from app.utils.utils import Roles, Relationship, datetime_string_to_naive, datetime_string_to_utc
+from app.utils.utils import Roles, Relationship, page_args, image_mimetype, SEARCH_PAGE_SIZE, datetime_string_to_naive, \
+    datetime_string_to_utc, month_string_to_int
 from app.dbUtils.dbUtils import query_validated_user, query_parent_hood, query_existing_student,\
-    query_all_existing_students, query_student_parents, query_student_credits, query_student_sessions
+    query_all_existing_students, query_student_parents, query_student_credits, query_student_sessions, \
+    query_student_series, expand_series, query_student_qr_code_etag, query_student_qr_code, search_students, \
+    query_student_course_stats
+from app.utils.stream_utils import stream_json_list
+from app.utils.etag_utils import conditional_get
+from app.utils.task_utils import enqueue_student_qr_code
+from app.utils.recurrence_utils import occurrence_id, to_naive_utc
 from datetime import datetime
 
+
 # --------------------------Student Section----------------------------------------------------------
 @bluePrint.route('/student', methods=['POST'])
 @jwt_roles_required(Roles.TEACHER)  # At least teacher is required
@@ -20,15 +28,14 @@ def add_student():
     real_name = request.json.get('real_name', None)
     dob = request.json.get('dob', None)
     gender = request.json.get('gender', None)
-    creator_id = get_jwt_identity().get('id')
 
     # Convert DOB to naive datetime format to store in DB
     dob_naive = datetime_string_to_naive(dob)
     
     # Create student instance, fill in the values and add to DB
     student = Student()
-    # Query the db to find the User who created this student.
-    creator = query_validated_user(creator_id)
+    # The User who created this student, jwt_roles_required already checked that it is validated.
+    creator = get_current_user()
     if creator:
         # Check if the creator exists in the User table
         student.creator = creator
@@ -41,9 +48,51 @@ def add_student():
 
     db.session.add(student)
     db.session.commit()
+    # The QR code image is requested from wechat by the task worker, not while the teacher waits.
+    enqueue_student_qr_code(current_app, student.id)
     return jsonify(message="Student created successfully"), 201
 
 
+@bluePrint.route('/student_qr_code', methods=['GET'])
+@jwt_roles_required(Roles.TEACHER)  # At least teacher is required
+def get_student_qr_code():
+    """
+    This api returns the QR code image of a student, given by the 'student_id' arg.
+    The image is sent with its ETag and a long max-age, a request with a matching If-None-Match header
+    is answered with 304 without loading the image from the DB.
+    If the image is not generated yet, its generation is enqueued and 202 is returned.
+    """
+    student_id = request.args.get('student_id', None, type=int)
+    student = query_student_qr_code_etag(student_id)
+    if not student:
+        return jsonify(message="No such student"), 404
+    if not student.qr_code_etag:
+        enqueue_student_qr_code(current_app, student_id)
+        return jsonify(message="QR code is being generated"), 202
+
+    if request.if_none_match.contains(student.qr_code_etag):
+        response = current_app.response_class(status=304)
+    else:
+        image = query_student_qr_code(student_id)
+        response = current_app.response_class(image, mimetype=image_mimetype(image))
+    response.set_etag(student.qr_code_etag)
+    response.headers['Cache-Control'] = 'private, max-age=%d' % current_app.config['QR_CODE_MAX_AGE']
+    return response
+
+
+@bluePrint.route('/student_qr_code', methods=['POST'])
+@jwt_roles_required(Roles.TEACHER)  # At least teacher is required
+def regenerate_student_qr_code():
+    """
+    This api enqueues the generation of a new QR code image for a student.
+    """
+    student_id = request.json.get('student_id', None)
+    if not query_student_qr_code_etag(student_id):
+        return jsonify(message="No such student"), 404
+    enqueue_student_qr_code(current_app, student_id)
+    return jsonify(message="QR code is being generated"), 202
+
+
 @bluePrint.route('/parent_hood', methods=['PUT'])
 @jwt_roles_required(Roles.PARENT)  # At least parent is required
 def update_parent_hood():
@@ -60,7 +109,7 @@ def update_parent_hood():
         parent_hood.relation = relation  # get the int value of the ralation from the relation dict
     else:
         parent_hood = ParentHood()
-        parent_hood.parent = query_validated_user(parent_id)
+        parent_hood.parent = get_current_user()
         parent_hood.student = query_existing_student(student_id)
         parent_hood.relation = relation
 
@@ -104,17 +153,64 @@ def get_student_credits():
     return jsonify(message=result), 201
 
 
+@bluePrint.route('/student_stats', methods=['POST'])
+@jwt_roles_required(Roles.PARENT)  # Parents can only see the statistics of their own children
+def get_student_stats():
+    """
+    This api gets the monthly attendance and credit statistics of each of the student's courses,
+    from 'start_month' to 'end_month' (both 'YYYY-MM', months of the UTC session start times).
+    """
+    student_id = request.json.get('student_id', None)
+    try:
+        start_month = month_string_to_int(request.json.get('start_month', None))
+        end_month = month_string_to_int(request.json.get('end_month', None))
+    except ValueError:
+        return jsonify(message="Invalid month"), 400
+
+    requester = get_current_user()
+    if requester.roles < Roles.TEACHER and not query_parent_hood(requester.id, student_id):
+        return jsonify(message="Not a parent of the student"), 403
+
+    result = []
+    for stat, course_name in query_student_course_stats(student_id, start_month, end_month):
+        item = stat.to_dict()
+        item['course_name'] = course_name
+        result.append(item)
+    return jsonify(message=result), 201
+
+
 @bluePrint.route('/students', methods=['GET'])
 @jwt_roles_required(Roles.TEACHER)
+@conditional_get('students')
 def get_students():
     """
-    This api gets all undeleted students from the DB.
+    This api gets all undeleted students from the DB, a page at a time with the optional 'limit' and 'cursor' args.
     """
-    students = query_all_existing_students()
-    if students:
-        return jsonify(message=[student.to_dict() for student in students]), 201
-    else:
-        return jsonify(message=[]), 201
+    try:
+        cursor, limit = page_args(request.args)
+        students, next_cursor = query_all_existing_students(cursor, limit, stream=True)
+    except ValueError:
+        return jsonify(message="Invalid cursor or limit"), 400
+    return stream_json_list((Student.dict_of(student) for student in students), next_cursor=next_cursor)
+
+
+@bluePrint.route('/search_students', methods=['GET'])
+@jwt_roles_required(Roles.TEACHER)  # At least teacher is required
+def get_search_students():
+    """
+    This api searches the students whose real name contains the 'q' arg, e.g. for a typeahead.
+    The results are ranked exact, prefix then substring matches, a page at a time with the optional 'limit'
+    and 'cursor' args.
+    """
+    query_text = request.args.get('q', '').strip()
+    if not query_text:
+        return jsonify(message="Empty search"), 400
+    try:
+        cursor, limit = page_args(request.args)
+        students, next_cursor = search_students(query_text, cursor, limit or SEARCH_PAGE_SIZE)
+    except ValueError:
+        return jsonify(message="Invalid cursor or limit"), 400
+    return jsonify(message=[Student.dict_of(student) for student in students], next_cursor=next_cursor), 201
 
 
 @bluePrint.route('/student_sessions', methods=['POST'])
@@ -137,4 +233,11 @@ def get_student_sessions():
         result.append({"session_id": class_session.id, "course_name": class_session.course.name, "start_time": class_session.start_time, "duration": class_session.duration,\
             "series_id": class_session.series_id, "attended": taking_class.attended})
 
+    # Occurrences of lazily expanded series that have no ClassSession row yet
+    occurrences = expand_series(query_student_series(student_id, start_time_utc, end_time_utc), start_time_utc, end_time_utc)
+    for series, course_name, occurrence_time in occurrences:
+        result.append({"session_id": occurrence_id(series.id, occurrence_time), "course_name": course_name, "start_time": occurrence_time,\
+            "duration": series.duration, "series_id": series.id, "attended": False})
+    result.sort(key=lambda session: to_naive_utc(session['start_time']))
+
     return jsonify(message=result), 201
@@ -5,12 +5,15 @@ from flask import jsonify, request
 from flask_jwt_extended import get_jwt_identity
 
 from app import db
-from app.models import CourseCredit, TakingClass, User
+from app.models import User
 from app.api import bluePrint
-from app.api.auth.auth_utils import jwt_roles_required
-from app.dbUtils.dbUtils import query_existing_teacher, query_class_session, query_existing_user,\
-    query_teacher_sessions, query_student_credit, query_taking_class, query_existing_teachers
-from app.utils.utils import Roles, datetime_string_to_utc
+from app.api.auth.auth_utils import jwt_roles_required, get_current_user
+from app.api.auth.permission_cache import bump_permission_version
+from app.dbUtils.dbUtils import query_existing_teacher,\
+    query_teacher_sessions, record_attendance, query_existing_teachers, resolve_class_session
+from app.utils.utils import Roles, datetime_string_to_utc, page_args
+from app.utils.stream_utils import stream_json_list
+from app.utils.etag_utils import conditional_get
 
 
 # -------------------Teachers Section--------------------------------------------------------
@@ -20,9 +23,7 @@ def register_teacher():
     """
     This api adds teacher's real information to the DB.
     """
-    teacher_id = get_jwt_identity().get('id')
-
-    teacher = query_existing_user(teacher_id)
+    teacher = get_current_user()
 
     if teacher:
         teacher.phone = request.json.get('phone', None)
@@ -34,6 +35,7 @@ def register_teacher():
         teacher.avatar = request.json.get('avatar', None)
         teacher.roles = Roles.TEACHER
         teacher.register_time = datetime.utcnow()
+        bump_permission_version(teacher)
         db.session.add(teacher)
         db.session.commit()
         return jsonify(message="Teacher created successfully"), 201
@@ -56,6 +58,7 @@ def approve_teacher():
         teacher.approver_id = get_jwt_identity().get('id')
         teacher.approve_time = datetime.utcnow()
         teacher.validated = decision
+        bump_permission_version(teacher)
 
         db.session.add(teacher)
         db.session.commit()
@@ -69,6 +72,7 @@ def approve_teacher():
 def get_teacher_sessions():
     """
     This api returns the teacher's sessions within a time frame.
+    The optional 'limit' and 'cursor' page through the sessions in start time order.
     """
     teacher_id = get_jwt_identity().get('id')
     start_time = request.json.get('start_time', None)
@@ -77,13 +81,14 @@ def get_teacher_sessions():
     start_time_utc = datetime_string_to_utc(start_time)
     end_time_utc = datetime_string_to_utc(end_time)
 
-    class_sessions = query_teacher_sessions(teacher_id, start_time_utc, end_time_utc)
-    
-    result = []
-    for class_session, _ in class_sessions:
-        result.append(class_session.to_dict())
+    try:
+        cursor, limit = page_args(request.json)
+        # Occurrences of lazily expanded series that have no ClassSession row yet are merged in
+        result, next_cursor = query_teacher_sessions(teacher_id, start_time_utc, end_time_utc, cursor, limit)
+    except ValueError:
+        return jsonify(message="Invalid cursor or limit"), 400
 
-    return jsonify(message=result), 201
+    return jsonify(message=result, next_cursor=next_cursor), 201
 
 
 @bluePrint.route('/attendance_call', methods=['POST'])
@@ -101,45 +106,16 @@ def attendance_call():
     # "student_ids": [{"student_id": 1, "attended": true}, {"student_id": 3, "attended": true}, {"student_id": 4, "attended": true}]
     # }
 
-    class_session = query_class_session(session_id)
-    
-    if class_session:
-        # Add attendance call info to class session
-        class_session.attendance_call = True
-        class_session.attendance_teacher_id = teacher_id
-        class_session.attendance_time = datetime.utcnow()
+    # The session can be an occurrence of a lazily expanded series, which then gets its ClassSession row.
+    class_session = resolve_class_session(session_id)
 
-        db.session.add(class_session)
+    if class_session:
+        # Credits and attendance of all the students are written in one transaction,
+        # and a session that already had its attendance call is not charged again.
+        if not record_attendance(class_session, teacher_id, students or []):
+            db.session.rollback()
+            return jsonify(message="Attendance already called"), 409
         db.session.commit()
-
-        course_id = class_session.course.id
-        for student in students:
-            # Deduct credit from student credits
-            student_id = student.get('student_id')
-            attended = student.get('attended')
-            course_credit = query_student_credit(student_id, course_id)
-            if course_credit:
-                course_credit.credit = course_credit.credit - 1
-            else:
-                course_credit = CourseCredit()
-                course_credit.student_id = student_id
-                course_credit.course_id = course_id
-                course_credit.credit = -1
-            db.session.add(course_credit)
-            db.session.commit()
-
-            # Add student taking class information to db if attended
-            if attended:
-                taking_class = query_taking_class(student_id, session_id)
-                if taking_class:
-                    taking_class.attended = True
-                else:
-                    taking_class = TakingClass()
-                    taking_class.student_id = student_id
-                    taking_class.session_id = session_id
-                    taking_class.attended = True
-                db.session.add(taking_class)
-                db.session.commit()
         return jsonify(message="Attendance call success"), 201
     else:
         return jsonify(message="Cannot find class session"), 201
@@ -147,12 +123,17 @@ def attendance_call():
 
 @bluePrint.route('/teachers', methods=['GET'])
 @jwt_roles_required(Roles.ADMIN)
+@conditional_get('users')
 def get_teachers():
     """
-    This api gets all undeleted teachers from the DB.
+    This api gets all undeleted teachers from the DB, a page at a time with the optional 'limit' and 'cursor' args.
     """
-    teachers = query_existing_teachers()
-    return jsonify(message=[teacher.validate_info() for teacher in teachers]), 201
+    try:
+        cursor, limit = page_args(request.args)
+        teachers, next_cursor = query_existing_teachers(cursor, limit, stream=True)
+    except ValueError:
+        return jsonify(message="Invalid cursor or limit"), 400
+    return stream_json_list((User.validate_info_of(teacher) for teacher in teachers), next_cursor=next_cursor)
 
 
 # @bluePrint.route('/dbutilstest', methods=['POST'])
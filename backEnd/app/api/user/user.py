@@ -5,11 +5,13 @@ from flask_jwt_extended import get_jwt_identity, jwt_required
 from app import db
 from app.models import User
 from app.api import bluePrint
-from app.api.auth.auth_utils import jwt_roles_required
+from app.api.auth.auth_utils import jwt_roles_required, get_current_user
+from app.api.auth.permission_cache import bump_permission_version
 from app.dbUtils.dbUtils import query_existing_phone_user, query_existing_teacher,\
     query_validated_user, query_existing_user,\
-    query_unvalidated_users, query_unrevoked_admins
-from app.utils.utils import Roles, VALIDATIONS
+    query_unvalidated_users, query_unrevoked_admins, search_users
+from app.utils.utils import Roles, VALIDATIONS, page_args, SEARCH_PAGE_SIZE
+
 
 #-----------------------Users Section-----------------------------------------
 @bluePrint.route('/user', methods=['POST'])
@@ -41,8 +43,7 @@ def get_user():
     """
     This api gets one user from the DB by the access token.
     """
-    id = get_jwt_identity().get('id')
-    user = query_existing_user(id)    
+    user = get_current_user()
     
     if user:
         result = user.full_info()
@@ -65,7 +66,8 @@ def assign_role():
     user = query_validated_user(user_id)
 
     if user:
-        user.role = role
+        user.roles = role
+        bump_permission_version(user)
         db.session.add(user)
         db.session.commit()
         return jsonify(message="User role assigned"), 201
@@ -86,6 +88,7 @@ def validate_user():
 
     if user:
         user.validated = decision
+        bump_permission_version(user)
         user.approver_id = get_jwt_identity().get('id')
         user.approve_time = datetime.utcnow()
         db.session.add(user)
@@ -100,23 +103,48 @@ def validate_user():
 def get_unvalidated_users():
     """
     This API gets a list of all existing but unvalidated users from the DB.
+    The optional 'limit' and 'cursor' args page through the list.
     """
-    users = query_unvalidated_users()
+    try:
+        cursor, limit = page_args(request.args)
+        users, next_cursor = query_unvalidated_users(cursor, limit)
+    except ValueError:
+        return jsonify(message="Invalid cursor or limit"), 400
 
     if users:
-        return jsonify(message=[user.validate_info() for user in users]), 201
+        return jsonify(message=[user.validate_info() for user in users], next_cursor=next_cursor), 201
     else:
         return jsonify(message="No unvalidated users"), 400
 
 
+@bluePrint.route('/search_users', methods=['GET'])
+@jwt_roles_required(Roles.ADMIN)  # Only Admin can search the users, the results have their phones.
+def get_search_users():
+    """
+    This API searches the users whose real name, nick name or phone contains the 'q' arg, e.g. for a typeahead.
+    The optional 'role' arg only searches the users having that role, e.g. parents.
+    The results are ranked exact, prefix then substring matches, a page at a time with the optional 'limit'
+    and 'cursor' args.
+    """
+    query_text = request.args.get('q', '').strip()
+    if not query_text:
+        return jsonify(message="Empty search"), 400
+    try:
+        role = request.args.get('role', None, type=int)
+        cursor, limit = page_args(request.args)
+        users, next_cursor = search_users(query_text, role, cursor, limit or SEARCH_PAGE_SIZE)
+    except ValueError:
+        return jsonify(message="Invalid cursor or limit"), 400
+    return jsonify(message=[User.validate_info_of(user) for user in users], next_cursor=next_cursor), 201
+
+
 @bluePrint.route('/wechat_user_role', methods=['GET'])
 @jwt_required()
 def get_user_role():
     """
     This API returns the user's role and validation status.
     """
-    user_id = get_jwt_identity().get('id')
-    user = query_existing_user(user_id)
+    user = get_current_user()
 
     if user:
         return jsonify(message=user.get_roles()), 201
@@ -130,8 +158,7 @@ def add_admin():
     """
     This API registers an admin
     """
-    user_id = get_jwt_identity().get('id')
-    user = query_existing_user(user_id)
+    user = get_current_user()
 
     if user:
         user.roles = Roles.ADMIN
@@ -145,6 +172,7 @@ def add_admin():
         user.register_time = datetime.utcnow()
         user.nick_name = request.json.get('nick_name', None)
         user.validated = VALIDATIONS.WAITING
+        bump_permission_version(user)
 
         db.session.add(user)
         db.session.commit()
@@ -161,7 +189,7 @@ def validate_admin():
     """
     super_id = get_jwt_identity().get('id')
 
-    super = query_existing_user(super_id)
+    super = get_current_user()
 
     if current_app.config.get('SUPER_ID') and super.openid == current_app.config.get('SUPER_ID'):
         admin_id = request.json.get('admin_id', None)
@@ -169,6 +197,7 @@ def validate_admin():
         admin = query_existing_user(admin_id)
         if admin:
             admin.validated = decision
+            bump_permission_version(admin)
             admin.approver_id = super_id
             admin.approve_time = datetime.utcnow()
             db.session.add(admin)
@@ -185,14 +214,19 @@ def validate_admin():
 def get_admins():
     """
     This API gets all admins in the DB
+    The optional 'limit' and 'cursor' args page through the list.
     """
     super_id = get_jwt_identity().get('id')
 
-    super = query_existing_user(super_id)
+    super = get_current_user()
 
     if current_app.config.get('SUPER_ID') and super.openid == current_app.config.get('SUPER_ID'):
-        admins = query_unrevoked_admins()
-        return jsonify(message=[admin.validate_info() for admin in admins]), 201
+        try:
+            cursor, limit = page_args(request.args)
+            admins, next_cursor = query_unrevoked_admins(cursor, limit)
+        except ValueError:
+            return jsonify(message="Invalid cursor or limit"), 400
+        return jsonify(message=[admin.validate_info() for admin in admins], next_cursor=next_cursor), 201
     else:
         return jsonify(message="What are you thinking?"), 201
 
@@ -3,6 +3,7 @@ from app.api import bluePrint
 from app.api.auth.auth_utils import jwt_roles_required
 from app.utils.utils import Roles
 from app.dbUtils.dbUtils import query_validated_user
+from app.utils.http_client import wechat_http
 
 
 @bluePrint.route('/util/coverpic', methods=['POST'])
@@ -12,3 +13,12 @@ def add_cover_pic():
     This API adds a cover picture.
     """
     return jsonify(message="Picture added"), 201
+
+
+@bluePrint.route('/util/outbound_metrics', methods=['GET'])
+@jwt_roles_required(Roles.ADMIN)
+def get_outbound_metrics():
+    """
+    This API returns the latency metrics and circuit states of the outbound wechat calls of this worker.
+    """
+    return jsonify(message=wechat_http.metrics_snapshot()), 200
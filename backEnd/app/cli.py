@@ -0,0 +1,76 @@
+import click
+
+from app.api.auth.auth_utils import prune_db
+from app import db
+from app.dbUtils.dbUtils import query_credit_mismatches, query_students_without_qr_code, rebuild_student_course_stats
+from app.utils.task_utils import schedule_prune_tokens, schedule_reconcile_credits, enqueue_student_qr_code, \
+    enqueue_rebuild_stats
+
+
+def register(app):
+    @app.cli.group()
+    def tokens():
+        """Token maintenance commands."""
+        pass
+
+    @tokens.command()
+    @click.option('--now', is_flag=True, help='Prune in this process instead of scheduling the rq job.')
+    def prune(now):
+        """Delete expired and long revoked tokens, or schedule the periodic prune job."""
+        if now:
+            deleted = prune_db(batch_size=app.config['TOKEN_PRUNE_BATCH_SIZE'],
+                               pause=app.config['TOKEN_PRUNE_BATCH_PAUSE'])
+            click.echo('Deleted %d tokens.' % deleted)
+        else:
+            schedule_prune_tokens(app, delay=0)
+            click.echo('Token prune job scheduled.')
+
+    @app.cli.group()
+    def credits():
+        """Course credit maintenance commands."""
+        pass
+
+    @credits.command()
+    @click.option('--now', is_flag=True, help='Reconcile in this process instead of scheduling the rq job.')
+    def reconcile(now):
+        """Check the course credit balances against the credit ledger, or schedule the periodic reconcile job."""
+        if now:
+            mismatches = query_credit_mismatches()
+            for student_id, course_id, balance, ledger in mismatches:
+                click.echo('student %s course %s: balance %s, ledger %s' % (student_id, course_id, balance, ledger))
+            click.echo('%d mismatches.' % len(mismatches))
+        else:
+            schedule_reconcile_credits(app, delay=0)
+            click.echo('Credit reconcile job scheduled.')
+
+    @app.cli.group()
+    def students():
+        """Student maintenance commands."""
+        pass
+
+    @students.command('qr-codes')
+    def qr_codes():
+        """Enqueue the QR code generation of every student that has no QR code yet."""
+        student_ids = query_students_without_qr_code()
+        for student_id in student_ids:
+            enqueue_student_qr_code(app, student_id)
+        click.echo('%d QR code jobs enqueued.' % len(student_ids))
+
+    @app.cli.group()
+    def stats():
+        """Student course statistics commands."""
+        pass
+
+    @stats.command()
+    @click.option('--now', is_flag=True, help='Rebuild in this process instead of enqueuing the rq job.')
+    def rebuild(now):
+        """Build the student course statistics again from history, or enqueue the rebuild job."""
+        if now:
+            rows = rebuild_student_course_stats()
+            db.session.commit()
+            click.echo('Rebuilt %d statistics rows.' % rows)
+        else:
+            if enqueue_rebuild_stats(app):
+                click.echo('Statistics rebuild job enqueued.')
+            else:
+                click.echo('A statistics rebuild job is already pending.')
@@ -1,6 +1,183 @@
-from app.models import Teaching, User, Course, CourseCredit, ParentHood, Student, TakingClass, ClassSession
-from app.utils.utils import Roles, VALIDATIONS
+import base64
+import hashlib
+import heapq
+import json
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import islice
+from uuid import uuid4
+
+from app.models import Teaching, User, Course, CourseCredit, ParentHood, Student, TakingClass, ClassSession, \
+    ClassSeries, TakingSeries, SeriesException, CreditTransaction, StudentCourseStat
+from app.utils.recurrence_utils import expand_rule, to_naive_utc, parse_occurrence_id, weekly_rule, \
+    utc_offset_minutes, occurrence_id, shift_rule_weekdays
+from app.utils.utils import Roles, VALIDATIONS, CreditKinds
+from app.utils.etag_utils import mark_tables_changed
+from app.utils.interval_utils import find_overlaps
+from app.utils.search_utils import search_indexes, EXACT_MATCH, PREFIX_MATCH, SUBSTRING_MATCH
 from app import db
+from sqlalchemy import or_, and_, func, text, literal, case, DATETIME
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, load_only
+
+
+# Loads the course name and the attendance teacher name that ClassSession.to_dict uses in the same query,
+# instead of one lazy load per session.
+CLASS_SESSION_LOAD_OPTIONS = (
+    joinedload(ClassSession.course).load_only('name'),
+    joinedload(ClassSession.attendance_teacher).load_only('real_name'),
+)
+
+
+def encode_cursor(values):
+    """
+    This function encodes the key values of the last item of a page into an opaque cursor string.
+    """
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, key_columns):
+    """
+    This function decodes a cursor made by encode_cursor. A ValueError is raised for an invalid cursor.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(key_columns):
+            raise ValueError('Invalid cursor')
+        return [datetime.fromisoformat(value) if isinstance(column.type, DATETIME) else value
+                for column, value in zip(key_columns, values)]
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError('Invalid cursor')
+
+
+# The columns the long lists select instead of whole ORM objects. Building the objects and adding them to the
+# identity map costs more CPU than the query itself for these lists, and the rows are only serialized.
+STUDENT_LIST_COLUMNS = (Student.id, Student.real_name, Student.gender, Student.dob)
+COURSE_LIST_COLUMNS = (Course.id, Course.name)
+USER_VALIDATE_INFO_COLUMNS = (User.id, User.phone, User.nick_name, User.real_name, User.roles, User.validated,
+                              User.register_time)
+
+STREAM_BATCH_SIZE = 500  # Rows fetched at a time when a query result is streamed with yield_per
+
+
+def keyset_paginate(query, key_columns, key_of, cursor=None, limit=None, stream=False):
+    """
+    This function orders the query by the key columns and returns (items, next_cursor).
+    With a cursor, only the items after the cursor's key are returned. With a limit, at most limit items are
+    returned and next_cursor is set if there are more. Without a limit all the remaining items are returned.
+    key_of(item) returns the key values of an item, in the order of key_columns.
+    With stream and no limit, the items are returned as a lazy iterator reading STREAM_BATCH_SIZE rows at a time.
+    """
+    query = query.order_by(*key_columns)
+    if cursor:
+        values = decode_cursor(cursor, key_columns)
+        # (a, b) > (x, y) written out, since not every DB supports row value comparison.
+        conditions = []
+        for i, column in enumerate(key_columns):
+            equal_before = [key_columns[j] == values[j] for j in range(i)]
+            conditions.append(and_(*(equal_before + [column > values[i]])))
+        query = query.filter(or_(*conditions))
+    if limit is None:
+        if stream:
+            return query.yield_per(STREAM_BATCH_SIZE), None
+        return query.all(), None
+
+    items = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(key_of(items[-1]))
+    return items, next_cursor
+
+
+SESSION_PAGE_KEY = [ClassSession.start_time, ClassSession.id]
+# A cursor into a list of sessions and occurrences: the start time, then the session id of a ClassSession row
+# or the series id of an occurrence that has no row yet.
+SESSION_LIST_KEY = [ClassSession.start_time, ClassSession.id, ClassSeries.id]
+# The kinds of items in a list of sessions, a ClassSession row comes before an occurrence at the same time.
+SESSION_ROW = 0
+SERIES_OCCURRENCE = 1
+
+
+def _session_key(class_session):
+    return class_session.start_time, SESSION_ROW, class_session.id
+
+
+def _occurrence_key(occurrence):
+    series, _, occurrence_time = occurrence
+    return occurrence_time, SERIES_OCCURRENCE, series.id
+
+
+def decode_session_cursor(cursor):
+    """
+    This function decodes a cursor of a list of sessions and occurrences into the key of the last item of the page.
+    A ValueError is raised for an invalid cursor.
+    """
+    start_time, session_id, series_id = decode_cursor(cursor, SESSION_LIST_KEY)
+    if isinstance(session_id, int) and series_id is None:
+        return start_time, SESSION_ROW, session_id
+    if isinstance(series_id, str) and session_id is None:
+        return start_time, SERIES_OCCURRENCE, series_id
+    raise ValueError('Invalid cursor')
+
+
+def session_list_page(query, series_of, start_time_utc, end_time_utc, cursor=None, limit=None, stream=False):
+    """
+    This function merges the class sessions of the query with the occurrences of lazily expanded series that have
+    no ClassSession row yet, and returns (sessions, next_cursor) with the sessions in the format of
+    ClassSession.to_dict, in start time order. series_of(start, end) returns the (series, course name) pairs
+    that have occurrences within a time frame. With a limit, at most limit sessions and occurrences together
+    are returned, and the cursor is after the last of either. With stream and no limit, the sessions are returned
+    as a lazy iterator reading STREAM_BATCH_SIZE rows at a time.
+    """
+    query = query.order_by(*SESSION_PAGE_KEY)
+    after = None
+    if cursor:
+        after = decode_session_cursor(cursor)
+        start_time_utc, kind, item_id = after
+        if kind == SESSION_ROW:
+            query = query.filter(or_(ClassSession.start_time > start_time_utc,
+                                     and_(ClassSession.start_time == start_time_utc, ClassSession.id > item_id)))
+        else:
+            query = query.filter(ClassSession.start_time > start_time_utc)
+
+    if limit is None:
+        class_sessions = query.yield_per(STREAM_BATCH_SIZE) if stream else query.all()
+        window_end = end_time_utc
+    else:
+        class_sessions = query.limit(limit + 1).all()
+        # The occurrences after the first session that is left out can not be on this page.
+        window_end = class_sessions[limit].start_time if len(class_sessions) > limit else end_time_utc
+    occurrences = sorted((occurrence for occurrence in expand_series(series_of(start_time_utc, window_end),
+                                                                     start_time_utc, window_end)
+                          if after is None or _occurrence_key(occurrence) > after), key=_occurrence_key)
+    items = heapq.merge(((_session_key(class_session), class_session) for class_session in class_sessions),
+                        ((_occurrence_key(occurrence), occurrence) for occurrence in occurrences),
+                        key=lambda item: item[0])
+
+    def to_dict(item):
+        key, value = item
+        if key[1] == SESSION_ROW:
+            return value.to_dict()
+        series, course_name, occurrence_time = value
+        return series.occurrence_dict(occurrence_time, course_name)
+
+    if limit is None:
+        if stream:
+            return (to_dict(item) for item in items), None
+        return [to_dict(item) for item in items], None
+    page = list(islice(items, limit + 1))
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        start_time, kind, item_id = page[-1][0]
+        next_cursor = encode_cursor([start_time, item_id if kind == SESSION_ROW else None,
+                                     item_id if kind == SERIES_OCCURRENCE else None])
+    return [to_dict(item) for item in page], next_cursor
 
 
 def query_existing_user(user_id):
@@ -22,12 +199,12 @@ def query_validated_user(user_id):
         return None
 
 
-def query_unvalidated_users():
+def query_unvalidated_users(cursor=None, limit=None):
     """
-    This function retrieves all existing but unvalidated users.
+    This function retrieves all existing but unvalidated users, a page at a time, see keyset_paginate.
     """
-    users = User.query.filter(User.deleted == False).filter(User.validated == False).all()
-    return users
+    query = User.query.filter(User.deleted == False).filter(User.validated == False)
+    return keyset_paginate(query, [User.id], lambda user: [user.id], cursor, limit)
 
 
 def query_existing_student(student_id):
@@ -38,12 +215,48 @@ def query_existing_student(student_id):
     return student
 
 
-def query_all_existing_students():
+def query_student_qr_code_etag(student_id):
     """
-    This function returns all undeleted students in the DB
+    This function returns the (id, qr_code_etag) row of an existing student without loading the QR code image,
+    or None if there is no such student. The etag is None while the image is not generated.
     """
-    students = Student.query.filter(Student.deleted == False).all()
-    return students
+    return db.session.query(Student.id, Student.qr_code_etag).filter(Student.deleted == False)\
+        .filter(Student.id == student_id).first()
+
+
+def query_student_qr_code(student_id):
+    """
+    This function returns the QR code image bytes of an existing student, or None.
+    """
+    return db.session.query(Student.qr_code).filter(Student.deleted == False)\
+        .filter(Student.id == student_id).scalar()
+
+
+def store_student_qr_code(student_id, image):
+    """
+    This function stores a generated QR code image and its etag for the student, and returns the etag.
+    """
+    etag = hashlib.sha1(image).hexdigest()
+    Student.query.filter(Student.id == student_id)\
+        .update({Student.qr_code: image, Student.qr_code_etag: etag}, synchronize_session=False)
+    return etag
+
+
+def query_students_without_qr_code():
+    """
+    This function returns the ids of the existing students whose QR code is not generated yet.
+    """
+    rows = db.session.query(Student.id).filter(Student.deleted == False).filter(Student.qr_code_etag == None).all()
+    return [student_id for student_id, in rows]
+
+
+def query_all_existing_students(cursor=None, limit=None, stream=False):
+    """
+    This function returns all undeleted students in the DB, a page at a time, see keyset_paginate.
+    The students are rows of STUDENT_LIST_COLUMNS, to be serialized with Student.dict_of.
+    """
+    query = db.session.query(*STUDENT_LIST_COLUMNS).filter(Student.deleted == False)
+    return keyset_paginate(query, [Student.id], lambda student: [student.id], cursor, limit, stream)
 
 
 def query_existing_phone_user(phone_number):
@@ -67,12 +280,13 @@ def query_existing_course(course_id):
     return course
 
 
-def query_existing_courses_all():
+def query_existing_courses_all(cursor=None, limit=None):
     """
-    This function returns all the existing courses in the DB.
+    This function returns all the existing courses in the DB, a page at a time, see keyset_paginate.
+    The courses are rows of COURSE_LIST_COLUMNS, to be serialized with Course.dict_of.
     """
-    courses = Course.query.filter(Course.deleted == False).all()
-    return courses
+    query = db.session.query(*COURSE_LIST_COLUMNS).filter(Course.deleted == False)
+    return keyset_paginate(query, [Course.id], lambda course: [course.id], cursor, limit)
 
 
 def query_existing_teacher(teacher_id):
@@ -84,12 +298,100 @@ def query_existing_teacher(teacher_id):
     return teacher
 
 
-def query_existing_teachers():
+def query_existing_teachers(cursor=None, limit=None, stream=False):
     """
-    This function retrieves all existing teachers.
+    This function retrieves all existing teachers, a page at a time, see keyset_paginate.
+    The teachers are rows of USER_VALIDATE_INFO_COLUMNS, to be serialized with User.validate_info_of.
     """
-    teachers = User.query.filter(User.deleted == False).filter(User.roles == Roles.TEACHER).all()
-    return teachers
+    query = db.session.query(*USER_VALIDATE_INFO_COLUMNS).filter(User.deleted == False)\
+        .filter(User.roles == Roles.TEACHER)
+    return keyset_paginate(query, [User.id], lambda teacher: [teacher.id], cursor, limit, stream)
+
+
+NGRAM_TOKEN_SIZE = 2  # MySQL's ngram_token_size, shorter queries can not use the full text index
+
+
+def _search_match_class(columns, query_text):
+    """
+    This function returns the SQL expression of the match class of a search result, see search_utils.
+    """
+    exact = or_(*[column == query_text for column in columns])
+    prefix = or_(*[column.startswith(query_text, autoescape=True) for column in columns])
+    return case([(exact, EXACT_MATCH), (prefix, PREFIX_MATCH)], else_=SUBSTRING_MATCH)
+
+
+def _fulltext_condition(columns, query_text):
+    """
+    This function returns the MySQL condition that finds the rows containing the query text
+    with the n-gram full text index on the columns.
+    """
+    if len(query_text) < NGRAM_TOKEN_SIZE:
+        return or_(*[column.startswith(query_text, autoescape=True) for column in columns])
+    # A quoted phrase matches the consecutive n-grams of the text, the boolean mode operators inside it are ignored.
+    phrase = '"%s"' % re.sub(r'["\\]', ' ', query_text)
+    names = ', '.join(str(column.expression) for column in columns)
+    return text('MATCH (%s) AGAINST (:search_phrase IN BOOLEAN MODE)' % names).bindparams(search_phrase=phrase)
+
+
+def _search_rows(query, columns, id_column, load_index, group, query_text, cursor, limit):
+    """
+    This function returns (rows, next_cursor) of a page of the rows of the query whose columns contain the query text.
+    The rows are ranked by match class (exact, prefix, then substring) and id.
+    MySQL finds them with its n-gram full text index, other DBs with the in-process index returned by load_index(),
+    which only gives the ids of the page, the rows are then read by id.
+    """
+    match_class = _search_match_class(columns, query_text)
+    key_columns = [match_class, id_column]
+    if db.session.get_bind().dialect.name == 'mysql':
+        query = query.add_columns(match_class.label('match_class')).filter(_fulltext_condition(columns, query_text))
+        return keyset_paginate(query, key_columns, lambda row: [row.match_class, row.id], cursor, limit)
+
+    after = decode_cursor(cursor, key_columns) if cursor else None
+    ranked = load_index().search(query_text, group, after, limit + 1)
+    next_cursor = encode_cursor(ranked[limit - 1]) if len(ranked) > limit else None
+    ranked = ranked[:limit]
+    if not ranked:
+        return [], None
+    rows = {row.id: row for row in query.filter(id_column.in_([doc_id for _, doc_id in ranked]))}
+    # A row deleted since the index was built is left out of the page.
+    return [rows[doc_id] for _, doc_id in ranked if doc_id in rows], next_cursor
+
+
+def _student_search_documents():
+    rows = db.session.query(Student.id, Student.real_name).filter(Student.deleted == False)\
+        .yield_per(STREAM_BATCH_SIZE)
+    return ((student_id, None, [real_name]) for student_id, real_name in rows)
+
+
+def _user_search_documents():
+    rows = db.session.query(User.id, User.roles, User.real_name, User.nick_name, User.phone)\
+        .filter(User.deleted == False).yield_per(STREAM_BATCH_SIZE)
+    return ((user_id, roles, [real_name, nick_name, phone]) for user_id, roles, real_name, nick_name, phone in rows)
+
+
+def search_students(query_text, cursor=None, limit=20):
+    """
+    This function returns (students, next_cursor) of a page of the undeleted students whose real_name contains
+    the query text, ranked by match class. The students are rows of STUDENT_LIST_COLUMNS.
+    """
+    query = db.session.query(*STUDENT_LIST_COLUMNS).filter(Student.deleted == False)
+    return _search_rows(query, [Student.real_name], Student.id,
+                        lambda: search_indexes.get('students', ['students'], _student_search_documents),
+                        None, query_text, cursor, limit)
+
+
+def search_users(query_text, role=None, cursor=None, limit=20):
+    """
+    This function returns (users, next_cursor) of a page of the undeleted users whose real_name, nick_name or phone
+    contains the query text, ranked by match class. With a role, only the users having exactly that role are searched.
+    The users are rows of USER_VALIDATE_INFO_COLUMNS.
+    """
+    query = db.session.query(*USER_VALIDATE_INFO_COLUMNS).filter(User.deleted == False)
+    if role is not None:
+        query = query.filter(User.roles == role)
+    return _search_rows(query, [User.real_name, User.nick_name, User.phone], User.id,
+                        lambda: search_indexes.get('users', ['users'], _user_search_documents),
+                        role, query_text, cursor, limit)
 
 
 def query_course_credit(course_id, student_id):
@@ -119,17 +421,19 @@ def query_existing_taking_class(class_session_id, student_id):
     return taking_class
 
 
-def query_teacher_class_sessions(start_time, end_time, teacher_id):
+def query_teacher_class_sessions(start_time, end_time, teacher_id, cursor=None, limit=None, stream=False):
     """
-    This function selects all the class session that a teacher is teaching, and within a certain time frame.
+    This function selects all the class session that a teacher is teaching, and within a certain time frame,
+    together with the occurrences of the teacher's lazily expanded series.
+    The sessions are returned a page at a time in start time order, see session_list_page.
     """
-    sessions = ClassSession.query.join(Teaching)\
+    query = ClassSession.query.join(Teaching).options(*CLASS_SESSION_LOAD_OPTIONS)\
         .filter(ClassSession.deleted == False)\
         .filter(Teaching.deleted == False)\
         .filter(ClassSession.id == Teaching.session_id)\
         .filter(ClassSession.start_time >= start_time, ClassSession.start_time <= end_time)\
-        .filter(Teaching.teacher_id == teacher_id).all()
-    return sessions
+        .filter(Teaching.teacher_id == teacher_id)
+    return session_list_page(query, partial(query_teacher_series, teacher_id), start_time, end_time, cursor, limit, stream)
 
 
 def query_class_session(session_id):
@@ -194,28 +498,82 @@ def query_student_credits_of_parent(student_id, parent_id):
     return course_credits
 
 
-def query_teacher_sessions(teacher_id, start_time_utc, end_time_utc):
+def query_parent_children_credits(parent_id):
     """
-    This function retrieves all the sessions that a teacher teaches within a time frame.
+    This function retrieves the children of a parent with the remaining credits of their courses, in one query.
+    A list of (student, course name, credit) is returned, with None for the course of a child without credits.
     """
-    sessions = db.session.query(ClassSession, Teaching).filter(ClassSession.deleted == False).\
+    credits = db.session.query(Student, Course.name, CourseCredit.credit)\
+        .options(load_only('id', 'real_name', 'gender', 'dob'))\
+        .join(ParentHood, ParentHood.student_id == Student.id)\
+        .outerjoin(CourseCredit, and_(CourseCredit.student_id == Student.id, CourseCredit.deleted == False))\
+        .outerjoin(Course, and_(Course.id == CourseCredit.course_id, Course.deleted == False))\
+        .filter(ParentHood.deleted == False, ParentHood.parent_id == parent_id)\
+        .filter(Student.deleted == False)\
+        .order_by(Student.id).all()
+    return credits
+
+
+def query_parent_children_sessions(parent_id, start_time_utc, end_time_utc):
+    """
+    This function retrieves the sessions of all the children of a parent within a time frame, in one query.
+    A list of (student id, class session, attended) in start time order is returned.
+    """
+    sessions = db.session.query(TakingClass.student_id, ClassSession, TakingClass.attended)\
+        .options(*CLASS_SESSION_LOAD_OPTIONS)\
+        .join(ClassSession, ClassSession.id == TakingClass.session_id)\
+        .join(ParentHood, ParentHood.student_id == TakingClass.student_id)\
+        .filter(ParentHood.deleted == False, ParentHood.parent_id == parent_id)\
+        .filter(TakingClass.deleted == False, ClassSession.deleted == False)\
+        .filter(ClassSession.start_time >= start_time_utc, ClassSession.start_time <= end_time_utc)\
+        .order_by(ClassSession.start_time, ClassSession.id).all()
+    return sessions
+
+
+def query_parent_children_series(parent_id, start_time_utc, end_time_utc):
+    """
+    This function retrieves the lazily expanded series all the children of a parent take, that have occurrences
+    within a time frame. A list of (series, course name, student id) is returned.
+    """
+    series = db.session.query(ClassSeries, Course.name, TakingSeries.student_id)\
+        .join(TakingSeries, TakingSeries.series_id == ClassSeries.id)\
+        .join(ParentHood, ParentHood.student_id == TakingSeries.student_id)\
+        .filter(Course.id == ClassSeries.course_id)\
+        .filter(ParentHood.deleted == False, ParentHood.parent_id == parent_id)\
+        .filter(TakingSeries.deleted == False, ClassSeries.deleted == False)\
+        .filter(ClassSeries.dtstart <= to_naive_utc(end_time_utc), ClassSeries.until >= to_naive_utc(start_time_utc)).all()
+    return series
+
+
+def query_teacher_sessions(teacher_id, start_time_utc, end_time_utc, cursor=None, limit=None):
+    """
+    This function retrieves all the sessions that a teacher teaches within a time frame,
+    together with the occurrences of the teacher's lazily expanded series.
+    The sessions are returned a page at a time in start time order, see session_list_page.
+    """
+    query = ClassSession.query.options(*CLASS_SESSION_LOAD_OPTIONS).\
+        filter(ClassSession.deleted == False).\
         filter(Teaching.deleted == False).\
         filter(Teaching.session_id == ClassSession.id).\
         filter(Teaching.teacher_id == teacher_id).\
-        filter(ClassSession.start_time >= start_time_utc, ClassSession.start_time <= end_time_utc).all()
-    return sessions
+        filter(ClassSession.start_time >= start_time_utc, ClassSession.start_time <= end_time_utc)
+    return session_list_page(query, partial(query_teacher_series, teacher_id), start_time_utc, end_time_utc, cursor, limit)
 
 
-def query_student_sessions(student_id, start_time_utc, end_time_utc):
+def query_student_sessions(student_id, start_time_utc, end_time_utc, stream=False):
     """
     This function retrieves all the sessions that a student registered within a time frame.
+    With stream, the sessions are returned in start time order as a lazy iterator instead of a list.
     """
-    sessions = db.session.query(ClassSession, TakingClass).filter(ClassSession.deleted == False).\
+    query = db.session.query(ClassSession, TakingClass).options(*CLASS_SESSION_LOAD_OPTIONS).\
+        filter(ClassSession.deleted == False).\
         filter(TakingClass.deleted == False).\
         filter(TakingClass.session_id == ClassSession.id).\
         filter(TakingClass.student_id == student_id).\
-        filter(ClassSession.start_time >= start_time_utc, ClassSession.start_time <= end_time_utc).all()
-    return sessions
+        filter(ClassSession.start_time >= start_time_utc, ClassSession.start_time <= end_time_utc)
+    if stream:
+        return query.order_by(ClassSession.start_time, ClassSession.id).yield_per(STREAM_BATCH_SIZE)
+    return query.all()
 
 
 def query_taking_class(student_id, session_id):
@@ -227,12 +585,12 @@ def query_taking_class(student_id, session_id):
     return taking_class
 
 
-def query_unvalidated_parents():
+def query_unvalidated_parents(cursor=None, limit=None):
     """
-    This function retrieves all existing but unvalidated parents.
+    This function retrieves all existing but unvalidated parents, a page at a time, see keyset_paginate.
     """
-    parents = User.query.filter(User.deleted == False).filter(User.validated == False).filter(User.roles == Roles.PARENT).all()
-    return parents
+    query = User.query.filter(User.deleted == False).filter(User.validated == False).filter(User.roles == Roles.PARENT)
+    return keyset_paginate(query, [User.id], lambda parent: [parent.id], cursor, limit)
 
 
 def query_parent_hood(parent_id, student_id):
@@ -244,12 +602,12 @@ def query_parent_hood(parent_id, student_id):
     return parent_hood
 
 
-def query_unrevoked_admins():
+def query_unrevoked_admins(cursor=None, limit=None):
     """
-    This function retrieves all the unrevoked admins
+    This function retrieves all the unrevoked admins, a page at a time, see keyset_paginate.
     """
-    admins = User.query.filter(User.deleted == False).filter(User.roles == Roles.ADMIN).filter(User.validated != VALIDATIONS.REVOKED).all()
-    return admins
+    query = User.query.filter(User.deleted == False).filter(User.roles == Roles.ADMIN).filter(User.validated != VALIDATIONS.REVOKED)
+    return keyset_paginate(query, [User.id], lambda admin: [admin.id], cursor, limit)
 
 
 def query_parent_students(parent_id):
@@ -262,6 +620,820 @@ def query_parent_students(parent_id):
         filter(ParentHood.parent_id == parent_id).all()
     return students
 
+
+BULK_CHUNK_SIZE = 500  # Rows sent per executemany in the bulk insert functions
+
+
+def _bulk_insert(table, rows):
+    """
+    This function inserts the rows (a list of dicts) into the table with one executemany per chunk.
+    """
+    for i in range(0, len(rows), BULK_CHUNK_SIZE):
+        db.session.execute(table.insert(), rows[i:i + BULK_CHUNK_SIZE])
+    if rows:
+        mark_tables_changed(table.name)
+
+
+def _bulk_upsert_add(table, rows, key_columns, add_columns):
+    """
+    This function inserts the rows (a list of dicts) into the table, a row whose key already exists is added to
+    the existing row instead: the values of add_columns are added to the existing values.
+    It is used for rows that concurrent transactions may insert at the same time, so a duplicate key can not fail
+    the transaction. On MySQL each chunk is one INSERT ... ON DUPLICATE KEY UPDATE col = col + VALUES(col).
+    Other DBs insert each chunk in a savepoint and, on a duplicate key, update or insert its rows one by one.
+    """
+    mysql = db.session.get_bind().dialect.name == 'mysql'
+    for i in range(0, len(rows), BULK_CHUNK_SIZE):
+        chunk = rows[i:i + BULK_CHUNK_SIZE]
+        if mysql:
+            statement = mysql_insert(table)
+            statement = statement.on_duplicate_key_update({column: table.c[column] + statement.inserted[column]
+                                                           for column in add_columns})
+            db.session.execute(statement, chunk)
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert(), chunk)
+        except IntegrityError:
+            for row in chunk:
+                updated = db.session.execute(
+                    table.update().where(and_(*(table.c[column] == row[column] for column in key_columns)))
+                    .values({column: table.c[column] + row[column] for column in add_columns})).rowcount
+                if not updated:
+                    db.session.execute(table.insert(), [row])
+    if rows:
+        mark_tables_changed(table.name)
+
+
+def month_of(time):
+    """
+    This function returns the yyyymm month of a datetime, as stored in the student course statistics.
+    """
+    return time.year * 100 + time.month
+
+
+def _new_stats():
+    # Deltas of (student_id, course_id, month) as [scheduled, attended, credits_charged].
+    return defaultdict(lambda: [0, 0, 0])
+
+
+def _taking_class_stats(*conditions):
+    """
+    This function returns the statistics of the undeleted taking class rows of the undeleted class sessions
+    matching the conditions, as deltas for _add_student_course_stats. Credits come from the attendance calls only.
+    """
+    stats = _new_stats()
+    rows = db.session.query(TakingClass.student_id, ClassSession.course_id, ClassSession.start_time,
+                            TakingClass.attended)\
+        .join(ClassSession, TakingClass.session_id == ClassSession.id)\
+        .filter(TakingClass.deleted == False, ClassSession.deleted == False).filter(*conditions)\
+        .yield_per(STREAM_BATCH_SIZE)
+    for student_id, course_id, start_time, attended in rows:
+        delta = stats[(student_id, course_id, month_of(start_time))]
+        delta[0] += 1
+        if attended:
+            delta[1] += 1
+    return stats
+
+
+def _stats_difference(after, before):
+    stats = _new_stats()
+    for key, delta in after.items():
+        stats[key] = list(delta)
+    for key, delta in before.items():
+        stats[key] = [value - old for value, old in zip(stats[key], delta)]
+    return stats
+
+
+def _add_student_course_stats(stats):
+    """
+    This function adds deltas to the monthly student course statistics, stats maps (student_id, course_id, month)
+    to [scheduled, attended, credits_charged]. The existing rows are updated with one UPDATE per course, month and
+    delta, so the students of an attendance call or an enrollment take a few statements, the missing rows are inserted
+    with an upsert, since another transaction may insert the same rows meanwhile.
+    The caller commits, so the statistics change in the same transaction as the rows they count.
+    """
+    stats = {key: delta for key, delta in stats.items() if any(delta)}
+    if not stats:
+        return
+    existing = set(tuple(row) for row in db.session.query(StudentCourseStat.student_id, StudentCourseStat.course_id,
+                                                          StudentCourseStat.month)
+                   .filter(StudentCourseStat.student_id.in_(set(key[0] for key in stats)),
+                           StudentCourseStat.course_id.in_(set(key[1] for key in stats)),
+                           StudentCourseStat.month.in_(set(key[2] for key in stats))))
+
+    groups = defaultdict(list)
+    for (student_id, course_id, month), delta in stats.items():
+        if (student_id, course_id, month) in existing:
+            groups[(course_id, month, tuple(delta))].append(student_id)
+    for (course_id, month, (scheduled, attended, credits_charged)), student_ids in groups.items():
+        StudentCourseStat.query.filter(StudentCourseStat.course_id == course_id, StudentCourseStat.month == month,
+                                       StudentCourseStat.student_id.in_(student_ids))\
+            .update({StudentCourseStat.scheduled: StudentCourseStat.scheduled + scheduled,
+                     StudentCourseStat.attended: StudentCourseStat.attended + attended,
+                     StudentCourseStat.credits_charged: StudentCourseStat.credits_charged + credits_charged},
+                    synchronize_session=False)
+
+    _bulk_upsert_add(StudentCourseStat.__table__, [
+        {'student_id': student_id, 'course_id': course_id, 'month': month,
+         'scheduled': delta[0], 'attended': delta[1], 'credits_charged': delta[2]}
+        for (student_id, course_id, month), delta in stats.items() if (student_id, course_id, month) not in existing],
+        ('student_id', 'course_id', 'month'), ('scheduled', 'attended', 'credits_charged'))
+
+
+def insert_class_series(series_id, course_id, start_times_utc, duration, info, teacher_id, student_ids):
+    """
+    This function inserts all the sessions of a recurring series, with their teaching and taking class rows,
+    using bulk inserts instead of one ORM object per row.
+    The new session ids are read back with one query on the series_id.
+    The caller commits. The session ids are returned in start time order.
+    """
+    _bulk_insert(ClassSession.__table__, [{
+        'series_id': series_id,
+        'course_id': course_id,
+        'start_time': start_time_utc,
+        'duration': duration,
+        'info': info
+    } for start_time_utc in start_times_utc])
+
+    session_ids = [session_id for session_id, in db.session.query(ClassSession.id)
+                   .filter(ClassSession.series_id == series_id)
+                   .order_by(ClassSession.start_time, ClassSession.id)]
+
+    _bulk_insert(Teaching.__table__, [{'session_id': session_id, 'teacher_id': teacher_id}
+                                      for session_id in session_ids])
+    if student_ids:
+        _bulk_insert(TakingClass.__table__, [{'session_id': session_id, 'student_id': student_id}
+                                             for session_id in session_ids for student_id in student_ids])
+        _add_student_course_stats(_taking_class_stats(ClassSession.series_id == series_id))
+    return session_ids
+
+
+def enroll_students(session_ids, student_ids, comments):
+    """
+    This function enrolls the students into the class sessions, with the same comments for every taking class row.
+    The existing rows of all the pairs are read with one query and updated with one statement (which also restores
+    soft deleted rows), the missing ones are inserted in batches. The caller commits, so it is all one transaction.
+    The number of inserted rows is returned.
+    """
+    session_ids = list(set(session_ids))
+    student_ids = list(set(student_ids))
+    if not session_ids or not student_ids:
+        return 0
+
+    existing = set()
+    restored = []
+    sessions = {}
+    for i in range(0, len(session_ids), BULK_CHUNK_SIZE):
+        chunk = session_ids[i:i + BULK_CHUNK_SIZE]
+        sessions.update((session_id, (course_id, start_time)) for session_id, course_id, start_time in
+                        db.session.query(ClassSession.id, ClassSession.course_id, ClassSession.start_time)
+                        .filter(ClassSession.id.in_(chunk), ClassSession.deleted == False))
+        found = db.session.query(TakingClass.session_id, TakingClass.student_id, TakingClass.deleted,
+                                 TakingClass.attended)\
+            .filter(TakingClass.session_id.in_(chunk), TakingClass.student_id.in_(student_ids)).all()
+        if found:
+            existing.update((session_id, student_id) for session_id, student_id, _, _ in found)
+            restored.extend((session_id, student_id, attended) for session_id, student_id, deleted, attended in found
+                            if deleted)
+            TakingClass.query.filter(TakingClass.session_id.in_(chunk), TakingClass.student_id.in_(student_ids))\
+                .update({TakingClass.comments: comments, TakingClass.deleted: False}, synchronize_session=False)
+
+    rows = [{'session_id': session_id, 'student_id': student_id, 'comments': comments}
+            for session_id in session_ids for student_id in student_ids
+            if (session_id, student_id) not in existing]
+    _bulk_insert(TakingClass.__table__, rows)
+
+    # Only the restored and the inserted rows are new to the statistics.
+    stats = _new_stats()
+    for session_id, student_id, attended in restored + [(row['session_id'], row['student_id'], False) for row in rows]:
+        if session_id in sessions:
+            course_id, start_time = sessions[session_id]
+            delta = stats[(student_id, course_id, month_of(start_time))]
+            delta[0] += 1
+            if attended:
+                delta[1] += 1
+    _add_student_course_stats(stats)
+    return len(rows)
+
+
+def _locked_course_credit(student_id, course_id, operator_id, now):
+    """
+    This function returns the credit row of a student's course, locked until the end of the transaction.
+    A missing row is created at 0, a soft deleted one is restarted at 0 with an adjustment in the ledger.
+    """
+    course_credit = CourseCredit.query.filter(CourseCredit.student_id == student_id)\
+        .filter(CourseCredit.course_id == course_id).with_for_update().first()
+    if course_credit is None:
+        course_credit = CourseCredit(student_id=student_id, course_id=course_id, credit=0, deleted=False)
+        db.session.add(course_credit)
+    elif course_credit.deleted:
+        db.session.add(CreditTransaction(student_id=student_id, course_id=course_id, kind=CreditKinds.ADJUSTMENT,
+                                         amount=-(course_credit.credit or 0), balance=0, operator_id=operator_id,
+                                         create_time=now, comments='Restart of a deleted course credit'))
+        course_credit.credit = 0
+        course_credit.deleted = False
+    return course_credit
+
+
+def _add_credit_transaction(course_credit, amount, kind, operator_id, comments, now):
+    course_credit.credit = (course_credit.credit or 0) + amount
+    db.session.add(CreditTransaction(student_id=course_credit.student_id, course_id=course_credit.course_id,
+                                     kind=kind, amount=amount, balance=course_credit.credit, operator_id=operator_id,
+                                     create_time=now, comments=comments))
+    return course_credit
+
+
+def change_course_credit(student_id, course_id, amount, kind, operator_id=None, comments=None):
+    """
+    This function adds amount (negative for a charge) to the credit balance of a student's course,
+    and records the change in the credit ledger. The caller commits, so both are in the same transaction.
+    The course credit is returned.
+    """
+    now = datetime.utcnow()
+    course_credit = _locked_course_credit(student_id, course_id, operator_id, now)
+    return _add_credit_transaction(course_credit, amount, kind, operator_id, comments, now)
+
+
+def set_course_credit(student_id, course_id, credit, operator_id=None, comments=None):
+    """
+    This function sets the credit balance of a student's course, recording the difference as an adjustment.
+    The caller commits.
+    """
+    now = datetime.utcnow()
+    course_credit = _locked_course_credit(student_id, course_id, operator_id, now)
+    return _add_credit_transaction(course_credit, credit - (course_credit.credit or 0), CreditKinds.ADJUSTMENT,
+                                   operator_id, comments, now)
+
+
+def query_credit_statement(student_id, course_id, start_time_utc, end_time_utc):
+    """
+    This function retrieves the credit transactions of a student's course within a time frame, and the balance
+    before the first of them. Both are range scans of the (student_id, course_id, create_time) index.
+    """
+    start_naive = to_naive_utc(start_time_utc)
+    end_naive = to_naive_utc(end_time_utc)
+    query = CreditTransaction.query.filter(CreditTransaction.student_id == student_id)\
+        .filter(CreditTransaction.course_id == course_id)
+    previous = query.filter(CreditTransaction.create_time < start_naive)\
+        .order_by(CreditTransaction.create_time.desc(), CreditTransaction.id.desc()).first()
+    transactions = query.filter(CreditTransaction.create_time >= start_naive, CreditTransaction.create_time <= end_naive)\
+        .order_by(CreditTransaction.create_time, CreditTransaction.id).all()
+    return (previous.balance if previous else 0), transactions
+
+
+def query_credits_used(start_time_utc, end_time_utc):
+    """
+    This function sums the attendance charges of every student's courses within a time frame,
+    e.g. the credits used in a month. A list of (student_id, student name, course name, credits used) is returned.
+    """
+    used = db.session.query(CreditTransaction.student_id, Student.real_name, Course.name,
+                            -func.sum(CreditTransaction.amount))\
+        .filter(CreditTransaction.create_time >= to_naive_utc(start_time_utc),
+                CreditTransaction.create_time <= to_naive_utc(end_time_utc))\
+        .filter(CreditTransaction.kind == CreditKinds.ATTENDANCE)\
+        .filter(Student.id == CreditTransaction.student_id)\
+        .filter(Course.id == CreditTransaction.course_id)\
+        .group_by(CreditTransaction.student_id, Student.real_name, CreditTransaction.course_id, Course.name).all()
+    return used
+
+
+def query_credit_mismatches():
+    """
+    This function finds the course credits whose balance is not the sum of their ledger transactions.
+    A list of (student_id, course_id, balance, ledger sum) is returned.
+    """
+    ledger = db.session.query(CreditTransaction.student_id, CreditTransaction.course_id,
+                              func.sum(CreditTransaction.amount).label('total'))\
+        .group_by(CreditTransaction.student_id, CreditTransaction.course_id).subquery()
+    total = func.coalesce(ledger.c.total, 0)
+    mismatches = db.session.query(CourseCredit.student_id, CourseCredit.course_id, CourseCredit.credit, total)\
+        .outerjoin(ledger, and_(ledger.c.student_id == CourseCredit.student_id,
+                                ledger.c.course_id == CourseCredit.course_id))\
+        .filter(func.coalesce(CourseCredit.credit, 0) != total).all()
+    return mismatches
+
+
+def record_attendance(class_session, teacher_id, students):
+    """
+    This function records the attendance call of a class session and deducts one credit of the session's course
+    from every student in the call, with a fixed number of statements whatever the number of students.
+    students is a list of {"student_id": 1, "attended": true}, the attended students are marked in their taking
+    class rows (which are added if missing).
+    The session is claimed first with a conditional UPDATE, so when two calls for the same session race, the second
+    one waits for the first to commit and then finds the session already called. False is returned in that case
+    and nothing is changed. The caller commits, so it is all one transaction.
+    """
+    claimed = ClassSession.query.filter(ClassSession.id == class_session.id)\
+        .filter(or_(ClassSession.attendance_call == False, ClassSession.attendance_call == None))\
+        .update({ClassSession.attendance_call: True,
+                 ClassSession.attendance_teacher_id: teacher_id,
+                 ClassSession.attendance_time: datetime.utcnow()}, synchronize_session=False)
+    if not claimed:
+        return False
+
+    student_ids = list(set(student.get('student_id') for student in students))
+    attended_ids = list(set(student.get('student_id') for student in students if student.get('attended')))
+    course_id = class_session.course_id
+    now = datetime.utcnow()
+    stats = _new_stats()
+    month = month_of(class_session.start_time)
+
+    if student_ids:
+        credits = {student_id: (deleted, credit) for student_id, deleted, credit in
+                   db.session.query(CourseCredit.student_id, CourseCredit.deleted, CourseCredit.credit)
+                   .filter(CourseCredit.course_id == course_id, CourseCredit.student_id.in_(student_ids))}
+        # The decrement is done by the DB, so concurrent calls of other sessions can not lose an update.
+        if any(not deleted for deleted, _ in credits.values()):
+            CourseCredit.query.filter(CourseCredit.course_id == course_id, CourseCredit.student_id.in_(student_ids))\
+                .filter(CourseCredit.deleted == False)\
+                .update({CourseCredit.credit: CourseCredit.credit - 1}, synchronize_session=False)
+        # A soft deleted credit row starts again from nothing, like a missing one.
+        deleted_ids = [student_id for student_id, (deleted, _) in credits.items() if deleted]
+        if deleted_ids:
+            CourseCredit.query.filter(CourseCredit.course_id == course_id, CourseCredit.student_id.in_(deleted_ids))\
+                .update({CourseCredit.credit: -1, CourseCredit.deleted: False}, synchronize_session=False)
+        # A missing row can be inserted meanwhile by a call of another session, then the credit is deducted from it.
+        _bulk_upsert_add(CourseCredit.__table__, [{'student_id': student_id, 'course_id': course_id, 'credit': -1}
+                                                  for student_id in student_ids if student_id not in credits],
+                         ('student_id', 'course_id'), ('credit',))
+
+        # The new balances are read back while the UPDATE still holds the rows, and go into the ledger.
+        balances = dict(db.session.query(CourseCredit.student_id, CourseCredit.credit)
+                        .filter(CourseCredit.course_id == course_id, CourseCredit.student_id.in_(student_ids)))
+        transactions = [{'student_id': student_id, 'course_id': course_id, 'kind': CreditKinds.ADJUSTMENT,
+                         'amount': -(credits[student_id][1] or 0), 'balance': 0, 'operator_id': teacher_id,
+                         'create_time': now, 'comments': 'Restart of a deleted course credit'}
+                        for student_id in deleted_ids]
+        transactions.extend({'student_id': student_id, 'course_id': course_id, 'kind': CreditKinds.ATTENDANCE,
+                             'amount': -1, 'balance': balances[student_id], 'session_id': class_session.id,
+                             'operator_id': teacher_id, 'create_time': now, 'comments': None}
+                            for student_id in student_ids)
+        _bulk_insert(CreditTransaction.__table__, transactions)
+        for student_id in student_ids:
+            stats[(student_id, course_id, month)][2] += 1
+
+    if attended_ids:
+        existing = {student_id: (deleted, attended) for student_id, deleted, attended in
+                    db.session.query(TakingClass.student_id, TakingClass.deleted, TakingClass.attended)
+                    .filter(TakingClass.session_id == class_session.id, TakingClass.student_id.in_(attended_ids))}
+        if existing:
+            TakingClass.query.filter(TakingClass.session_id == class_session.id, TakingClass.student_id.in_(existing))\
+                .update({TakingClass.attended: True, TakingClass.deleted: False}, synchronize_session=False)
+        _bulk_insert(TakingClass.__table__, [{'session_id': class_session.id, 'student_id': student_id, 'attended': True}
+                                             for student_id in attended_ids if student_id not in existing])
+        for student_id in attended_ids:
+            deleted, attended = existing.get(student_id, (True, False))
+            delta = stats[(student_id, course_id, month)]
+            if deleted:
+                # A new or restored row is also a newly scheduled session.
+                delta[0] += 1
+            if deleted or not attended:
+                delta[1] += 1
+    _add_student_course_stats(stats)
+    return True
+
+
+def enroll_series_students(series_id, student_ids):
+    """
+    This function makes the students take the future occurrences of a lazily expanded series that are not
+    materialized yet, restoring soft deleted rows. The caller commits.
+    """
+    student_ids = list(set(student_ids))
+    existing = set(student_id for student_id, in db.session.query(TakingSeries.student_id)
+                   .filter(TakingSeries.series_id == series_id, TakingSeries.student_id.in_(student_ids)))
+    if existing:
+        TakingSeries.query.filter(TakingSeries.series_id == series_id, TakingSeries.student_id.in_(existing))\
+            .update({TakingSeries.deleted: False}, synchronize_session=False)
+    _bulk_insert(TakingSeries.__table__, [{'series_id': series_id, 'student_id': student_id}
+                                          for student_id in student_ids if student_id not in existing])
+
+
+def query_series_session_ids(series_id):
+    """
+    This function retrieves the ids of all the existing class sessions of a series,
+    both the ones inserted with the series and the materialized occurrences of a lazily expanded one.
+    """
+    return [session_id for session_id, in db.session.query(ClassSession.id)
+            .filter(ClassSession.deleted == False).filter(ClassSession.series_id == series_id)]
+
+
+def query_existing_class_series(series_id):
+    """
+    This function retrieves an undeleted lazily expanded series.
+    """
+    return ClassSeries.query.filter(ClassSeries.deleted == False).filter(ClassSeries.id == series_id).first()
+
+
+def insert_lazy_class_series(series_id, course_id, start_time_local, end_time_local, repeat_wkdays, duration, info,
+                             teacher_id, student_ids):
+    """
+    This function stores a weekly series as one ClassSeries rule and its students, without any ClassSession row.
+    The caller commits.
+    """
+    series = ClassSeries(id=series_id, course_id=course_id, teacher_id=teacher_id, rrule=weekly_rule(repeat_wkdays),
+                         dtstart=to_naive_utc(start_time_local), until=to_naive_utc(end_time_local),
+                         tz_offset=utc_offset_minutes(start_time_local), duration=duration, info=info,
+                         create_time=datetime.utcnow())
+    db.session.add(series)
+    if student_ids:
+        _bulk_insert(TakingSeries.__table__, [{'series_id': series_id, 'student_id': student_id}
+                                              for student_id in student_ids])
+    return series
+
+
+def query_teacher_series(teacher_id, start_time_utc, end_time_utc):
+    """
+    This function retrieves the (series, course name) of the lazily expanded series a teacher teaches,
+    that have occurrences within a time frame.
+    """
+    series = db.session.query(ClassSeries, Course.name).filter(ClassSeries.deleted == False)\
+        .filter(Course.id == ClassSeries.course_id)\
+        .filter(ClassSeries.teacher_id == teacher_id)\
+        .filter(ClassSeries.dtstart <= to_naive_utc(end_time_utc), ClassSeries.until >= to_naive_utc(start_time_utc)).all()
+    return series
+
+
+def query_student_series(student_id, start_time_utc, end_time_utc):
+    """
+    This function retrieves the (series, course name) of the lazily expanded series a student takes,
+    that have occurrences within a time frame.
+    """
+    series = db.session.query(ClassSeries, Course.name).filter(ClassSeries.deleted == False)\
+        .filter(TakingSeries.deleted == False)\
+        .filter(Course.id == ClassSeries.course_id)\
+        .filter(TakingSeries.series_id == ClassSeries.id)\
+        .filter(TakingSeries.student_id == student_id)\
+        .filter(ClassSeries.dtstart <= to_naive_utc(end_time_utc), ClassSeries.until >= to_naive_utc(start_time_utc)).all()
+    return series
+
+
+CONFLICT_LOOKBACK = timedelta(days=1)  # Longest existing session the conflict check can see starting before the window
+
+
+def find_schedule_conflicts(teacher_id, student_ids, start_times_utc, duration):
+    """
+    This function finds the existing sessions of the teacher or of the students that overlap new sessions.
+    The existing sessions of the whole time frame of the new sessions are read with one query for the teacher and one
+    for the students, plus the occurrences of their lazily expanded series, and compared with one sweep per person.
+    A list of conflicts (dicts) in start time order is returned.
+    """
+    if not start_times_utc:
+        return []
+    starts = sorted(to_naive_utc(start_time) for start_time in start_times_utc)
+    window_start = starts[0] - CONFLICT_LOOKBACK
+    window_end = starts[-1] + timedelta(minutes=duration)
+    student_ids = list(set(student_ids or []))
+
+    # The existing sessions of each person, as lists of (start, end, session) keyed on ('teacher' or 'student', id).
+    existing = {}
+
+    def add(person, session_id, start_time, session_duration):
+        end_time = start_time + timedelta(minutes=session_duration or 0)
+        existing.setdefault(person, []).append((start_time, end_time, (session_id, start_time, session_duration)))
+
+    window = and_(ClassSession.deleted == False,
+                  ClassSession.start_time >= window_start, ClassSession.start_time < window_end)
+    for session_id, start_time, session_duration in db.session.query(
+            ClassSession.id, ClassSession.start_time, ClassSession.duration)\
+            .filter(Teaching.session_id == ClassSession.id)\
+            .filter(Teaching.deleted == False, Teaching.teacher_id == teacher_id)\
+            .filter(window):
+        add(('teacher', teacher_id), session_id, start_time, session_duration)
+    series_list = query_teacher_series(teacher_id, window_start, window_end)
+    for series, _, occurrence_time in expand_series(series_list, window_start, window_end):
+        add(('teacher', teacher_id), occurrence_id(series.id, occurrence_time), occurrence_time, series.duration)
+
+    if student_ids:
+        for student_id, session_id, start_time, session_duration in db.session.query(
+                TakingClass.student_id, ClassSession.id, ClassSession.start_time, ClassSession.duration)\
+                .filter(TakingClass.session_id == ClassSession.id)\
+                .filter(TakingClass.deleted == False, TakingClass.student_id.in_(student_ids))\
+                .filter(window):
+            add(('student', student_id), session_id, start_time, session_duration)
+        series_students = {}
+        for series_id, student_id in db.session.query(TakingSeries.series_id, TakingSeries.student_id)\
+                .filter(TakingSeries.deleted == False, TakingSeries.student_id.in_(student_ids)):
+            series_students.setdefault(series_id, []).append(student_id)
+        if series_students:
+            series_list = db.session.query(ClassSeries, Course.name).filter(ClassSeries.deleted == False)\
+                .filter(Course.id == ClassSeries.course_id)\
+                .filter(ClassSeries.id.in_(list(series_students)))\
+                .filter(ClassSeries.dtstart < window_end, ClassSeries.until >= window_start).all()
+            for series, _, occurrence_time in expand_series(series_list, window_start, window_end):
+                for student_id in series_students[series.id]:
+                    add(('student', student_id), occurrence_id(series.id, occurrence_time), occurrence_time,
+                        series.duration)
+
+    new_sessions = [(start, start + timedelta(minutes=duration), start) for start in starts]
+    conflicts = []
+    for (role, person_id), sessions in existing.items():
+        for start, (session_id, other_start, other_duration) in find_overlaps(new_sessions, sessions):
+            conflicts.append({
+                'start_time_utc': start.strftime('%Y-%m-%dT%H:%M:%S'),
+                role + '_id': person_id,
+                'conflict_session_id': session_id,
+                'conflict_start_time_utc': other_start.strftime('%Y-%m-%dT%H:%M:%S'),
+                'conflict_duration': other_duration
+            })
+    conflicts.sort(key=lambda conflict: conflict['start_time_utc'])
+    return conflicts
+
+
+def expand_series(series_list, start_time_utc, end_time_utc):
+    """
+    This function expands (series, course name) pairs into the occurrences within a time frame.
+    Cancelled and materialized occurrences are skipped, the materialized ones are read as ClassSession rows.
+    The exceptions of all the series are read with one query. A list of (series, course name, occurrence time) is returned.
+    """
+    if not series_list:
+        return []
+    start_naive = to_naive_utc(start_time_utc)
+    end_naive = to_naive_utc(end_time_utc)
+    exceptions = set(db.session.query(SeriesException.series_id, SeriesException.occurrence_time)
+                     .filter(SeriesException.series_id.in_([series.id for series, _ in series_list]))
+                     .filter(SeriesException.occurrence_time >= start_naive, SeriesException.occurrence_time <= end_naive))
+    result = []
+    for series, course_name in series_list:
+        for occurrence_time in expand_rule(series.rrule, series.dtstart, series.until, series.tz_offset,
+                                           start_naive, end_naive):
+            if (series.id, occurrence_time) not in exceptions:
+                result.append((series, course_name, occurrence_time))
+    return result
+
+
+def query_series_students(series_id):
+    """
+    This functions retrieves all the students taking a lazily expanded series.
+    """
+    students = db.session.query(TakingSeries, Student).filter(TakingSeries.deleted == False)\
+        .filter(Student.deleted == False)\
+        .filter(TakingSeries.student_id == Student.id)\
+        .filter(TakingSeries.series_id == series_id).all()
+    return students
+
+
+def materialize_occurrence(series, occurrence_time):
+    """
+    This function creates the ClassSession row of an occurrence of a lazily expanded series,
+    with its teaching and taking class rows, and records it as an exception of the series so it is not expanded again.
+    The caller commits.
+    """
+    class_session = ClassSession(series_id=series.id, course_id=series.course_id, start_time=occurrence_time,
+                                 duration=series.duration, info=series.info)
+    db.session.add(class_session)
+    db.session.flush()
+    db.session.add(Teaching(session_id=class_session.id, teacher_id=series.teacher_id))
+    for taking_series, _ in query_series_students(series.id):
+        db.session.add(TakingClass(session_id=class_session.id, student_id=taking_series.student_id))
+    db.session.add(SeriesException(series_id=series.id, occurrence_time=occurrence_time, session_id=class_session.id))
+    db.session.flush()
+    _add_student_course_stats(_taking_class_stats(TakingClass.session_id == class_session.id))
+    return class_session
+
+
+def resolve_class_session(session_id, materialize=True):
+    """
+    This function returns the class session with the session_id.
+    The session_id can also be the id of an occurrence of a lazily expanded series (see occurrence_id),
+    then the occurrence is materialized into a ClassSession row first, unless materialize is False.
+    None is returned for unknown, cancelled or (with materialize False) not yet materialized sessions.
+    """
+    occurrence = parse_occurrence_id(session_id)
+    if occurrence is None:
+        return query_class_session(session_id)
+
+    series_id, occurrence_time = occurrence
+    exception = SeriesException.query.filter(SeriesException.series_id == series_id)\
+        .filter(SeriesException.occurrence_time == occurrence_time).first()
+    if exception:
+        return query_class_session(exception.session_id) if exception.session_id else None
+
+    if not materialize:
+        return None
+    series = query_existing_class_series(series_id)
+    if not series or occurrence_time not in expand_rule(series.rrule, series.dtstart, series.until, series.tz_offset,
+                                                        occurrence_time, occurrence_time):
+        return None
+    return materialize_occurrence(series, occurrence_time)
+
+
+def _add_minutes(column, minutes):
+    """
+    This function returns the SQL expression of a DATETIME column plus some minutes, for the DB in use.
+    """
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # SQLAlchemy stores 'YYYY-MM-DD HH:MM:SS.ffffff' strings in SQLite, and compares them as strings.
+        # datetime() drops the fraction, so the unchanged fraction of the old value is appended again.
+        return func.strftime('%Y-%m-%d %H:%M:%S', column, '%+d minutes' % minutes).op('||')(func.substr(column, 20))
+    return func.timestampadd(text('MINUTE'), minutes, column)
+
+
+def _open_series_sessions(series_id, from_time=None):
+    """
+    This function returns the conditions of the class sessions of a series that can still be changed,
+    i.e. not deleted and without an attendance call, optionally only those starting from from_time.
+    """
+    conditions = [ClassSession.series_id == series_id, ClassSession.deleted == False,
+                  or_(ClassSession.attendance_call == False, ClassSession.attendance_call == None)]
+    if from_time is not None:
+        conditions.append(ClassSession.start_time >= from_time)
+    return and_(*conditions)
+
+
+def _open_series_session_ids(series_id, from_time=None):
+    # MySQL can not update a table with a subquery on the same table, so this is only used for the other tables.
+    return db.session.query(ClassSession.id).filter(_open_series_sessions(series_id, from_time)).subquery()
+
+
+def split_class_series(series_id, from_time):
+    """
+    This function splits a series at from_time (naive UTC), so the sessions from then on can be changed as a whole.
+    The class sessions starting from from_time are moved to a new series_id. For a lazily expanded series, the rule
+    is cut at from_time and continued by a new ClassSeries with the same students and exceptions.
+    Nothing is split if all the series is after from_time. The series_id of the sessions from from_time is returned.
+    The caller commits.
+    """
+    if from_time is None:
+        return series_id
+    series = query_existing_class_series(series_id)
+    earlier_sessions = db.session.query(ClassSession.id).filter(ClassSession.series_id == series_id)\
+        .filter(ClassSession.start_time < from_time).first()
+    if not earlier_sessions and (series is None or series.dtstart >= from_time):
+        return series_id
+
+    new_series_id = str(uuid4())
+    ClassSession.query.filter(ClassSession.series_id == series_id).filter(ClassSession.start_time >= from_time)\
+        .update({ClassSession.series_id: new_series_id}, synchronize_session=False)
+
+    if series is not None and series.until >= from_time:
+        following = expand_rule(series.rrule, series.dtstart, series.until, series.tz_offset, from_time, series.until)
+        if following:
+            db.session.add(ClassSeries(id=new_series_id, course_id=series.course_id, teacher_id=series.teacher_id,
+                                       rrule=series.rrule, dtstart=following[0], until=series.until,
+                                       tz_offset=series.tz_offset, duration=series.duration, info=series.info,
+                                       create_time=datetime.utcnow()))
+            db.session.flush()
+            db.session.execute(TakingSeries.__table__.insert().from_select(
+                ['series_id', 'student_id', 'deleted'],
+                db.session.query(literal(new_series_id), TakingSeries.student_id, TakingSeries.deleted)
+                .filter(TakingSeries.series_id == series_id).statement))
+            SeriesException.query.filter(SeriesException.series_id == series_id)\
+                .filter(SeriesException.occurrence_time >= from_time)\
+                .update({SeriesException.series_id: new_series_id}, synchronize_session=False)
+            mark_tables_changed(TakingSeries.__table__.name)
+        series.until = from_time - timedelta(seconds=1)
+    return new_series_id
+
+
+def update_class_series(series_id, shift_minutes=None, duration=None, info=None, teacher_id=None):
+    """
+    This function changes all the open sessions of a series (see _open_series_sessions) with one UPDATE per kind
+    of change: start times shifted by shift_minutes, a new duration or info, or a new teacher in the teaching rows.
+    A lazily expanded series gets the same changes in its rule. The caller commits.
+    The number of class sessions changed is returned.
+    """
+    values = {}
+    if shift_minutes:
+        values[ClassSession.start_time] = _add_minutes(ClassSession.start_time, shift_minutes)
+    if duration is not None:
+        values[ClassSession.duration] = duration
+    if info is not None:
+        values[ClassSession.info] = info
+
+    # A shift can move sessions to another month, their statistics are counted again after it.
+    stats_before = _taking_class_stats(_open_series_sessions(series_id)) if shift_minutes else None
+
+    changed = 0
+    if teacher_id is not None:
+        changed = Teaching.query.filter(Teaching.session_id.in_(_open_series_session_ids(series_id)))\
+            .filter(Teaching.deleted == False)\
+            .update({Teaching.teacher_id: teacher_id}, synchronize_session=False)
+    if values:
+        changed = ClassSession.query.filter(_open_series_sessions(series_id))\
+            .update(values, synchronize_session=False)
+    if shift_minutes:
+        _add_student_course_stats(_stats_difference(_taking_class_stats(_open_series_sessions(series_id)),
+                                                    stats_before))
+
+    series = query_existing_class_series(series_id)
+    if series is not None:
+        if shift_minutes:
+            series.rrule = shift_rule_weekdays(series.rrule, series.dtstart, series.tz_offset, shift_minutes)
+            series.dtstart += timedelta(minutes=shift_minutes)
+            series.until += timedelta(minutes=shift_minutes)
+            # The exceptions follow the occurrences they stand for.
+            SeriesException.query.filter(SeriesException.series_id == series_id)\
+                .update({SeriesException.occurrence_time: _add_minutes(SeriesException.occurrence_time, shift_minutes)},
+                        synchronize_session=False)
+        if duration is not None:
+            series.duration = duration
+        if info is not None:
+            series.info = info
+        if teacher_id is not None:
+            series.teacher_id = teacher_id
+    return changed
+
+
+def cancel_class_series(series_id, from_time=None):
+    """
+    This function soft deletes the open sessions of a series (see _open_series_sessions) from from_time (naive UTC),
+    or all of them, with their teaching and taking class rows. A lazily expanded series is ended before from_time,
+    or deleted. The caller commits. The number of class sessions cancelled is returned.
+    """
+    # The rows of the sessions go first, while the sessions still match the conditions.
+    _add_student_course_stats(_stats_difference({}, _taking_class_stats(_open_series_sessions(series_id, from_time))))
+    Teaching.query.filter(Teaching.session_id.in_(_open_series_session_ids(series_id, from_time)))\
+        .update({Teaching.deleted: True}, synchronize_session=False)
+    TakingClass.query.filter(TakingClass.session_id.in_(_open_series_session_ids(series_id, from_time)))\
+        .update({TakingClass.deleted: True}, synchronize_session=False)
+    cancelled = ClassSession.query.filter(_open_series_sessions(series_id, from_time))\
+        .update({ClassSession.deleted: True}, synchronize_session=False)
+
+    series = query_existing_class_series(series_id)
+    if series is not None:
+        if from_time is None or from_time <= series.dtstart:
+            series.deleted = True
+            TakingSeries.query.filter(TakingSeries.series_id == series_id)\
+                .update({TakingSeries.deleted: True}, synchronize_session=False)
+        elif from_time <= series.until:
+            series.until = from_time - timedelta(seconds=1)
+    return cancelled
+
+
+def query_student_course_stats(student_id, start_month, end_month):
+    """
+    This function retrieves the monthly statistics of a student's courses from start_month to end_month (yyyymm),
+    with the course names, in month order.
+    """
+    return db.session.query(StudentCourseStat, Course.name)\
+        .join(Course, StudentCourseStat.course_id == Course.id)\
+        .filter(StudentCourseStat.student_id == student_id)\
+        .filter(StudentCourseStat.month >= start_month, StudentCourseStat.month <= end_month)\
+        .order_by(StudentCourseStat.month, StudentCourseStat.course_id).all()
+
+
+def query_course_stats(course_id, start_month, end_month):
+    """
+    This function sums the statistics of every undeleted student of a course from start_month to end_month (yyyymm),
+    e.g. for a term report. It reads the monthly statistics only, not the session tables.
+    A list of (student_id, real_name, scheduled, attended, credits_charged) is returned.
+    """
+    return db.session.query(Student.id, Student.real_name, func.sum(StudentCourseStat.scheduled),
+                            func.sum(StudentCourseStat.attended), func.sum(StudentCourseStat.credits_charged))\
+        .join(Student, StudentCourseStat.student_id == Student.id)\
+        .filter(Student.deleted == False)\
+        .filter(StudentCourseStat.course_id == course_id)\
+        .filter(StudentCourseStat.month >= start_month, StudentCourseStat.month <= end_month)\
+        .group_by(Student.id, Student.real_name).order_by(Student.id).all()
+
+
+def rebuild_student_course_stats():
+    """
+    This function builds all the student course statistics again from the taking class rows and the attendance
+    charges in the credit ledger, e.g. to backfill them from history. The old rows are replaced in the same
+    transaction. The caller commits. The number of statistics rows is returned.
+    The statistics are locked and deleted before anything else is read, and stay locked until the commit (every row
+    and gap of the table on MySQL, the database on SQLite), so a transaction adding to them meanwhile either committed
+    before and is counted here, or waits for the rebuild and adds to the new rows.
+    """
+    # The keys of the old rows are kept, as zero rows if nothing counts them any more, since a transaction that found
+    # a row before the rebuild updates it afterwards instead of inserting it.
+    old_keys = db.session.query(StudentCourseStat.student_id, StudentCourseStat.course_id, StudentCourseStat.month)\
+        .with_for_update().all()
+    StudentCourseStat.query.delete(synchronize_session=False)
+    mark_tables_changed(StudentCourseStat.__table__.name)
+
+    stats = _taking_class_stats()
+    charges = db.session.query(CreditTransaction.session_id, CreditTransaction.student_id, CreditTransaction.course_id,
+                               ClassSession.start_time, CreditTransaction.amount)\
+        .join(ClassSession, CreditTransaction.session_id == ClassSession.id)\
+        .filter(CreditTransaction.kind == CreditKinds.ATTENDANCE).yield_per(STREAM_BATCH_SIZE)
+    charged_sessions = set()
+    for session_id, student_id, course_id, start_time, amount in charges:
+        charged_sessions.add(session_id)
+        stats[(student_id, course_id, month_of(start_time))][2] -= amount
+
+    # Attendance calls from before the credit ledger have no charges in it. They charged every student in the call,
+    # attended or not, and only the enrolled students have a taking class row to count them from.
+    called = db.session.query(ClassSession.id, TakingClass.student_id, ClassSession.course_id,
+                              ClassSession.start_time)\
+        .join(ClassSession, TakingClass.session_id == ClassSession.id)\
+        .filter(TakingClass.deleted == False, ClassSession.deleted == False)\
+        .filter(ClassSession.attendance_call == True).yield_per(STREAM_BATCH_SIZE)
+    for session_id, student_id, course_id, start_time in called:
+        if session_id not in charged_sessions:
+            stats[(student_id, course_id, month_of(start_time))][2] += 1
+
+    stats = {key: delta for key, delta in stats.items() if any(delta)}
+    for key in old_keys:
+        stats.setdefault(tuple(key), [0, 0, 0])
+    rows = [{'student_id': student_id, 'course_id': course_id, 'month': month,
+             'scheduled': delta[0], 'attended': delta[1], 'credits_charged': delta[2]}
+            for (student_id, course_id, month), delta in stats.items()]
+    _bulk_insert(StudentCourseStat.__table__, rows)
+    return len(rows)
+
 # def query_existing_class_session(session_id, teacher_id):
 #     """
 #     This function selects one session based on the session_id and teacher_id.
@@ -1,6 +1,7 @@
 from app.utils.utils import Relationship
-from sqlalchemy import Column, INTEGER, String, BOOLEAN, ForeignKey, DATETIME, BLOB
-from sqlalchemy.orm import backref
+from app.utils.recurrence_utils import occurrence_id
+from sqlalchemy import Column, INTEGER, String, BOOLEAN, ForeignKey, DATETIME, BLOB, Index, UniqueConstraint
+from sqlalchemy.orm import backref, deferred
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db, ma
 
@@ -8,6 +9,10 @@ from app import db, ma
 # All relationships are configured on the "many" side of a one-to-many relationship.
 class Student(db.Model):
     __tablename__ = 'students'
+    __table_args__ = (
+        # An n-gram full text index on MySQL for the name search, a plain index on other DBs.
+        Index('ft_students_real_name', 'real_name', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+    )
 
     id = Column(INTEGER, primary_key=True)
     deleted = Column(BOOLEAN, default=False)
@@ -16,7 +21,9 @@ class Student(db.Model):
     gender = Column(BOOLEAN)  # 0 for girl and 1 for boy
     creator_id = Column(INTEGER, ForeignKey('users.id'))
     create_time = Column(DATETIME)  # The date and time when the student is created
-    qr_code = Column(BLOB)
+    # The image is only loaded when it is read, by the QR code api, not with every student query.
+    qr_code = deferred(Column(BLOB))
+    qr_code_etag = Column(String(40))  # sha1 of qr_code, changes whenever the image is generated again
 
     # Relationship for user who created this student
     creator = db.relationship("User", backref="created_students")
@@ -25,17 +32,34 @@ class Student(db.Model):
         return "<Student(name='%s')>" % self.real_name
 
     def to_dict(self):
+        return Student.dict_of(self)
+
+    @staticmethod
+    def dict_of(row):
+        """
+        This function returns the to_dict of a student from any row with its id, real_name, gender and dob,
+        e.g. a row of a query that selects only these columns.
+        """
         result = {
-            "id": self.id,
-            "real_name": self.real_name,
-            "gender": self.gender
+            "id": row.id,
+            "real_name": row.real_name,
+            "gender": row.gender
         }
-        if self.dob:
-            result['dob'] = self.dob.strftime('%Y-%m-%dT%H:%M:%S')
+        if row.dob:
+            # Same output as strftime('%Y-%m-%dT%H:%M:%S') for the naive datetimes in the DB, but faster.
+            result['dob'] = row.dob.isoformat(timespec='seconds')
         return result
 
+
 class User(db.Model):
     __tablename__ = "users"
+    __table_args__ = (
+        Index('ix_users_phone_deleted', 'phone', 'deleted'),
+        Index('ix_users_openid_deleted', 'openid', 'deleted'),
+        Index('ix_users_roles_validated_deleted', 'roles', 'validated', 'deleted'),
+        # An n-gram full text index on MySQL for the name and phone search, a plain index on other DBs.
+        Index('ft_users_search', 'real_name', 'nick_name', 'phone', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+    )
 
     id = Column(INTEGER, primary_key=True)
     deleted = Column(BOOLEAN, default=False)  # Field to mark whether the account is deleted.
@@ -59,6 +83,8 @@ class User(db.Model):
     validated = Column(INTEGER, default=0)  # Field to mark whether the user's account is validated by the admin.
     approve_time = Column(DATETIME)  # Server date and time when the use is approved.
     approver_id = Column(INTEGER, ForeignKey('users.id'), default=None)  # Approved by whom
+    # Bumped whenever roles, validated or deleted change. Tokens carry the version they were issued with.
+    perm_version = Column(INTEGER, default=0, server_default='0')
 
     approved_users = db.relationship("User", backref=backref('approver', remote_side=[id]))  # All approved users by this user
 
@@ -107,14 +133,22 @@ class User(db.Model):
         This function returns the user's phone, real_name, Role in a dict.
         This function is to help admins to approve an unapproved user.
         """
+        return User.validate_info_of(self)
+
+    @staticmethod
+    def validate_info_of(row):
+        """
+        This function returns the validate_info of a user from any row with the columns it needs,
+        e.g. a row of a query that selects only these columns.
+        """
         return {
-            'user_id': self.id,
-            'phone': self.phone,
-            'nick_name': self.nick_name,
-            'real_name': self.real_name,
-            'role': self.roles,
-            'validation_status': self.validated,
-            'registeration_time': self.register_time
+            'user_id': row.id,
+            'phone': row.phone,
+            'nick_name': row.nick_name,
+            'real_name': row.real_name,
+            'role': row.roles,
+            'validation_status': row.validated,
+            'registeration_time': row.register_time
         }
 
     def get_role_value(self):
@@ -124,6 +158,17 @@ class User(db.Model):
         """
         return self.roles
 
+    def token_claims(self):
+        """
+        This function returns the role, validation status and permission version that are put in the user's tokens.
+        jwt_roles_required trusts these claims as long as the user's perm_version is unchanged.
+        """
+        return {
+            'roles': self.roles,
+            'validated': self.validated,
+            'perm_version': self.perm_version or 0
+        }
+
     def get_roles(self):
         """
         This function returns the user's role and validation status in a dict.
@@ -149,9 +194,16 @@ class Course(db.Model):
         """
         This functions returns information needed for a item in the course list
         """
+        return Course.dict_of(self)
+
+    @staticmethod
+    def dict_of(row):
+        """
+        This function returns the to_dict of a course from any row with its id and name.
+        """
         return {
-            "id": self.id,
-            "name": self.name
+            "id": row.id,
+            "name": row.name
         }
 
 
@@ -168,8 +220,74 @@ class CourseCredit(db.Model):
     course = db.relationship("Course", backref="course_credits")
 
 
+class CreditTransaction(db.Model):
+    """
+    Model for the append-only ledger of course credit changes.
+    CourseCredit.credit is the balance of a student's course, it always equals the sum of the amounts here.
+    """
+    __tablename__ = "creditTransactions"
+    __table_args__ = (
+        Index('ix_creditTransactions_student_course_time', 'student_id', 'course_id', 'create_time'),
+        Index('ix_creditTransactions_create_time_kind', 'create_time', 'kind'),
+    )
+
+    id = Column(INTEGER, primary_key=True)
+    student_id = Column(INTEGER, ForeignKey('students.id'), nullable=False)
+    course_id = Column(INTEGER, ForeignKey('courses.id'), nullable=False)
+    kind = Column(String(20), nullable=False)  # One of CreditKinds
+    amount = Column(INTEGER, nullable=False)  # Credits added to the balance, negative for a charge
+    balance = Column(INTEGER, nullable=False)  # The balance after this transaction
+    session_id = Column(INTEGER, ForeignKey('classSessions.id'))  # The class session of an attendance charge
+    operator_id = Column(INTEGER, ForeignKey('users.id'))  # The user who made the change
+    create_time = Column(DATETIME, nullable=False)  # UTC time of the change
+    comments = Column(String(500))
+
+    def to_dict(self):
+        return {
+            'transaction_id': self.id,
+            'kind': self.kind,
+            'amount': self.amount,
+            'balance': self.balance,
+            'session_id': self.session_id,
+            'operator_id': self.operator_id,
+            'create_time_utc': self.create_time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'comments': self.comments
+        }
+
+
+class StudentCourseStat(db.Model):
+    """
+    Model for the monthly attendance and credit statistics of a student's course, kept up to date by the writes
+    to the taking class rows and the attendance calls, so reports do not scan the session tables.
+    """
+    __tablename__ = "studentCourseStats"
+    __table_args__ = (
+        Index('ix_studentCourseStats_course_month', 'course_id', 'month'),
+    )
+
+    student_id = Column(INTEGER, ForeignKey('students.id'), primary_key=True)
+    course_id = Column(INTEGER, ForeignKey('courses.id'), primary_key=True)
+    month = Column(INTEGER, primary_key=True)  # yyyymm of the UTC start time of the sessions
+    scheduled = Column(INTEGER, nullable=False, default=0)  # Undeleted sessions the student takes
+    attended = Column(INTEGER, nullable=False, default=0)  # Those of them the student attended
+    credits_charged = Column(INTEGER, nullable=False, default=0)  # Credits charged by the attendance calls
+
+    def to_dict(self):
+        return {
+            'course_id': self.course_id,
+            'month': '%04d-%02d' % divmod(self.month, 100),
+            'scheduled': self.scheduled,
+            'attended': self.attended,
+            'credits_charged': self.credits_charged
+        }
+
+
 class ClassSession(db.Model):
     __tablename__ = "classSessions"
+    __table_args__ = (
+        Index('ix_classSessions_deleted_start_time', 'deleted', 'start_time'),
+        Index('ix_classSessions_series_id', 'series_id'),
+    )
 
     id = Column(INTEGER, primary_key=True)
     series_id = Column(String(200), default=None)  # If the class session is in a series, then here is the UUID for the series
@@ -203,8 +321,79 @@ class ClassSession(db.Model):
         return result
 
 
+class ClassSeries(db.Model):
+    """
+    Model for a recurring series of class sessions that is stored as a rule instead of one row per session.
+    The occurrences are expanded on read. An occurrence only gets a ClassSession row (with this series_id)
+    when it is touched, e.g. by an attendance call, and from then on the row replaces the occurrence.
+    """
+    __tablename__ = "classSeries"
+    __table_args__ = (
+        Index('ix_classSeries_teacher_id_deleted', 'teacher_id', 'deleted'),
+    )
+
+    id = Column(String(200), primary_key=True)  # The UUID of the series, same as ClassSession.series_id
+    course_id = Column(INTEGER, ForeignKey("courses.id"))
+    teacher_id = Column(INTEGER, ForeignKey("users.id"))
+    deleted = Column(BOOLEAN, default=False)
+    rrule = Column(String(500))  # RFC 5545 RRULE without DTSTART and UNTIL, e.g. FREQ=WEEKLY;BYDAY=MO,WE
+    dtstart = Column(DATETIME)  # UTC time of the first occurrence
+    until = Column(DATETIME)  # UTC time after which there is no occurrence
+    tz_offset = Column(INTEGER)  # Offset of the series' local time from UTC, in minutes. The rule is expanded in local time.
+    duration = Column(INTEGER)  # Duration of each occurrence, in minutes
+    info = Column(String(500))
+    create_time = Column(DATETIME)
+
+    # Relationships
+    course = db.relationship("Course", backref="course_series")
+    teacher = db.relationship("User", backref="teacher_series")
+
+    def occurrence_dict(self, occurrence_time, course_name):
+        """
+        This function returns an occurrence that has no ClassSession row yet, in the format of ClassSession.to_dict.
+        """
+        return {
+            'session_id': occurrence_id(self.id, occurrence_time),
+            'series_id': self.id,
+            'course_name': course_name,
+            'start_time_utc': occurrence_time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'duration': self.duration,
+            'attendance_call': False
+        }
+
+
+class TakingSeries(db.Model):
+    __tablename__ = "takingSeries"
+    __table_args__ = (
+        Index('ix_takingSeries_student_id_deleted', 'student_id', 'deleted'),
+    )
+
+    series_id = Column(String(200), ForeignKey("classSeries.id"), primary_key=True)
+    student_id = Column(INTEGER, ForeignKey("students.id"), primary_key=True)
+    deleted = Column(BOOLEAN, default=False)
+
+    # Relationships
+    class_series = db.relationship("ClassSeries", backref="series_takings")
+    student = db.relationship("Student", backref="student_series")
+
+
+class SeriesException(db.Model):
+    """
+    Model for an occurrence of a ClassSeries that is not expanded any more,
+    either because it was cancelled or because it was materialized into a ClassSession row.
+    """
+    __tablename__ = "seriesExceptions"
+
+    series_id = Column(String(200), ForeignKey("classSeries.id"), primary_key=True)
+    occurrence_time = Column(DATETIME, primary_key=True)  # UTC start time of the occurrence in the rule
+    session_id = Column(INTEGER, ForeignKey("classSessions.id"))  # The materialized session, None if cancelled
+
+
 class ParentHood(db.Model):
     __tablename__ = "parenthoods"
+    __table_args__ = (
+        Index('ix_parenthoods_parent_id_deleted', 'parent_id', 'deleted'),
+    )
 
     student_id = Column(INTEGER, ForeignKey("students.id"), primary_key=True)
     parent_id = Column(INTEGER, ForeignKey("users.id"), primary_key=True)
@@ -218,6 +407,9 @@ class ParentHood(db.Model):
 
 class Teaching(db.Model):
     __tablename__ = "teachings"
+    __table_args__ = (
+        Index('ix_teachings_teacher_id_deleted', 'teacher_id', 'deleted'),
+    )
 
     session_id = Column(INTEGER, ForeignKey("classSessions.id"), primary_key=True)
     teacher_id = Column(INTEGER, ForeignKey("users.id"), primary_key=True)
@@ -232,6 +424,9 @@ class Teaching(db.Model):
 
 class TakingClass(db.Model):
     __tablename__ = "takingClasses"
+    __table_args__ = (
+        Index('ix_takingClasses_student_id_deleted', 'student_id', 'deleted'),
+    )
 
     session_id = Column(INTEGER, ForeignKey("classSessions.id"), primary_key=True)
     student_id = Column(INTEGER, ForeignKey("students.id"), primary_key=True)
@@ -248,12 +443,20 @@ class TokenBlacklist(db.Model):
     """
     Model for black listed JWT tokens.
     """
+    __table_args__ = (
+        UniqueConstraint('jti', name='uq_token_blacklist_jti'),
+        Index('ix_token_blacklist_user_id_revoked', 'user_id', 'revoked'),
+        Index('ix_token_blacklist_expires', 'expires'),
+        Index('ix_token_blacklist_revoked_revoke_time', 'revoked', 'revoke_time'),
+    )
+
     id = Column(INTEGER, primary_key=True)
     jti = Column(String(36), nullable=False)
     token_type = Column(String(10), nullable=False)
     user_id = Column(INTEGER, nullable=False)
     revoked = Column(BOOLEAN, nullable=False)
     expires = Column(DATETIME, nullable=False)
+    revoke_time = Column(DATETIME)  # UTC time the token was revoked, the prune job keeps revoked tokens for a while
 
     def to_dict(self):
         return {
@@ -0,0 +1,104 @@
+from rq import get_current_job
+
+from app import create_app
+from app.api.auth.auth_utils import prune_db
+from app import db
+from app.dbUtils.dbUtils import query_credit_mismatches, store_student_qr_code, rebuild_student_course_stats
+from app.utils.task_utils import schedule_prune_tokens, schedule_reconcile_credits, is_latest_periodic_run, \
+    clear_pending_job, student_qr_code_job_id, REBUILD_STATS_JOB_ID
+from app.utils.wechat_utils import request_wechat_qr_code
+
+# The rq worker runs the jobs outside of any request, so the jobs get their own app and app context.
+app = create_app()
+app.app_context().push()
+
+
+def _superseded(name):
+    """
+    This function returns True if the running job is a periodic run that was replaced by a newer scheduled run.
+    """
+    job = get_current_job()
+    if job and not is_latest_periodic_run(app, name, job.id):
+        app.logger.info('Skipped %s run %s, a newer run is scheduled.', name, job.id)
+        return True
+    return False
+
+
+def _set_job_progress(**counters):
+    job = get_current_job()
+    if job:
+        job.meta.update(counters)
+        job.save_meta()
+
+
+def prune_tokens(reschedule=True):
+    """
+    This job deletes expired and long revoked tokens from the token_blacklist table in small batches, see prune_db.
+    The progress counters are kept in job.meta: deleted (tokens deleted so far) and batches (batches committed).
+    If reschedule is True, the job enqueues its next run after TOKEN_PRUNE_INTERVAL.
+    """
+    if reschedule and _superseded('prune_tokens'):
+        return 0
+    _set_job_progress(deleted=0, batches=0, finished=False)
+    try:
+        deleted = prune_db(batch_size=app.config['TOKEN_PRUNE_BATCH_SIZE'],
+                           pause=app.config['TOKEN_PRUNE_BATCH_PAUSE'],
+                           progress=lambda deleted, batches: _set_job_progress(deleted=deleted, batches=batches))
+        _set_job_progress(finished=True)
+        app.logger.info('Pruned %d tokens.', deleted)
+        return deleted
+    finally:
+        if reschedule:
+            schedule_prune_tokens(app)
+
+
+def reconcile_credits(reschedule=True):
+    """
+    This job checks that every course credit balance equals the sum of its credit ledger transactions.
+    The mismatches are logged and kept in job.meta, they are not fixed automatically.
+    If reschedule is True, the job enqueues its next run after CREDIT_RECONCILE_INTERVAL.
+    """
+    if reschedule and _superseded('reconcile_credits'):
+        return []
+    try:
+        mismatches = [{'student_id': student_id, 'course_id': course_id, 'balance': balance, 'ledger': int(ledger)}
+                      for student_id, course_id, balance, ledger in query_credit_mismatches()]
+        for mismatch in mismatches:
+            app.logger.error('Course credit balance does not match its ledger: %s', mismatch)
+        _set_job_progress(mismatches=mismatches, finished=True)
+        app.logger.info('Reconciled course credits, %d mismatches.', len(mismatches))
+        return mismatches
+    finally:
+        if reschedule:
+            schedule_reconcile_credits(app)
+
+
+def rebuild_stats():
+    """
+    This job builds the monthly student course statistics again from the taking class rows and the credit ledger,
+    to backfill them from history. The number of statistics rows is kept in job.meta.
+    """
+    try:
+        _set_job_progress(finished=False)
+        rows = rebuild_student_course_stats()
+        db.session.commit()
+        _set_job_progress(rows=rows, finished=True)
+        app.logger.info('Rebuilt %d student course statistics.', rows)
+        return rows
+    finally:
+        clear_pending_job(app, REBUILD_STATS_JOB_ID)
+
+
+def generate_student_qr_code(student_id):
+    """
+    This job requests the wechat applet QR code of a student and stores the image with its etag.
+    The QR code carries the student id as its scene, so parents can scan it to bind themselves to the student.
+    """
+    try:
+        image = request_wechat_qr_code('student_id=%d' % student_id, app.config['WECHAT_QR_CODE_PAGE'])
+        etag = store_student_qr_code(student_id, image)
+        db.session.commit()
+        app.logger.info('Generated the QR code of student %d.', student_id)
+        return etag
+    finally:
+        clear_pending_job(app, student_qr_code_job_id(student_id))
@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+
+class LocalCache:
+    """
+    This class is a small thread safe LRU cache with a per entry TTL.
+    One instance lives in each gunicorn worker, so it is only a short lived copy of the shared store.
+    """
+    def __init__(self, max_size=10000, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        This function returns the cached value of the key, or the default if it is missing or expired.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        This function stores the value of the key, evicting the least recently used entries when full.
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        """
+        This function stores the value of the key only if the key has no live entry, like redis SET NX.
+        It returns True if the value was stored.
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] >= now:
+                return False
+            self._data[key] = (value, now + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class InProcessRedis:
+    """
+    This class implements the small part of the redis client API that the app uses.
+    It is used when no redis server is reachable, and as a fake redis in tests.
+    Values are kept as bytes to behave like the real client.
+    """
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    def _alive(self, name):
+        item = self._data.get(name)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[name]
+            return None
+        return item
+
+    def ping(self):
+        return True
+
+    def get(self, name):
+        with self._lock:
+            item = self._alive(name)
+            return item[0] if item else None
+
+    def mget(self, names):
+        return [self.get(name) for name in names]
+
+    def set(self, name, value, ex=None, px=None, nx=False):
+        with self._lock:
+            if nx and self._alive(name):
+                return None
+            expires_at = None
+            if ex is not None:
+                expires_at = time.monotonic() + ex
+            elif px is not None:
+                expires_at = time.monotonic() + px / 1000.0
+            self._data[name] = (self._encode(value), expires_at)
+            return True
+
+    def setex(self, name, time_seconds, value):
+        return self.set(name, value, ex=time_seconds)
+
+    def delete(self, *names):
+        with self._lock:
+            count = 0
+            for name in names:
+                if self._alive(name):
+                    count += 1
+                self._data.pop(name, None)
+            return count
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            item = self._alive(name)
+            value = int(item[0]) + amount if item else amount
+            expires_at = item[1] if item else None
+            self._data[name] = (self._encode(value), expires_at)
+            return value
+
+    def ttl(self, name):
+        with self._lock:
+            item = self._alive(name)
+            if item is None:
+                return -2
+            if item[1] is None:
+                return -1
+            return int(item[1] - time.monotonic())
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+
+    def pipeline(self, transaction=True):
+        return InProcessPipeline(self)
+
+
+class InProcessPipeline:
+    """
+    This class queues commands for an InProcessRedis and runs them on execute(), like a redis pipeline.
+    """
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._client._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+def init_redis(app):
+    """
+    This function connects the app to the redis server in the config.
+    If the server can not be reached, an in process store is used instead so the app still works
+    (but the cache is no longer shared between workers).
+    """
+    if app.config.get('REDIS_FAKE'):
+        client = InProcessRedis()
+    else:
+        client = redis.Redis(host=app.config['REDIS_HOST'], port=int(app.config['REDIS_PORT']),
+                             socket_connect_timeout=1, socket_timeout=1)
+        try:
+            client.ping()
+        except redis.RedisError:
+            app.logger.warning('Redis is not reachable, falling back to an in process store.')
+            client = InProcessRedis()
+            # Each worker now has its own store, values written by one worker are not seen by the others.
+            app.extensions['redis_fallback'] = True
+    app.extensions['redis'] = client
+    return client
+
+
+def get_redis(app):
+    """
+    This function returns the redis client (or its in process stand-in) of the app.
+    """
+    return app.extensions['redis']
+
+
+def get_shared_redis(app):
+    """
+    This function returns the redis client of the app if it is shared by all workers, or None in the fallback mode,
+    where each worker has its own in process store that the writes of other workers never reach.
+    """
+    if app.extensions.get('redis_fallback'):
+        return None
+    return app.extensions['redis']
+
+
+def run_script(client, script, emulate, keys, args):
+    """
+    This function runs a Lua script atomically on redis and returns its result.
+    The in process store can not run Lua, so there emulate(client, keys, args) does the same under the store's lock.
+    """
+    if isinstance(client, InProcessRedis):
+        with client._lock:
+            return emulate(client, keys, args)
+    return client.eval(script, len(keys), *keys, *args)
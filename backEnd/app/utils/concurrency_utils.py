@@ -0,0 +1,53 @@
+import threading
+
+from flask import current_app
+
+
+class BulkheadFull(Exception):
+    """
+    Indicates that every slot of a bulkhead is taken.
+    """
+    pass
+
+
+class Bulkhead:
+    """
+    This class limits how many request threads of a worker can be inside a slow section at once,
+    e.g. waiting on an upstream call. The other threads stay free for the fast endpoints.
+    A thread that finds every slot taken is rejected at once instead of waiting for a slot,
+    since a waiting thread is just as unavailable to the other endpoints as one inside the section.
+    The limit is read from the app config: <prefix>_MAX_CONCURRENCY, it must be below the threads of a worker.
+    """
+    def __init__(self, config_prefix):
+        self.config_prefix = config_prefix
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            with self._lock:
+                if self._semaphore is None:
+                    self._semaphore = threading.BoundedSemaphore(
+                        current_app.config[self.config_prefix + '_MAX_CONCURRENCY'])
+        return self._semaphore
+
+    def __enter__(self):
+        semaphore = self._get_semaphore()
+        if not semaphore.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise BulkheadFull(self.config_prefix)
+        with self._lock:
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+        return False
+
+
+wechat_login_bulkhead = Bulkhead('WECHAT_LOGIN')
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import time
+from functools import wraps
+
+import redis
+from flask import current_app, make_response, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+
+from app import db
+from app.utils.cache_utils import get_redis
+
+
+class TableVersions:
+    """
+    This class keeps a change version per table in redis, shared by all the workers.
+    The version of a table is bumped after every commit that wrote to it, so an ETag built from the versions
+    of the tables a response reads changes whenever the response may change.
+    """
+    key_prefix = 'table_version:'
+
+    def _key(self, table):
+        return self.key_prefix + table
+
+    def get(self, tables):
+        """
+        This function returns the versions of the tables, or None if they can not be read.
+        """
+        if current_app.extensions.get('redis_fallback'):
+            # Versions bumped in other workers would not be seen, so they can not be trusted.
+            return None
+        client = get_redis(current_app)
+        keys = [self._key(table) for table in tables]
+        try:
+            versions = client.mget(keys)
+            if None in versions:
+                # A missing version (first use, or redis lost its data) starts from the current time,
+                # so it can not repeat a version an old ETag was built from.
+                pipe = client.pipeline(transaction=False)
+                for key in keys:
+                    pipe.set(key, int(time.time() * 1000), nx=True)
+                pipe.execute()
+                versions = client.mget(keys)
+        except redis.RedisError:
+            return None
+        return [int(version) for version in versions]
+
+    def bump(self, tables):
+        """
+        This function bumps the versions of the tables.
+        """
+        if not tables:
+            return
+        client = get_redis(current_app)
+        try:
+            pipe = client.pipeline(transaction=False)
+            for table in tables:
+                key = self._key(table)
+                pipe.set(key, int(time.time() * 1000), nx=True)
+                pipe.incr(key)
+            pipe.execute()
+        except redis.RedisError:
+            current_app.logger.warning('Could not bump the table versions in redis.')
+
+
+table_versions = TableVersions()
+
+
+def mark_tables_changed(*tables):
+    """
+    This function records that the current transaction wrote to the tables, their versions are bumped when it commits.
+    ORM flushes and bulk query updates/deletes are recorded automatically, only Core statements
+    run with db.session.execute need to call this.
+    """
+    db.session.info.setdefault('changed_tables', set()).update(tables)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _record_flushed_tables(session, flush_context):
+    tables = session.info.setdefault('changed_tables', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        tables.add(instance.__table__.name)
+
+
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def _record_bulk_tables(context):
+    context.session.info.setdefault('changed_tables', set()).add(context.primary_table.name)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_table_versions(session):
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        table_versions.bump(sorted(tables))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_table_versions(session):
+    session.info.pop('changed_tables', None)
+
+
+def conditional_get(*tables, private=True):
+    """
+    This decorator adds a strong ETag and a Cache-Control header to a GET api that only reads the given tables.
+    The ETag is built from the table versions, the url and, for a private api, the user, so a request with a
+    matching If-None-Match header is answered with 304 before the api runs any query.
+    It must be placed below jwt_roles_required for private apis.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            versions = table_versions.get(tables)
+            if versions is None:
+                return fn(*args, **kwargs)
+
+            user_id = get_jwt_identity().get('id') if private else None
+            key = json.dumps([request.full_path, user_id, versions])
+            etag = hashlib.sha1(key.encode()).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code not in (200, 201):
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = '%s, max-age=%d, must-revalidate' % (
+                'private' if private else 'public', current_app.config['CONDITIONAL_GET_MAX_AGE'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,238 @@
+import random
+import threading
+import time
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Indicates that an outbound call failed after its retries, or was not tried because the circuit is open.
+    """
+    pass
+
+
+def _not_sent(error):
+    """
+    This function returns True if a request failed while connecting, so it never reached the upstream.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+class CircuitBreaker:
+    """
+    This class stops calls to an endpoint after `failures` consecutive failures.
+    After `reset_timeout` seconds one trial call is let through, its result closes or reopens the circuit.
+    """
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_thread = None  # The thread running the trial call, if any
+        self._lock = threading.Lock()
+
+    def allow(self, reset_timeout):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= reset_timeout and self.trial_thread is None:
+                self.trial_thread = threading.get_ident()
+                return True
+            return False
+
+    def end_trial(self):
+        """
+        This function lets another trial through if the trial call of this thread ended without a result,
+        e.g. it raised something other than a request error.
+        """
+        with self._lock:
+            if self.trial_thread == threading.get_ident():
+                self.trial_thread = None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_thread = None
+
+    def record_failure(self, max_failures):
+        with self._lock:
+            self.failures += 1
+            self.trial_thread = None
+            if self.failures >= max_failures:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        return 'closed' if self.opened_at is None else 'open'
+
+
+class EndpointMetrics:
+    """
+    This class counts calls, errors and latency of one outbound endpoint.
+    """
+    # Upper bounds of the latency buckets, in milliseconds.
+    buckets = (50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(self.buckets) + 1)
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms, error=False):
+        with self._lock:
+            self.calls += 1
+            if error:
+                self.errors += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+            for i, bound in enumerate(self.buckets):
+                if elapsed_ms <= bound:
+                    self.histogram[i] += 1
+                    break
+            else:
+                self.histogram[-1] += 1
+
+    def increment(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def to_dict(self):
+        with self._lock:
+            labels = ['<=%dms' % bound for bound in self.buckets] + ['>%dms' % self.buckets[-1]]
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'avg_ms': round(self.total_ms / self.calls, 1) if self.calls else 0,
+                'max_ms': round(self.max_ms, 1),
+                'histogram': dict(zip(labels, self.histogram))
+            }
+
+
+class OutboundClient:
+    """
+    This class is the shared HTTP client for calls to an external service.
+    It keeps connections alive in a pool, bounds every call with connect and read timeouts,
+    retries failed calls with jittered exponential backoff, and has one circuit breaker and one
+    set of latency metrics per endpoint.
+    A call that is not idempotent (e.g. it spends a single use code) is only retried when it could not connect,
+    since after a timeout or a 5xx the upstream may already have handled it.
+    Its settings are read from the app config with the given prefix, e.g. WECHAT_HTTP_READ_TIMEOUT.
+    """
+    def __init__(self, config_prefix):
+        self.config_prefix = config_prefix
+        self._session = None
+        self._lock = threading.Lock()
+        self.breakers = {}
+        self.metrics = {}
+
+    def _config(self, name):
+        return current_app.config[self.config_prefix + '_' + name]
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    pool_size = self._config('POOL_SIZE')
+                    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def _endpoint(self, endpoint):
+        with self._lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker()
+                self.metrics[endpoint] = EndpointMetrics()
+        return self.breakers[endpoint], self.metrics[endpoint]
+
+    def get(self, endpoint, url, params=None, idempotent=True):
+        """
+        This function sends a GET request and returns the response.
+        endpoint is a short name used for the circuit breaker and the metrics, e.g. 'jscode2session'.
+        idempotent is False for calls that must not be repeated once the upstream may have received them.
+        UpstreamUnavailable is raised if the circuit is open or all the attempts failed.
+        """
+        return self._request('GET', endpoint, url, idempotent, params=params)
+
+    def post(self, endpoint, url, params=None, json=None):
+        """
+        This function sends a POST request with a json body and returns the response, see get.
+        It is retried like a GET, so it must only be used for calls that can safely be repeated.
+        """
+        return self._request('POST', endpoint, url, True, params=params, json=json)
+
+    def _request(self, method, endpoint, url, idempotent, **kwargs):
+        breaker, metrics = self._endpoint(endpoint)
+        if not breaker.allow(self._config('CIRCUIT_RESET_TIMEOUT')):
+            metrics.increment('rejected')
+            raise UpstreamUnavailable('Circuit open for %s' % endpoint)
+
+        try:
+            return self._send(method, endpoint, url, idempotent, breaker, metrics, **kwargs)
+        finally:
+            # A trial call that raised something unexpected must not keep the circuit open for good.
+            breaker.end_trial()
+
+    def _send(self, method, endpoint, url, idempotent, breaker, metrics, **kwargs):
+        timeout = (self._config('CONNECT_TIMEOUT'), self._config('READ_TIMEOUT'))
+        retries = self._config('RETRIES')
+        backoff = self._config('RETRY_BACKOFF')
+        last_error = None
+        attempts = 0
+        for attempt in range(retries + 1):
+            if attempt and not (idempotent or _not_sent(last_error)):
+                break
+            attempts += 1
+            if attempt:
+                metrics.increment('retries')
+                # Full jitter, so retrying workers do not hit the upstream at the same moment.
+                time.sleep(random.uniform(0, backoff * (2 ** (attempt - 1))))
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                metrics.observe((time.monotonic() - start) * 1000, error=True)
+                last_error = e
+                continue
+            elapsed_ms = (time.monotonic() - start) * 1000
+            if response.status_code >= 500:
+                metrics.observe(elapsed_ms, error=True)
+                last_error = requests.HTTPError('%s returned %d' % (endpoint, response.status_code))
+                continue
+            metrics.observe(elapsed_ms)
+            breaker.record_success()
+            return response
+
+        breaker.record_failure(self._config('CIRCUIT_FAILURES'))
+        raise UpstreamUnavailable('%s failed after %d attempts: %s' % (endpoint, attempts, last_error))
+
+    def metrics_snapshot(self):
+        """
+        This function returns the metrics and circuit state of every endpoint called so far.
+        """
+        with self._lock:
+            endpoints = list(self.metrics)
+        result = {}
+        for endpoint in endpoints:
+            result[endpoint] = self.metrics[endpoint].to_dict()
+            result[endpoint]['circuit'] = self.breakers[endpoint].state
+        return result
+
+
+wechat_http = OutboundClient('WECHAT_HTTP')
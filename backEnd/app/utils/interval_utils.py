@@ -0,0 +1,28 @@
+import heapq
+
+
+def find_overlaps(intervals, others):
+    """
+    This function finds every pair of an interval in intervals and an interval in others that overlap.
+    Both are lists of (start, end, item), an interval includes its start but not its end,
+    so back to back sessions do not overlap. A list of (item, other item) is returned.
+    The intervals are swept once in start order, so the cost is O((n + m) log(n + m) + number of overlaps)
+    instead of comparing every pair.
+    """
+    # At the same start, empty intervals (e.g. a duration of 0) come first: they only overlap the intervals that
+    # started before them, and are dropped before the next interval starting at the same time.
+    events = sorted([(start, 0, end, item) for start, end, item in intervals] +
+                    [(start, 1, end, item) for start, end, item in others],
+                    key=lambda event: (event[0], event[2] > event[0], event[1]))
+    # The intervals of each side that are still running, as heaps keyed on their end.
+    active = ([], [])
+    overlaps = []
+    for count, (start, side, end, item) in enumerate(events):
+        for heap in active:
+            while heap and heap[0][0] <= start:
+                heapq.heappop(heap)
+        for _, _, other in active[1 - side]:
+            overlaps.append((item, other) if side == 0 else (other, item))
+        # count breaks ties between equal ends, the items themselves are never compared.
+        heapq.heappush(active[side], (end, count, item))
+    return overlaps
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+
+from dateutil.rrule import rrulestr, MO, TU, WE, TH, FR, SA, SU
+
+WEEKDAYS = (MO, TU, WE, TH, FR, SA, SU)
+OCCURRENCE_TIME_FORMAT = '%Y%m%dT%H%M%SZ'
+
+
+def weekly_rule(repeat_wkdays):
+    """
+    This function returns the RRULE of a weekly series on the weekdays 0, 1, 2, ... 6 for Mon, Tue, Wed, ... Sun.
+    """
+    return 'FREQ=WEEKLY;INTERVAL=1;WKST=MO;BYDAY=' + ','.join(str(WEEKDAYS[wkday]) for wkday in repeat_wkdays)
+
+
+def shift_rule_weekdays(rule, dtstart_utc, tz_offset, shift_minutes):
+    """
+    This function returns the rule of a series whose occurrences are all moved by shift_minutes.
+    The BYDAY weekdays are in the series' local time, so a shift across local midnight moves them
+    by as many days as it moves the local date of dtstart.
+    """
+    tz = timezone(timedelta(minutes=tz_offset or 0))
+    date_before = dtstart_utc.replace(tzinfo=timezone.utc).astimezone(tz).date()
+    date_after = (dtstart_utc + timedelta(minutes=shift_minutes)).replace(tzinfo=timezone.utc).astimezone(tz).date()
+    days = (date_after - date_before).days
+    if not days % 7:
+        return rule
+    names = [str(weekday) for weekday in WEEKDAYS]
+    parts = []
+    for part in rule.split(';'):
+        name, _, value = part.partition('=')
+        if name == 'BYDAY':
+            # A weekday can carry an ordinal, e.g. +1MO, only the weekday itself moves.
+            value = ','.join(day[:-2] + names[(names.index(day[-2:]) + days) % 7] for day in value.split(','))
+            part = name + '=' + value
+        parts.append(part)
+    return ';'.join(parts)
+
+
+def to_naive_utc(dt):
+    """
+    This function converts a datetime with timezone information to a naive datetime in UTC,
+    which is how the series times are stored and compared. Naive datetimes are returned as they are.
+    """
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def utc_offset_minutes(dt):
+    """
+    This function returns the UTC offset of a datetime with timezone information, in minutes.
+    """
+    return int(dt.utcoffset().total_seconds() // 60)
+
+
+def expand_rule(rule, dtstart_utc, until_utc, tz_offset, window_start_utc, window_end_utc):
+    """
+    This function returns the occurrences of the rule within the window, both ends included, as naive UTC datetimes.
+    The rule is expanded in the series' local time, so weekdays are those of the timezone the series was created in.
+    """
+    tz = timezone(timedelta(minutes=tz_offset or 0))
+    dtstart_local = dtstart_utc.replace(tzinfo=timezone.utc).astimezone(tz)
+    recurrence = rrulestr(rule, dtstart=dtstart_local).replace(until=until_utc.replace(tzinfo=timezone.utc))
+    occurrences = recurrence.between(to_naive_utc(window_start_utc).replace(tzinfo=timezone.utc),
+                                     to_naive_utc(window_end_utc).replace(tzinfo=timezone.utc), inc=True)
+    return [to_naive_utc(occurrence) for occurrence in occurrences]
+
+
+def occurrence_id(series_id, occurrence_time):
+    """
+    This function returns the session id of an occurrence that has no ClassSession row yet.
+    """
+    return '%s@%s' % (series_id, occurrence_time.strftime(OCCURRENCE_TIME_FORMAT))
+
+
+def parse_occurrence_id(session_id):
+    """
+    This function splits an occurrence id into the series id and the naive UTC occurrence time.
+    None is returned if the session id is not an occurrence id.
+    """
+    if not isinstance(session_id, str) or '@' not in session_id:
+        return None
+    series_id, _, time_string = session_id.partition('@')
+    try:
+        return series_id, datetime.strptime(time_string, OCCURRENCE_TIME_FORMAT)
+    except ValueError:
+        return None
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app
+
+from app.utils.etag_utils import table_versions
+
+# Match classes of a search result, a lower class ranks first.
+EXACT_MATCH = 0
+PREFIX_MATCH = 1
+SUBSTRING_MATCH = 2
+
+
+def normalize_search_text(text):
+    """
+    This function returns the form of a text that the in-process index stores and matches, case is ignored.
+    """
+    return (text or '').strip().lower()
+
+
+def match_class(query, values):
+    """
+    This function returns the best match class of the normalized query against normalized field values,
+    or None if no field contains the query.
+    """
+    best = None
+    for value in values:
+        if value == query:
+            return EXACT_MATCH
+        if value.startswith(query):
+            best = PREFIX_MATCH
+        elif best is None and query in value:
+            best = SUBSTRING_MATCH
+    return best
+
+
+class NgramIndex:
+    """
+    This class is an in-process n-gram index over a few text fields of each document, for DBs without
+    an n-gram full text index. Every 1 and 2 character gram of a field maps to the ids of the documents containing it.
+    A query only checks the documents in the smallest postings of its grams, instead of every document.
+    """
+    def __init__(self, documents):
+        """
+        documents is an iterable of (id, group, field values), the group (e.g. a user's role) can be used to
+        restrict a search.
+        """
+        self.fields = {}
+        self.groups = {}
+        self.postings = defaultdict(set)
+        for doc_id, group, values in documents:
+            values = tuple(normalize_search_text(value) for value in values if value)
+            self.fields[doc_id] = values
+            self.groups[doc_id] = group
+            grams = set()
+            for value in values:
+                grams.update(value)
+                grams.update(value[i:i + 2] for i in range(len(value) - 1))
+            for gram in grams:
+                self.postings[gram].add(doc_id)
+
+    def search(self, query, group=None, after=None, limit=20):
+        """
+        This function returns up to limit (match class, id) of the documents matching the query, in rank order.
+        after is the (match class, id) of the last result of the previous page.
+        """
+        query = normalize_search_text(query)
+        if not query:
+            return []
+        grams = [query] if len(query) == 1 else [query[i:i + 2] for i in range(len(query) - 1)]
+        postings = sorted((self.postings.get(gram, ()) for gram in set(grams)), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+
+        results = []
+        for doc_id in candidates:
+            if group is not None and self.groups[doc_id] != group:
+                continue
+            rank = match_class(query, self.fields[doc_id])
+            if rank is not None and (after is None or (rank, doc_id) > tuple(after)):
+                results.append((rank, doc_id))
+        results.sort()
+        return results[:limit]
+
+
+class SearchIndexes:
+    """
+    This class keeps one NgramIndex per name in each worker, and builds it again after a write to its tables.
+    Changes are seen through the shared table versions, without redis an index is rebuilt after
+    SEARCH_INDEX_LOCAL_TTL seconds.
+    """
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, tables, load):
+        """
+        This function returns the index of the given name, load() returns its documents when it is (re)built.
+        """
+        versions = table_versions.get(tables)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._indexes.get(name)
+            if entry:
+                index, built_versions, built_at = entry
+                if versions is not None and versions == built_versions:
+                    return index
+                if versions is None and now - built_at < current_app.config['SEARCH_INDEX_LOCAL_TTL']:
+                    return index
+            index = NgramIndex(load())
+            self._indexes[name] = (index, versions, now)
+            return index
+
+
+search_indexes = SearchIndexes()
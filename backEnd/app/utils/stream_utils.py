@@ -0,0 +1,26 @@
+from flask import Response, json, stream_with_context
+
+
+def stream_json_list(items, status=201, **extra):
+    """
+    This function returns a response with the same {"message": [...]} body as jsonify(message=list(items)),
+    but the items are serialized and sent one at a time while they are read, so the full list and its
+    json string are never held in memory. Extra keyword arguments are added to the envelope after the list.
+    items can be any iterable, e.g. a query with yield_per or a generator of dicts.
+    """
+    def generate():
+        yield '{"message": ['
+        first = True
+        for item in items:
+            if first:
+                first = False
+                yield json.dumps(item)
+            else:
+                yield ', ' + json.dumps(item)
+        yield ']'
+        for key, value in extra.items():
+            yield ', %s: %s' % (json.dumps(key), json.dumps(value))
+        yield '}\n'
+
+    # stream_with_context keeps the request (and the DB session) alive until the last item is sent.
+    return Response(stream_with_context(generate()), status=status, mimetype='application/json')
@@ -0,0 +1,106 @@
+from datetime import timedelta
+from uuid import uuid4
+
+import redis
+
+
+# Redis key holding the job id of the latest scheduled run of a periodic job.
+PERIODIC_JOB_KEY = 'flaskapi:periodic-job:%s'
+# Redis key flagging a job that is queued or running.
+PENDING_JOB_KEY = 'flaskapi:pending-job:%s'
+PENDING_JOB_QUEUE_WAIT = 3600  # Seconds a pending job may wait in the queue before it can be enqueued again
+REBUILD_STATS_JOB_ID = 'rebuild_stats'
+
+
+def _schedule_periodic_job(app, name, delay):
+    """
+    This function enqueues a run of the periodic job app.tasks.<name> in delay seconds.
+    Every run gets its own job id: rq saves a job under its id, so a run scheduling its next run under its own id
+    would have that run overwritten and expired when it finishes.
+    The id of the latest run is kept in redis, a run that is no longer the latest does not schedule another one,
+    so scheduling the job again replaces the pending chain of runs instead of adding one.
+    The job is enqueued by name, since importing app.tasks creates a second app.
+    """
+    job_id = '%s_%s' % (name, uuid4().hex)
+    app.task_queue.connection.set(PERIODIC_JOB_KEY % name, job_id)
+    return app.task_queue.enqueue_in(timedelta(seconds=delay), 'app.tasks.' + name, job_id=job_id,
+                                     job_timeout=3600)
+
+
+def is_latest_periodic_run(app, name, job_id):
+    """
+    This function returns True if job_id is the latest scheduled run of the periodic job app.tasks.<name>.
+    """
+    latest = app.task_queue.connection.get(PERIODIC_JOB_KEY % name)
+    return latest is None or latest.decode() == job_id
+
+
+def schedule_prune_tokens(app, delay=None):
+    """
+    This function enqueues the next run of app.tasks.prune_tokens on the task queue, see _schedule_periodic_job.
+    """
+    if delay is None:
+        delay = app.config['TOKEN_PRUNE_INTERVAL']
+    return _schedule_periodic_job(app, 'prune_tokens', delay)
+
+
+def schedule_reconcile_credits(app, delay=None):
+    """
+    This function enqueues the next run of app.tasks.reconcile_credits on the task queue, see _schedule_periodic_job.
+    """
+    if delay is None:
+        delay = app.config['CREDIT_RECONCILE_INTERVAL']
+    return _schedule_periodic_job(app, 'reconcile_credits', delay)
+
+
+def enqueue_rebuild_stats(app):
+    """
+    This function enqueues app.tasks.rebuild_stats on the task queue, unless a rebuild is already queued or running,
+    see _enqueue_once. The job, or None if a rebuild is pending, is returned.
+    """
+    return _enqueue_once(app, 'rebuild_stats', job_id=REBUILD_STATS_JOB_ID, job_timeout=3600)
+
+
+def _enqueue_once(app, name, *args, job_id, job_timeout):
+    """
+    This function enqueues app.tasks.<name> unless the job with the same id is still queued or running.
+    It returns the job, or None if the job was already pending.
+    rq saves a job again under an id it already has, so the id alone does not keep a job from running twice.
+    A redis flag set with SET NX marks the job as pending until the job clears it (clear_pending_job),
+    or until it expires, in case the job is lost.
+    """
+    connection = app.task_queue.connection
+    if not connection.set(PENDING_JOB_KEY % job_id, 1, nx=True, ex=PENDING_JOB_QUEUE_WAIT + job_timeout):
+        return None
+    try:
+        return app.task_queue.enqueue('app.tasks.' + name, *args, job_id=job_id, job_timeout=job_timeout)
+    except redis.RedisError:
+        connection.delete(PENDING_JOB_KEY % job_id)
+        raise
+
+
+def clear_pending_job(app, job_id):
+    """
+    This function clears the pending flag of a job enqueued by _enqueue_once, so it can be enqueued again.
+    """
+    app.task_queue.connection.delete(PENDING_JOB_KEY % job_id)
+
+
+def student_qr_code_job_id(student_id):
+    """
+    This function returns the job id of the QR code generation of a student.
+    """
+    return 'student_qr_code_%d' % student_id
+
+
+def enqueue_student_qr_code(app, student_id):
+    """
+    This function enqueues app.tasks.generate_student_qr_code for the student on the task queue,
+    unless the student's job is already queued or running, see _enqueue_once.
+    A failure is only logged, since the QR code api enqueues the job again when the image is asked for.
+    """
+    try:
+        return _enqueue_once(app, 'generate_student_qr_code', student_id, job_id=student_qr_code_job_id(student_id),
+                             job_timeout=60)
+    except redis.RedisError:
+        app.logger.warning('Could not enqueue the QR code generation of student %d.', student_id)
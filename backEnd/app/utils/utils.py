@@ -9,7 +9,7 @@ def datetime_string_to_utc(datetime_string):
     tz_utc = pytz.utc
     try:
         dt = datetime.strptime(datetime_string, '%Y-%m-%dT%H:%M:%S%z')
-    except ValueError:
+    except (TypeError, ValueError):
         return None
     dt_utc = dt.astimezone(tz_utc)
     return dt_utc
@@ -58,6 +58,42 @@ def dt_list_to_UTC_list(dt_list):
     return result
 
 
+MAX_PAGE_SIZE = 500
+SEARCH_PAGE_SIZE = 20  # Results per page of a search without a limit
+
+
+def page_args(params):
+    """
+    This function reads the keyset pagination parameters 'cursor' and 'limit' from the request args or json.
+    The limit is capped at MAX_PAGE_SIZE. A ValueError is raised if the limit is not a positive integer.
+    Without a limit, the whole list after the cursor is returned, which keeps clients that do not paginate working.
+    """
+    params = params or {}
+    cursor = params.get('cursor', None)
+    limit = params.get('limit', None)
+    if limit is not None:
+        limit = int(limit)
+        if limit <= 0:
+            raise ValueError('limit must be positive')
+        limit = min(limit, MAX_PAGE_SIZE)
+    return cursor, limit
+
+
+def month_string_to_int(month_string):
+    """
+    This function converts a 'YYYY-MM' month to the yyyymm integer of the statistics, a ValueError is raised if invalid.
+    """
+    month = datetime.strptime(month_string or '', '%Y-%m')
+    return month.year * 100 + month.month
+
+
+def image_mimetype(image):
+    """
+    This function returns the mimetype of png or jpeg image bytes, wechat QR codes are jpeg unless png is asked for.
+    """
+    return 'image/png' if image.startswith(b'\x89PNG') else 'image/jpeg'
+
+
 class Roles:
     """
     This class serves as the enum for roles.
@@ -70,6 +106,16 @@ class Roles:
     ADMIN = 16
 
 
+class CreditKinds:
+    """
+    This class serves as the enum for the kinds of course credit transactions.
+    """
+    PURCHASE = 'purchase'
+    ATTENDANCE = 'attendance'  # The charge of an attendance call
+    ADJUSTMENT = 'adjustment'
+    REFUND = 'refund'
+
+
 class Relationship:
     FATHER = 1
     MOTHER = 2
@@ -83,6 +129,7 @@ class Relationship:
     AUNT = 10
     PARENT = 11
 
+
 class VALIDATIONS:
     WAITING = 0
     APPROVED = 1
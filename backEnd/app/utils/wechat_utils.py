@@ -1,4 +1,19 @@
-import requests
+import json
+import time
+import uuid
+
+import redis
+from flask import current_app
+
+from app.utils.cache_utils import LocalCache, get_redis
+from app.utils.http_client import wechat_http
+
+
+class WechatAccessTokenError(Exception):
+    """
+    Indicates that no wechat access token could be obtained.
+    """
+    pass
 
 
 def request_wechat_access_token(wechat_appid, wechat_app_secret):
@@ -11,6 +26,140 @@ def request_wechat_access_token(wechat_appid, wechat_app_secret):
         'appid': wechat_appid,
         'secret': wechat_app_secret
     }
-    r = requests.get(wechat_access_token_url, params=payload)
-    print(r.headers)
+    r = wechat_http.get('cgi-bin/token', wechat_access_token_url, params=payload)
     return r.json()
+
+
+class WechatAccessTokenManager:
+    """
+    This class keeps one wechat access token for all the gunicorn workers.
+    The token is stored in redis with its expiration, and refreshed WECHAT_TOKEN_REFRESH_MARGIN seconds
+    before it expires. Only the worker (or thread) holding the redis lock refreshes it,
+    the others keep using the current token, or wait for the new one if there is none.
+    """
+    token_key = 'wechat_access_token'
+    lock_key = 'wechat_access_token_lock'
+
+    def __init__(self, fetch=request_wechat_access_token):
+        self.fetch = fetch
+        self.local = LocalCache(max_size=1)
+
+    def _read(self):
+        try:
+            value = get_redis(current_app).get(self.token_key)
+        except redis.RedisError:
+            return None
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def _refresh(self):
+        result = self.fetch(current_app.config['WECHAT_APPID'], current_app.config['WECHAT_APP_SECRET'])
+        if 'access_token' not in result:
+            raise WechatAccessTokenError(result.get('errmsg', 'No access token in the wechat response'))
+        expires_in = int(result.get('expires_in', 7200))
+        stored = {'access_token': result['access_token'], 'expires_at': time.time() + expires_in}
+        try:
+            get_redis(current_app).set(self.token_key, json.dumps(stored), ex=expires_in)
+        except redis.RedisError:
+            current_app.logger.warning('Could not store the wechat access token in redis.')
+        return stored
+
+    def _acquire_lock(self):
+        lock_id = str(uuid.uuid4())
+        try:
+            acquired = get_redis(current_app).set(self.lock_key, lock_id, nx=True,
+                                                  ex=current_app.config['WECHAT_TOKEN_LOCK_TIMEOUT'])
+        except redis.RedisError:
+            # Without redis there is nothing to coordinate with, refresh in this process.
+            return lock_id
+        return lock_id if acquired else None
+
+    def _release_lock(self, lock_id):
+        try:
+            client = get_redis(current_app)
+            if client.get(self.lock_key) == lock_id.encode():
+                client.delete(self.lock_key)
+        except redis.RedisError:
+            pass
+
+    def _remember(self, stored):
+        ttl = stored['expires_at'] - time.time() - current_app.config['WECHAT_TOKEN_REFRESH_MARGIN']
+        if ttl > 0:
+            self.local.set(self.token_key, stored, ttl=ttl)
+
+    def get_token(self):
+        """
+        This function returns a valid wechat access token, refreshing it when it is about to expire.
+        """
+        stored = self.local.get(self.token_key)
+        if stored:
+            return stored['access_token']
+
+        margin = current_app.config['WECHAT_TOKEN_REFRESH_MARGIN']
+        deadline = time.time() + current_app.config['WECHAT_TOKEN_WAIT_TIMEOUT']
+        while True:
+            stored = self._read()
+            now = time.time()
+            if stored and stored['expires_at'] - now > margin:
+                self._remember(stored)
+                return stored['access_token']
+
+            lock_id = self._acquire_lock()
+            if lock_id:
+                try:
+                    # Another worker may have refreshed the token between the read and the lock.
+                    stored = self._read()
+                    if not stored or stored['expires_at'] - time.time() <= margin:
+                        stored = self._refresh()
+                    self._remember(stored)
+                    return stored['access_token']
+                finally:
+                    self._release_lock(lock_id)
+
+            # Someone else is refreshing, the current token can still be used until it really expires.
+            if stored and stored['expires_at'] > now:
+                return stored['access_token']
+            if now > deadline:
+                raise WechatAccessTokenError('Timed out waiting for the wechat access token refresh')
+            time.sleep(0.05)
+
+    def invalidate(self):
+        """
+        This function drops the stored token, e.g. after wechat rejected it.
+        """
+        self.local.clear()
+        try:
+            get_redis(current_app).delete(self.token_key)
+        except redis.RedisError:
+            pass
+
+
+wechat_token_manager = WechatAccessTokenManager()
+
+
+class WechatQRCodeError(Exception):
+    """
+    Indicates that wechat did not return a QR code image.
+    """
+    pass
+
+
+def request_wechat_qr_code(scene, page=None):
+    """
+    This function requests an unlimited wechat applet QR code for the scene, and returns the image bytes.
+    Wechat answers with json instead of an image when the call failed, then WechatQRCodeError is raised.
+    """
+    wechat_qr_code_url = 'https://api.weixin.qq.com/wxa/getwxacodeunlimit'
+    body = {'scene': scene}
+    if page:
+        body['page'] = page
+    r = wechat_http.post('wxa/getwxacodeunlimit', wechat_qr_code_url,
+                         params={'access_token': wechat_token_manager.get_token()}, json=body)
+    if r.headers.get('Content-Type', '').startswith('image/'):
+        return r.content
+    result = r.json()
+    if result.get('errcode') in (40001, 42001):
+        # The access token was rejected, the next attempt gets a new one.
+        wechat_token_manager.invalidate()
+    raise WechatQRCodeError(result.get('errmsg', 'No image in the wechat response'))
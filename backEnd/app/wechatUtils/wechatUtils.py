@@ -1,13 +1,8 @@
-import requests
-from config import Config
+from app.utils.wechat_utils import wechat_token_manager
 
-def get_wechat_access_token():
-    wechat_access_token_url = 'https://api.weixin.qq.com/cgi-bin/token'
-    payload = {
-        'grant_type':  'client_credential',
-        'appid': Config.WECHAT_APPID,
-        'secret': Config.WECHAT_APP_SECRET
-    }
-    r = requests.get(wechat_access_token_url, params=payload)
 
-    return r.json()
\ No newline at end of file
+def get_wechat_access_token():
+    """
+    This function returns the shared wechat access token, it is only requested from wechat when it is about to expire.
+    """
+    return {'access_token': wechat_token_manager.get_token()}
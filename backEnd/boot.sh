@@ -10,4 +10,4 @@ while true; do
     sleep 5
 done
 
-exec gunicorn -b :5000 --worker-tmp-dir /dev/shm --workers=2 --threads=4 --worker-class=gthread --access-logfile - --error-logfile - flaskAPI:app
+exec gunicorn -b :5000 --worker-tmp-dir /dev/shm --workers=2 --threads=8 --worker-class=gthread --access-logfile - --error-logfile - flaskAPI:app
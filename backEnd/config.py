@@ -5,6 +5,7 @@ from datetime import timedelta
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '.env'))
 
+
 class Config(object):
 
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
@@ -15,6 +16,33 @@ class Config(object):
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=700)
     WECHAT_APPID = os.environ.get('WECHAT_APPID')
     WECHAT_APP_SECRET = os.environ.get('WECHAT_APP_SECRET')
+    WECHAT_TOKEN_REFRESH_MARGIN = 300  # Refresh the wechat access token this many seconds before it expires
+    WECHAT_TOKEN_LOCK_TIMEOUT = 10  # Seconds after which a refresh lock of a dead worker is released
+    WECHAT_TOKEN_WAIT_TIMEOUT = 10  # Seconds to wait for another worker's refresh when there is no valid token
+    WECHAT_HTTP_POOL_SIZE = 10  # Keep-alive connections per worker to the wechat api
+    WECHAT_HTTP_CONNECT_TIMEOUT = 2  # Seconds
+    WECHAT_HTTP_READ_TIMEOUT = 5  # Seconds
+    WECHAT_HTTP_RETRIES = 2  # Retries after the first attempt, for connection errors, timeouts and 5xx
+    WECHAT_HTTP_RETRY_BACKOFF = 0.2  # Seconds, the jittered backoff doubles on each retry
+    WECHAT_HTTP_CIRCUIT_FAILURES = 5  # Failed calls in a row that open the circuit of an endpoint
+    WECHAT_HTTP_CIRCUIT_RESET_TIMEOUT = 30  # Seconds before a trial call is let through an open circuit
+    WECHAT_LOGIN_MAX_CONCURRENCY = 4  # Threads per worker that may wait on jscode2session at once, below --threads
     REDIS_HOST = os.environ.get('REDIS_HOST') or 'localhost'
     REDIS_PORT = os.environ.get('REDIS_PORT') or 6379
+    REDIS_FAKE = False  # Use the in process stand-in of redis instead of a server, for tests.
+    TOKEN_REVOCATION_LOCAL_TTL = 30  # Seconds a worker trusts its own copy of an active token's status
+    TOKEN_REVOCATION_SHARED_TTL = 24 * 3600  # Longest time a token's status is kept in redis
+    TOKEN_REVOCATION_ACTIVE_TTL = 300  # Longest time an active token's status is kept in redis
+    PERMISSION_VERSION_LOCAL_TTL = 30  # Seconds a worker trusts its own copy of a user's permission version
+    PERMISSION_VERSION_SHARED_TTL = 24 * 3600  # Longest time a permission version is kept in redis
+    TOKEN_PRUNE_INTERVAL = 24 * 3600  # Seconds between two runs of the token prune job
+    TOKEN_PRUNE_BATCH_SIZE = 1000  # Tokens deleted per transaction
+    TOKEN_PRUNE_BATCH_PAUSE = 0.1  # Seconds to wait between two batches
+    TOKEN_PRUNE_REVOKED_AGE = 30 * 24 * 3600  # Seconds a revoked token is kept before the prune job deletes it
+    CONDITIONAL_GET_MAX_AGE = 0  # Seconds clients may reuse a polled list before revalidating it with its ETag
+    CREDIT_RECONCILE_INTERVAL = 24 * 3600  # Seconds between two runs of the credit balance reconcile job
+    SEARCH_INDEX_LOCAL_TTL = 30  # Seconds a worker keeps its in-process search index when redis is unavailable
+    QR_CODE_MAX_AGE = 7 * 24 * 3600  # Seconds clients may reuse a student QR code image, an old one still scans
+    WECHAT_QR_CODE_PAGE = os.environ.get('WECHAT_QR_CODE_PAGE')  # Applet page a student QR code opens, None for home
     SUPER_ID = os.environ.get('SUPER_ID')
+    LAZY_CLASS_SERIES = False  # Default of add_class_session's 'lazy' flag: store a weekly series as a rule
@@ -6,9 +6,10 @@
 # Todo:
 #   1. Implement logger
 
-from app import create_app
+from app import create_app, cli
 
 app = create_app()
+cli.register(app)
 
 if __name__ == '__main__':
     # app.run(debug=True, host="0.0.0.0")
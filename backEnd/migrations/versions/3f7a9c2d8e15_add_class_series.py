@@ -0,0 +1,61 @@
+"""add lazily expanded class series
+
+Revision ID: 3f7a9c2d8e15
+Revises: 9b3d61e0c2f4
+Create Date: 2026-10-18 13:41:09.552731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f7a9c2d8e15'
+down_revision = '9b3d61e0c2f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('classSeries',
+    sa.Column('id', sa.String(length=200), nullable=False),
+    sa.Column('course_id', sa.INTEGER(), nullable=True),
+    sa.Column('teacher_id', sa.INTEGER(), nullable=True),
+    sa.Column('deleted', sa.BOOLEAN(), nullable=True),
+    sa.Column('rrule', sa.String(length=500), nullable=True),
+    sa.Column('dtstart', sa.DATETIME(), nullable=True),
+    sa.Column('until', sa.DATETIME(), nullable=True),
+    sa.Column('tz_offset', sa.INTEGER(), nullable=True),
+    sa.Column('duration', sa.INTEGER(), nullable=True),
+    sa.Column('info', sa.String(length=500), nullable=True),
+    sa.Column('create_time', sa.DATETIME(), nullable=True),
+    sa.ForeignKeyConstraint(['course_id'], ['courses.id'], ),
+    sa.ForeignKeyConstraint(['teacher_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_classSeries_teacher_id_deleted', 'classSeries', ['teacher_id', 'deleted'], unique=False)
+    op.create_table('takingSeries',
+    sa.Column('series_id', sa.String(length=200), nullable=False),
+    sa.Column('student_id', sa.INTEGER(), nullable=False),
+    sa.Column('deleted', sa.BOOLEAN(), nullable=True),
+    sa.ForeignKeyConstraint(['series_id'], ['classSeries.id'], ),
+    sa.ForeignKeyConstraint(['student_id'], ['students.id'], ),
+    sa.PrimaryKeyConstraint('series_id', 'student_id')
+    )
+    op.create_index('ix_takingSeries_student_id_deleted', 'takingSeries', ['student_id', 'deleted'], unique=False)
+    op.create_table('seriesExceptions',
+    sa.Column('series_id', sa.String(length=200), nullable=False),
+    sa.Column('occurrence_time', sa.DATETIME(), nullable=False),
+    sa.Column('session_id', sa.INTEGER(), nullable=True),
+    sa.ForeignKeyConstraint(['series_id'], ['classSeries.id'], ),
+    sa.ForeignKeyConstraint(['session_id'], ['classSessions.id'], ),
+    sa.PrimaryKeyConstraint('series_id', 'occurrence_time')
+    )
+
+
+def downgrade():
+    op.drop_table('seriesExceptions')
+    op.drop_index('ix_takingSeries_student_id_deleted', table_name='takingSeries')
+    op.drop_table('takingSeries')
+    op.drop_index('ix_classSeries_teacher_id_deleted', table_name='classSeries')
+    op.drop_table('classSeries')
@@ -0,0 +1,49 @@
+"""add indexes for the hot lookup columns
+
+Revision ID: 5c2e8a7f41b3
+Revises: 1d666d8e7781
+Create Date: 2026-10-18 09:12:40.418310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8a7f41b3'
+down_revision = '1d666d8e7781'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The index columns follow the filters in app/dbUtils/dbUtils.py: the equality column first, then deleted.
+    # phone and openid are only unique among undeleted users, which MySQL can not express,
+    # so they get plain indexes. Every jti is a fresh uuid4, so jti is unique.
+    with op.batch_alter_table('token_blacklist') as batch_op:
+        batch_op.create_unique_constraint('uq_token_blacklist_jti', ['jti'])
+    op.create_index('ix_token_blacklist_user_id_revoked', 'token_blacklist', ['user_id', 'revoked'], unique=False)
+    op.create_index('ix_token_blacklist_expires', 'token_blacklist', ['expires'], unique=False)
+    op.create_index('ix_users_phone_deleted', 'users', ['phone', 'deleted'], unique=False)
+    op.create_index('ix_users_openid_deleted', 'users', ['openid', 'deleted'], unique=False)
+    op.create_index('ix_users_roles_validated_deleted', 'users', ['roles', 'validated', 'deleted'], unique=False)
+    op.create_index('ix_classSessions_start_time_deleted', 'classSessions', ['start_time', 'deleted'], unique=False)
+    op.create_index('ix_classSessions_series_id', 'classSessions', ['series_id'], unique=False)
+    op.create_index('ix_teachings_teacher_id_deleted', 'teachings', ['teacher_id', 'deleted'], unique=False)
+    op.create_index('ix_takingClasses_student_id_deleted', 'takingClasses', ['student_id', 'deleted'], unique=False)
+    op.create_index('ix_parenthoods_parent_id_deleted', 'parenthoods', ['parent_id', 'deleted'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_parenthoods_parent_id_deleted', table_name='parenthoods')
+    op.drop_index('ix_takingClasses_student_id_deleted', table_name='takingClasses')
+    op.drop_index('ix_teachings_teacher_id_deleted', table_name='teachings')
+    op.drop_index('ix_classSessions_series_id', table_name='classSessions')
+    op.drop_index('ix_classSessions_start_time_deleted', table_name='classSessions')
+    op.drop_index('ix_users_roles_validated_deleted', table_name='users')
+    op.drop_index('ix_users_openid_deleted', table_name='users')
+    op.drop_index('ix_users_phone_deleted', table_name='users')
+    op.drop_index('ix_token_blacklist_expires', table_name='token_blacklist')
+    op.drop_index('ix_token_blacklist_user_id_revoked', table_name='token_blacklist')
+    with op.batch_alter_table('token_blacklist') as batch_op:
+        batch_op.drop_constraint('uq_token_blacklist_jti', type_='unique')
@@ -0,0 +1,27 @@
+"""put deleted before start_time in the class sessions time index
+
+Revision ID: 6324f5df6723
+Revises: 68a993161217
+Create Date: 2026-10-18 21:05:37.214906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6324f5df6723'
+down_revision = '68a993161217'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # deleted is filtered by equality and start_time by range, so the equality column comes first.
+    op.drop_index('ix_classSessions_start_time_deleted', table_name='classSessions')
+    op.create_index('ix_classSessions_deleted_start_time', 'classSessions', ['deleted', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_classSessions_deleted_start_time', table_name='classSessions')
+    op.create_index('ix_classSessions_start_time_deleted', 'classSessions', ['start_time', 'deleted'], unique=False)
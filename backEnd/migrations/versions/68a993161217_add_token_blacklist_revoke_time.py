@@ -0,0 +1,33 @@
+"""add token_blacklist.revoke_time
+
+Revision ID: 68a993161217
+Revises: 90757fc7ed05
+Create Date: 2026-10-18 18:54:23.832199
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '68a993161217'
+down_revision = '90757fc7ed05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('token_blacklist', sa.Column('revoke_time', sa.DATETIME(), nullable=True))
+    op.create_index('ix_token_blacklist_revoked_revoke_time', 'token_blacklist', ['revoked', 'revoke_time'], unique=False)
+
+    # Tokens revoked before this revision are kept for the full retention from now on.
+    tokens = sa.table('token_blacklist', sa.column('revoked', sa.BOOLEAN()), sa.column('revoke_time', sa.DATETIME()))
+    op.get_bind().execute(tokens.update().where(tokens.c.revoked == True).values(revoke_time=datetime.utcnow()))
+
+
+def downgrade():
+    op.drop_index('ix_token_blacklist_revoked_revoke_time', table_name='token_blacklist')
+    with op.batch_alter_table('token_blacklist') as batch_op:
+        batch_op.drop_column('revoke_time')
@@ -0,0 +1,50 @@
+"""add the course credit ledger
+
+Revision ID: 7e4b2c9a1d36
+Revises: 3f7a9c2d8e15
+Create Date: 2026-10-18 18:52:30.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e4b2c9a1d36'
+down_revision = '3f7a9c2d8e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('creditTransactions',
+    sa.Column('id', sa.INTEGER(), nullable=False),
+    sa.Column('student_id', sa.INTEGER(), nullable=False),
+    sa.Column('course_id', sa.INTEGER(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('amount', sa.INTEGER(), nullable=False),
+    sa.Column('balance', sa.INTEGER(), nullable=False),
+    sa.Column('session_id', sa.INTEGER(), nullable=True),
+    sa.Column('operator_id', sa.INTEGER(), nullable=True),
+    sa.Column('create_time', sa.DATETIME(), nullable=False),
+    sa.Column('comments', sa.String(length=500), nullable=True),
+    sa.ForeignKeyConstraint(['course_id'], ['courses.id'], ),
+    sa.ForeignKeyConstraint(['operator_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['session_id'], ['classSessions.id'], ),
+    sa.ForeignKeyConstraint(['student_id'], ['students.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_creditTransactions_create_time_kind', 'creditTransactions', ['create_time', 'kind'], unique=False)
+    op.create_index('ix_creditTransactions_student_course_time', 'creditTransactions', ['student_id', 'course_id', 'create_time'], unique=False)
+
+    # The existing balances have no history, each one starts the ledger with an opening adjustment.
+    op.execute('UPDATE courseCredits SET credit = 0 WHERE credit IS NULL')
+    op.execute("INSERT INTO creditTransactions (student_id, course_id, kind, amount, balance, create_time, comments) "
+               "SELECT student_id, course_id, 'adjustment', credit, credit, CURRENT_TIMESTAMP, 'Opening balance' "
+               "FROM courseCredits")
+
+
+def downgrade():
+    op.drop_index('ix_creditTransactions_student_course_time', table_name='creditTransactions')
+    op.drop_index('ix_creditTransactions_create_time_kind', table_name='creditTransactions')
+    op.drop_table('creditTransactions')
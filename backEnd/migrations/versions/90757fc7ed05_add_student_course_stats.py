@@ -0,0 +1,37 @@
+"""add the monthly student course statistics
+
+Revision ID: 90757fc7ed05
+Revises: d47e0a9c3b12
+Create Date: 2026-10-18 18:34:54.806059
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '90757fc7ed05'
+down_revision = 'd47e0a9c3b12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('studentCourseStats',
+    sa.Column('student_id', sa.INTEGER(), nullable=False),
+    sa.Column('course_id', sa.INTEGER(), nullable=False),
+    sa.Column('month', sa.INTEGER(), nullable=False),
+    sa.Column('scheduled', sa.INTEGER(), nullable=False),
+    sa.Column('attended', sa.INTEGER(), nullable=False),
+    sa.Column('credits_charged', sa.INTEGER(), nullable=False),
+    sa.ForeignKeyConstraint(['course_id'], ['courses.id'], ),
+    sa.ForeignKeyConstraint(['student_id'], ['students.id'], ),
+    sa.PrimaryKeyConstraint('student_id', 'course_id', 'month')
+    )
+    op.create_index('ix_studentCourseStats_course_month', 'studentCourseStats', ['course_id', 'month'], unique=False)
+    # The statistics of the existing sessions are built by `flask stats rebuild`, not here.
+
+
+def downgrade():
+    op.drop_index('ix_studentCourseStats_course_month', table_name='studentCourseStats')
+    op.drop_table('studentCourseStats')
@@ -0,0 +1,25 @@
+"""add users.perm_version
+
+Revision ID: 9b3d61e0c2f4
+Revises: 5c2e8a7f41b3
+Create Date: 2026-10-18 11:03:27.120854
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3d61e0c2f4'
+down_revision = '5c2e8a7f41b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('perm_version', sa.INTEGER(), server_default='0', nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('perm_version')
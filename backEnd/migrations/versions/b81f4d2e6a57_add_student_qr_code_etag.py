@@ -0,0 +1,37 @@
+"""add students.qr_code_etag
+
+Revision ID: b81f4d2e6a57
+Revises: 7e4b2c9a1d36
+Create Date: 2026-10-18 20:14:06.527311
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81f4d2e6a57'
+down_revision = '7e4b2c9a1d36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('students', sa.Column('qr_code_etag', sa.String(length=40), nullable=True))
+
+    # QR codes stored before this revision get their etag here.
+    connection = op.get_bind()
+    students = sa.table('students', sa.column('id', sa.INTEGER()), sa.column('qr_code', sa.BLOB()),
+                        sa.column('qr_code_etag', sa.String(length=40)))
+    rows = connection.execute(sa.select([students.c.id, students.c.qr_code])
+                              .where(students.c.qr_code.isnot(None))).fetchall()
+    for student_id, qr_code in rows:
+        connection.execute(students.update().where(students.c.id == student_id)
+                           .values(qr_code_etag=hashlib.sha1(qr_code).hexdigest()))
+
+
+def downgrade():
+    with op.batch_alter_table('students') as batch_op:
+        batch_op.drop_column('qr_code_etag')
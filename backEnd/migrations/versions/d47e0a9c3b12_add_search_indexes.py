@@ -0,0 +1,29 @@
+"""add the name and phone search indexes
+
+Revision ID: d47e0a9c3b12
+Revises: b81f4d2e6a57
+Create Date: 2026-10-18 21:37:42.804519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd47e0a9c3b12'
+down_revision = 'b81f4d2e6a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FULLTEXT with the ngram parser on MySQL, the prefix and parser are ignored by other DBs.
+    op.create_index('ft_students_real_name', 'students', ['real_name'], unique=False,
+                    mysql_prefix='FULLTEXT', mysql_with_parser='ngram')
+    op.create_index('ft_users_search', 'users', ['real_name', 'nick_name', 'phone'], unique=False,
+                    mysql_prefix='FULLTEXT', mysql_with_parser='ngram')
+
+
+def downgrade():
+    op.drop_index('ft_users_search', table_name='users')
+    op.drop_index('ft_students_real_name', table_name='students')
@@ -0,0 +1,214 @@
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+from flask import _app_ctx_stack
+
+from config import Config
+from app import create_app, db
+from app.api.auth.auth_utils import issue_tokens
+from app.api.auth.permission_cache import permission_cache
+from app.api.auth.revocation_cache import revocation_cache
+from app.models import User
+from app.utils.cache_utils import get_redis
+from app.utils.http_client import wechat_http
+from app.utils.search_utils import search_indexes
+from app.utils.utils import Roles, VALIDATIONS
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    REDIS_FAKE = True
+
+
+class FakeJob:
+    """
+    This class stands in for an rq job, it keeps the call of the job and its meta.
+    """
+    def __init__(self, job_id, func_name, args=(), kwargs=None, status='queued'):
+        self.id = job_id
+        self.func_name = func_name
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.meta = {}
+        self.status = status
+
+    def get_status(self):
+        return self.status
+
+    def save_meta(self):
+        pass
+
+
+class FakeQueue:
+    """
+    This class stands in for the rq queue of the app, since the tests run without a redis server.
+    Enqueued jobs are only recorded, a job saved again under its id replaces the older one like in rq.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.jobs = {}
+        self.calls = []
+
+    def enqueue(self, func_name, *args, job_id=None, job_timeout=None, **kwargs):
+        job = FakeJob(job_id, func_name, args, kwargs)
+        self.jobs[job_id] = job
+        self.calls.append(job)
+        return job
+
+    def enqueue_in(self, time_delta, func_name, *args, job_id=None, job_timeout=None, **kwargs):
+        job = FakeJob(job_id, func_name, args, kwargs, status='scheduled')
+        self.jobs[job_id] = job
+        self.calls.append(job)
+        return job
+
+    def fetch_job(self, job_id):
+        return self.jobs.get(job_id)
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app(TestConfig)
+    app.task_queue = FakeQueue(get_redis(app))
+    return app
+
+
+@pytest.fixture(autouse=True)
+def database(app):
+    with app.app_context():
+        db.create_all()
+    yield db
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+    get_redis(app).flushall()
+    revocation_cache.local.clear()
+    permission_cache.local.clear()
+    search_indexes._indexes.clear()
+    app.task_queue.jobs.clear()
+    app.task_queue.calls.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(roles=Roles.ADMIN, validated=VALIDATIONS.APPROVED, **kwargs):
+        with app.app_context():
+            user = User(roles=roles, validated=validated, **kwargs)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return make_user
+
+
+@pytest.fixture
+def auth_header(app):
+    def auth_header(user_id):
+        with app.app_context():
+            token = issue_tokens(User.query.get(user_id))['access_token']
+        return {'Authorization': 'Bearer ' + token}
+    return auth_header
+
+
+@pytest.fixture(scope='session')
+def tasks(app):
+    """
+    This fixture imports app.tasks on the test app, app.tasks otherwise creates its own app from Config.
+    The app context that app.tasks pushes on import is popped again, so requests of the tests get their own.
+    """
+    import app as app_package
+    create_app = app_package.create_app
+    app_package.create_app = lambda: app
+    try:
+        import app.tasks as tasks
+    finally:
+        app_package.create_app = create_app
+    _app_ctx_stack.top.pop()
+    return tasks
+
+
+@pytest.fixture
+def run_job(tasks, monkeypatch):
+    """
+    This fixture runs func() as the rq job `job`, like a worker would.
+    """
+    def run_job(job, func):
+        monkeypatch.setattr(tasks, 'get_current_job', lambda: job)
+        with tasks.app.app_context():
+            return func()
+    return run_job
+
+
+class WechatStubHandler(BaseHTTPRequestHandler):
+    """
+    This class answers every GET like the wechat api, after the delay and with the status set on its server.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits += 1
+            hits = self.server.hits
+        time.sleep(self.server.delay)
+        if urlsplit(self.path).path == '/cgi-bin/token':
+            result = {'access_token': 'token-%d' % hits, 'expires_in': self.server.expires_in}
+        else:
+            result = {'openid': 'openid-%d' % hits, 'session_key': 'key'}
+        body = json.dumps(result).encode()
+        try:
+            self.send_response(self.server.status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except ConnectionError:
+            # The caller timed out and closed the connection.
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def wechat_stub():
+    """
+    This fixture runs a local stand-in of the wechat api, its delay, status and token lifetime can be changed
+    by the tests.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WechatStubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.delay = 0
+    server.status = 200
+    server.hits = 0
+    server.expires_in = 7200
+    server.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stubbed_wechat_http(wechat_stub, monkeypatch):
+    """
+    This fixture sends the calls of wechat_http to the wechat stub, with fresh circuit breakers and metrics.
+    """
+    class StubSession(requests.Session):
+        def request(self, method, url, **kwargs):
+            return super().request(method, wechat_stub.url + urlsplit(url).path, **kwargs)
+
+    monkeypatch.setattr(wechat_http, '_session', StubSession())
+    monkeypatch.setattr(wechat_http, 'breakers', {})
+    monkeypatch.setattr(wechat_http, 'metrics', {})
+    return wechat_http
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app import db
+from app.dbUtils.dbUtils import record_attendance
+from app.models import Course, Student, ClassSession, CourseCredit, CreditTransaction
+from app.utils.utils import Roles
+
+
+def test_credit_row_inserted_meanwhile(app, make_user):
+    teacher_id = make_user(Roles.TEACHER)
+    with app.app_context():
+        course = Course(name='Piano', deleted=False)
+        student = Student(real_name='Student', deleted=False)
+        db.session.add_all([course, student])
+        db.session.flush()
+        class_session = ClassSession(course_id=course.id, start_time=datetime(2021, 3, 1, 8), duration=60)
+        db.session.add(class_session)
+        db.session.commit()
+
+        inserted = []
+
+        def buy_credits_first(conn, cursor, statement, parameters, context, executemany):
+            # Another transaction inserts the credit row after it was read here, before it is inserted here.
+            if statement.startswith(('SAVEPOINT', 'INSERT INTO "courseCredits"')) and not inserted:
+                inserted.append(True)
+                cursor.connection.execute('INSERT INTO "courseCredits" (student_id, course_id, deleted, credit) '
+                                          'VALUES (?, ?, 0, 9)', (student.id, course.id))
+
+        event.listen(db.engine, 'before_cursor_execute', buy_credits_first)
+        try:
+            assert record_attendance(class_session, teacher_id, [{'student_id': student.id, 'attended': True}])
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', buy_credits_first)
+
+        assert db.session.query(CourseCredit.credit).filter_by(student_id=student.id, course_id=course.id)\
+            .scalar() == 8
+        assert db.session.query(CreditTransaction.balance).filter_by(student_id=student.id).scalar() == 8
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta, timezone
+
+from app import db
+from app.dbUtils.dbUtils import insert_lazy_class_series, update_class_series, query_teacher_series, \
+    expand_series, resolve_class_session
+from app.models import Course, ClassSession, SeriesException, Teaching
+from app.utils.recurrence_utils import occurrence_id, shift_rule_weekdays, weekly_rule
+from app.utils.utils import Roles
+
+CHINA = timezone(timedelta(hours=8))
+
+
+def test_shift_rule_weekdays():
+    rule = weekly_rule([0, 2])
+    monday_7am_utc = datetime(2021, 3, 1, 7)
+    assert shift_rule_weekdays(rule, monday_7am_utc, 0, 60) == rule
+    assert shift_rule_weekdays(rule, monday_7am_utc, 0, -8 * 60) == 'FREQ=WEEKLY;INTERVAL=1;WKST=MO;BYDAY=SU,TU'
+    assert shift_rule_weekdays(rule, monday_7am_utc, 0, 7 * 24 * 60) == rule
+    # 07:00 in UTC+8 is 23:00 of the day before in UTC, the weekdays follow the local date.
+    assert shift_rule_weekdays(rule, datetime(2021, 2, 28, 23), 8 * 60, 17 * 60) == \
+        'FREQ=WEEKLY;INTERVAL=1;WKST=MO;BYDAY=TU,TH'
+
+
+def test_shift_across_local_midnight_keeps_exceptions(app, make_user):
+    teacher_id = make_user(Roles.TEACHER)
+    with app.app_context():
+        course = Course(name='Piano', deleted=False)
+        db.session.add(course)
+        db.session.flush()
+        # Mondays 07:00 in China for four weeks.
+        start = datetime(2021, 3, 1, 7, tzinfo=CHINA)
+        insert_lazy_class_series('series-1', course.id, start, start + timedelta(days=21, hours=1), [0], 60, None,
+                                 teacher_id, [])
+        db.session.commit()
+        window = (datetime(2021, 2, 20), datetime(2021, 4, 1))
+        occurrences = [time for _, _, time in expand_series(query_teacher_series(teacher_id, *window), *window)]
+        assert len(occurrences) == 4
+
+        db.session.add(SeriesException(series_id='series-1', occurrence_time=occurrences[1], session_id=None))
+        materialized = resolve_class_session(occurrence_id('series-1', occurrences[2]))
+        db.session.commit()
+
+        # Move every class to Sunday 23:00, the day before in local time.
+        update_class_series('series-1', shift_minutes=-8 * 60)
+        db.session.commit()
+
+        shifted = [time for _, _, time in expand_series(query_teacher_series(teacher_id, *window), *window)]
+        assert shifted == [occurrences[0] - timedelta(hours=8), occurrences[3] - timedelta(hours=8)]
+        assert db.session.query(ClassSession.start_time).filter(ClassSession.id == materialized.id).scalar() == \
+            occurrences[2] - timedelta(hours=8)
+
+
+def test_session_pages_are_cut_to_limit(app, client, make_user, auth_header):
+    teacher_id = make_user(Roles.TEACHER)
+    with app.app_context():
+        course = Course(name='Piano', deleted=False)
+        db.session.add(course)
+        db.session.flush()
+        # Every day of March at 08:00 UTC, and a few sessions, one of them at the time of an occurrence.
+        start = datetime(2021, 3, 1, 8, tzinfo=timezone.utc)
+        insert_lazy_class_series('series-1', course.id, start, start + timedelta(days=30, hours=1), list(range(7)), 60,
+                                 None, teacher_id, [])
+        for day in range(0, 30, 3):
+            class_session = ClassSession(course_id=course.id, start_time=datetime(2021, 3, 1 + day, 8 if day else 9),
+                                         duration=60)
+            db.session.add(class_session)
+            db.session.flush()
+            db.session.add(Teaching(session_id=class_session.id, teacher_id=teacher_id, deleted=False))
+        db.session.commit()
+    headers = auth_header(teacher_id)
+    body = {'start_time': '2021-03-01T00:00:00+0000', 'end_time': '2021-04-01T00:00:00+0000'}
+
+    for url in ('/api/v1.0/class_sessions', '/api/v1.0/teacher_sessions'):
+        everything = client.post(url, json=body, headers=headers).get_json()
+        assert len(everything['message']) == 41 and everything['next_cursor'] is None
+
+        pages = []
+        cursor = None
+        while True:
+            page = client.post(url, json=dict(body, limit=7, cursor=cursor), headers=headers).get_json()
+            assert len(page['message']) <= 7
+            pages.extend(page['message'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        assert pages == everything['message']
+
+
+def test_shifted_occurrences_resolve_to_their_exceptions(app, make_user):
+    teacher_id = make_user(Roles.TEACHER)
+    with app.app_context():
+        course = Course(name='Piano', deleted=False)
+        db.session.add(course)
+        db.session.flush()
+        start = datetime(2021, 3, 1, 8, tzinfo=timezone.utc)
+        insert_lazy_class_series('series-1', course.id, start, start + timedelta(days=21, hours=1), [0], 60, None,
+                                 teacher_id, [])
+        cancelled, materialized_time = datetime(2021, 3, 8, 8), datetime(2021, 3, 15, 8)
+        db.session.add(SeriesException(series_id='series-1', occurrence_time=cancelled, session_id=None))
+        materialized = resolve_class_session(occurrence_id('series-1', materialized_time))
+        db.session.commit()
+
+        update_class_series('series-1', shift_minutes=90)
+        db.session.commit()
+
+        shift = timedelta(minutes=90)
+        assert resolve_class_session(occurrence_id('series-1', cancelled + shift)) is None
+        assert resolve_class_session(occurrence_id('series-1', materialized_time + shift)).id == materialized.id
+        assert ClassSession.query.filter(ClassSession.start_time == materialized_time + shift).count() == 1
+        assert SeriesException.query.filter(SeriesException.occurrence_time == cancelled + shift).count() == 1
+        db.session.commit()
+        assert ClassSession.query.count() == 1
@@ -0,0 +1,66 @@
+"""
+Benchmark of creating a recurring series: one ORM object per session, teaching and taking class row
+(the former add_class_session) against the bulk inserts of insert_class_series, over series sizes.
+Run with python -m pytest -m benchmark -s to see the results.
+"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.dbUtils.dbUtils import insert_class_series
+from app.models import User, Course, Student, ClassSession, Teaching, TakingClass
+from app.utils.utils import Roles
+
+STUDENTS = 20
+SIZES = (26, 78, 156)  # Sessions of a term at once a week, and of a year at one and three days a week
+
+
+def _insert_orm(series_id, course_id, start_times_utc, teacher_id, student_ids):
+    for start_time_utc in start_times_utc:
+        class_session = ClassSession(course_id=course_id, series_id=series_id, start_time=start_time_utc, duration=60)
+        db.session.add(class_session)
+        db.session.add(Teaching(class_session=class_session, teacher_id=teacher_id))
+        for student_id in student_ids:
+            db.session.add(TakingClass(class_session=class_session, student_id=student_id))
+
+
+def _insert_bulk(series_id, course_id, start_times_utc, teacher_id, student_ids):
+    insert_class_series(series_id, course_id, start_times_utc, 60, None, teacher_id, student_ids)
+
+
+def _rows(series_id):
+    sessions = db.session.query(ClassSession.id).filter(ClassSession.series_id == series_id)
+    return (sessions.count(),
+            Teaching.query.filter(Teaching.session_id.in_(sessions)).count(),
+            TakingClass.query.filter(TakingClass.session_id.in_(sessions)).count())
+
+
+@pytest.mark.benchmark
+def test_bulk_series_insert_is_faster(app):
+    with app.app_context():
+        teacher = User(roles=Roles.TEACHER)
+        course = Course(name='Piano', deleted=False)
+        students = [Student(real_name='Student %d' % i, deleted=False) for i in range(STUDENTS)]
+        db.session.add_all([teacher, course] + students)
+        db.session.commit()
+        teacher_id, course_id = teacher.id, course.id
+        student_ids = [student.id for student in students]
+
+        print()
+        results = {}
+        for size in SIZES:
+            start_times_utc = [datetime(2021, 3, 1, 8) + timedelta(days=7 * i) for i in range(size)]
+            for name, insert in (('orm', _insert_orm), ('bulk', _insert_bulk)):
+                series_id = '%s-%d' % (name, size)
+                start = time.perf_counter()
+                insert(series_id, course_id, start_times_utc, teacher_id, student_ids)
+                db.session.commit()
+                results[name, size] = time.perf_counter() - start
+                assert _rows(series_id) == (size, size, size * STUDENTS)
+                db.session.expunge_all()
+            print('%4d sessions, %5d rows: %7.1f ms orm %7.1f ms bulk' % (
+                size, size * (STUDENTS + 2), results['orm', size] * 1000, results['bulk', size] * 1000))
+
+        assert results['bulk', SIZES[-1]] < results['orm', SIZES[-1]] / 2
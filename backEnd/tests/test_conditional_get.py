@@ -0,0 +1,73 @@
+from app import db
+from app.models import Course, Student
+from app.utils.etag_utils import mark_tables_changed
+from app.utils.utils import Roles
+
+
+def _get_courses(client, etag=None):
+    headers = {'If-None-Match': '"%s"' % etag} if etag else {}
+    return client.get('/api/v1.0/courses', headers=headers)
+
+
+def test_matching_etag_is_answered_with_304(app, client):
+    with app.app_context():
+        db.session.add(Course(name='Piano', deleted=False))
+        db.session.commit()
+
+    response = _get_courses(client)
+    assert response.status_code == 201
+    etag, _ = response.get_etag()
+    assert etag and 'max-age' in response.headers['Cache-Control']
+
+    cached = _get_courses(client, etag)
+    assert cached.status_code == 304
+    assert cached.get_data() == b''
+    assert cached.get_etag()[0] == etag
+    assert _get_courses(client, 'other').status_code == 201
+
+
+def test_writes_to_a_listed_table_change_the_etag(app, client):
+    with app.app_context():
+        db.session.add(Course(name='Piano', deleted=False))
+        db.session.commit()
+    etag = _get_courses(client).get_etag()[0]
+
+    # A write to a table the api does not read, and a rolled back write, keep the ETag.
+    with app.app_context():
+        db.session.add(Student(real_name='Student', deleted=False))
+        db.session.commit()
+        db.session.add(Course(name='Violin', deleted=False))
+        db.session.flush()
+        db.session.rollback()
+    assert _get_courses(client, etag).status_code == 304
+
+    # An ORM write.
+    with app.app_context():
+        db.session.add(Course(name='Violin', deleted=False))
+        db.session.commit()
+    response = _get_courses(client, etag)
+    assert response.status_code == 201
+    orm_etag = response.get_etag()[0]
+    assert orm_etag != etag
+
+    # A Core statement is only seen through mark_tables_changed.
+    with app.app_context():
+        db.session.execute(Course.__table__.update().where(Course.name == 'Violin').values(name='Cello'))
+        db.session.commit()
+    assert _get_courses(client, orm_etag).status_code == 304
+    with app.app_context():
+        db.session.execute(Course.__table__.update().where(Course.name == 'Cello').values(name='Viola'))
+        mark_tables_changed(Course.__table__.name)
+        db.session.commit()
+    response = _get_courses(client, orm_etag)
+    assert response.status_code == 201
+    assert response.get_etag()[0] != orm_etag
+    assert 'Viola' in {course['name'] for course in response.get_json()['message']}
+
+
+def test_private_etag_depends_on_the_user(app, client, make_user, auth_header):
+    first = auth_header(make_user(Roles.TEACHER))
+    second = auth_header(make_user(Roles.TEACHER))
+    etag = client.get('/api/v1.0/students', headers=first).get_etag()[0]
+    assert client.get('/api/v1.0/students', headers=dict(first, **{'If-None-Match': '"%s"' % etag})).status_code == 304
+    assert client.get('/api/v1.0/students', headers=dict(second, **{'If-None-Match': '"%s"' % etag})).status_code == 201
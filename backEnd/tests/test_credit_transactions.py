@@ -0,0 +1,52 @@
+import pytest
+
+from app import db
+from app.models import Course, Student, CourseCredit, CreditTransaction
+from app.utils.utils import Roles, CreditKinds
+
+
+@pytest.fixture
+def course_and_student(app):
+    with app.app_context():
+        course = Course(name='Piano', deleted=False)
+        student = Student(real_name='Student', deleted=False)
+        deleted_student = Student(real_name='Deleted', deleted=True)
+        db.session.add_all([course, student, deleted_student])
+        db.session.commit()
+        return course.id, student.id, deleted_student.id
+
+
+@pytest.mark.parametrize('url, body', [
+    ('/api/v1.0/credit_transaction', {'amount': 10}),
+    ('/api/v1.0/course_credit', {'course_credit': 10}),
+])
+def test_unknown_student_or_course_is_rejected(app, client, make_user, auth_header, course_and_student, url, body):
+    course_id, student_id, deleted_student_id = course_and_student
+    headers = auth_header(make_user(Roles.ADMIN))
+    for bad_course_id, bad_student_id, message in [(course_id, 9999, "Student does not exist"),
+                                                   (course_id, deleted_student_id, "Student does not exist"),
+                                                   (course_id, None, "Student does not exist"),
+                                                   (9999, student_id, "Course does not exist")]:
+        response = client.post(url, json=dict(body, course_id=bad_course_id, student_id=bad_student_id),
+                               headers=headers)
+        assert response.status_code == 400
+        assert response.get_json()['message'] == message
+    with app.app_context():
+        assert CourseCredit.query.count() == 0
+        assert CreditTransaction.query.count() == 0
+
+
+def test_only_a_purchase_starts_a_credit(app, client, make_user, auth_header, course_and_student):
+    course_id, student_id, _ = course_and_student
+    headers = auth_header(make_user(Roles.ADMIN))
+    body = {'course_id': course_id, 'student_id': student_id}
+
+    refund = client.post('/api/v1.0/credit_transaction', json=dict(body, amount=-2, kind=CreditKinds.REFUND),
+                         headers=headers)
+    assert refund.status_code == 400
+
+    purchase = client.post('/api/v1.0/credit_transaction', json=dict(body, amount=10), headers=headers)
+    assert purchase.status_code == 201 and purchase.get_json()['balance'] == 10
+    refund = client.post('/api/v1.0/credit_transaction', json=dict(body, amount=-2, kind=CreditKinds.REFUND),
+                         headers=headers)
+    assert refund.status_code == 201 and refund.get_json()['balance'] == 8
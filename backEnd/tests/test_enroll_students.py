@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.dbUtils import dbUtils
+from app.dbUtils.dbUtils import enroll_students, rebuild_student_course_stats, _taking_class_stats
+from app.models import Course, Student, ClassSession, TakingClass, StudentCourseStat
+
+
+def _taking_rows():
+    return {(row.session_id, row.student_id): (row.comments, row.deleted, row.attended)
+            for row in TakingClass.query}
+
+
+def _stat_rows():
+    return {(row.student_id, row.course_id, row.month): [row.scheduled, row.attended, row.credits_charged]
+            for row in StudentCourseStat.query}
+
+
+@pytest.mark.parametrize('chunk_size, session_count', [(7, 40), (dbUtils.BULK_CHUNK_SIZE, dbUtils.BULK_CHUNK_SIZE + 10)])
+def test_batched_enrollment_matches_per_row(app, monkeypatch, chunk_size, session_count):
+    monkeypatch.setattr(dbUtils, 'BULK_CHUNK_SIZE', chunk_size)
+    with app.app_context():
+        courses = [Course(name='Piano', deleted=False), Course(name='Violin', deleted=False)]
+        students = [Student(real_name='Student %d' % i, deleted=False) for i in range(4)]
+        db.session.add_all(courses + students)
+        db.session.flush()
+        # The sessions alternate between the courses and spread over two months.
+        sessions = [ClassSession(course_id=courses[i % 2].id, start_time=datetime(2021, 3, 20) + timedelta(days=i % 20),
+                                 duration=60) for i in range(session_count)]
+        db.session.add_all(sessions)
+        db.session.flush()
+        session_ids = [class_session.id for class_session in sessions]
+        student_ids = [student.id for student in students[:3]]
+        # An enrolled row, a soft deleted attended row, and a row of a student who is not enrolled again.
+        db.session.add_all([
+            TakingClass(session_id=session_ids[0], student_id=student_ids[0], comments='old', deleted=False,
+                        attended=True),
+            TakingClass(session_id=session_ids[-1], student_id=student_ids[1], comments='old', deleted=True,
+                        attended=True),
+            TakingClass(session_id=session_ids[1], student_id=students[3].id, comments='other', deleted=False),
+        ])
+        db.session.commit()
+        rebuild_student_course_stats()
+        db.session.commit()
+
+        # What enrolling one pair at a time gives: every pair enrolled with the new comments, attended kept.
+        expected = _taking_rows()
+        for session_id in session_ids:
+            for student_id in student_ids:
+                comments, deleted, attended = expected.get((session_id, student_id), (None, False, False))
+                expected[(session_id, student_id)] = ('new', False, attended)
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            # Duplicated ids are enrolled once.
+            inserted = enroll_students(session_ids + session_ids[:3], student_ids + student_ids[:1], 'new')
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        assert inserted == session_count * len(student_ids) - 2
+        assert _taking_rows() == expected
+        # The statistics were kept up to date by the upserts, they match a count of the taking class rows.
+        assert _stat_rows() == {key: delta for key, delta in _taking_class_stats().items() if any(delta)}
+        # A few statements per chunk of sessions, not one per row.
+        chunks = -(-session_count // chunk_size)
+        assert len(statements) <= 3 * chunks + -(-inserted // chunk_size) + 10
@@ -0,0 +1,84 @@
+import socket
+
+import pytest
+
+from app.utils.http_client import OutboundClient, UpstreamUnavailable
+
+
+@pytest.fixture
+def fast_retries(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'WECHAT_HTTP_READ_TIMEOUT', 0.2)
+    monkeypatch.setitem(app.config, 'WECHAT_HTTP_RETRY_BACKOFF', 0.01)
+
+
+def test_idempotent_call_is_retried(app, wechat_stub, stubbed_wechat_http, fast_retries):
+    wechat_stub.status = 502
+    with app.app_context():
+        with pytest.raises(UpstreamUnavailable):
+            stubbed_wechat_http.get('cgi-bin/token', 'https://api.weixin.qq.com/cgi-bin/token')
+    assert wechat_stub.hits == app.config['WECHAT_HTTP_RETRIES'] + 1
+
+
+@pytest.mark.parametrize('delay, status', [(0.5, 200), (0, 502)])
+def test_not_idempotent_call_is_sent_once(app, wechat_stub, stubbed_wechat_http, fast_retries, delay, status):
+    wechat_stub.delay = delay
+    wechat_stub.status = status
+    with app.app_context():
+        with pytest.raises(UpstreamUnavailable):
+            stubbed_wechat_http.get('jscode2session', 'https://api.weixin.qq.com/sns/jscode2session',
+                                    idempotent=False)
+        assert stubbed_wechat_http.metrics_snapshot()['jscode2session']['retries'] == 0
+    assert wechat_stub.hits == 1
+
+
+def test_not_idempotent_call_is_retried_when_not_connected(app, fast_retries):
+    with socket.socket() as closed:
+        closed.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/sns/jscode2session' % closed.getsockname()[1]
+    client = OutboundClient('WECHAT_HTTP')
+    with app.app_context():
+        with pytest.raises(UpstreamUnavailable):
+            client.get('jscode2session', url, idempotent=False)
+        assert client.metrics_snapshot()['jscode2session']['retries'] == app.config['WECHAT_HTTP_RETRIES']
+
+
+def test_login_is_not_retried(client, wechat_stub, stubbed_wechat_http, fast_retries):
+    wechat_stub.status = 503
+    response = client.post('/api/v1.0/wechat/login', json={'code': 'code'})
+    assert response.status_code == 503
+    assert wechat_stub.hits == 1
+
+
+def test_unexpected_trial_error_lets_the_next_trial_through(app, wechat_stub, stubbed_wechat_http, monkeypatch):
+    monkeypatch.setitem(app.config, 'WECHAT_HTTP_CIRCUIT_RESET_TIMEOUT', 0)
+    url = 'https://api.weixin.qq.com/cgi-bin/token'
+    breaker = stubbed_wechat_http._endpoint('cgi-bin/token')[0]
+    breaker.record_failure(1)
+    session = stubbed_wechat_http.session
+
+    def broken_request(*args, **kwargs):
+        raise ValueError('Not a request error')
+
+    with app.app_context():
+        with monkeypatch.context() as patch:
+            patch.setattr(session, 'request', broken_request)
+            with pytest.raises(ValueError):
+                stubbed_wechat_http.get('cgi-bin/token', url)
+        assert breaker.trial_thread is None
+        assert stubbed_wechat_http.get('cgi-bin/token', url).status_code == 200
+        assert breaker.state == 'closed'
+
+
+def test_open_circuit_stops_calls_to_a_slow_upstream(app, wechat_stub, stubbed_wechat_http, fast_retries,
+                                                     monkeypatch):
+    monkeypatch.setitem(app.config, 'WECHAT_HTTP_READ_TIMEOUT', 0.05)
+    wechat_stub.delay = 0.3
+    with app.app_context():
+        for _ in range(10):
+            with pytest.raises(UpstreamUnavailable):
+                stubbed_wechat_http.get('cgi-bin/token', 'https://api.weixin.qq.com/cgi-bin/token')
+        metrics = stubbed_wechat_http.metrics_snapshot()['cgi-bin/token']
+    failures = app.config['WECHAT_HTTP_CIRCUIT_FAILURES']
+    assert wechat_stub.hits == failures * (app.config['WECHAT_HTTP_RETRIES'] + 1)
+    assert metrics['rejected'] == 10 - failures
+    assert metrics['circuit'] == 'open'
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app import db
+from app.api.auth.auth_utils import load_token_revoke_status, get_user_unrevoked_tokens
+from app.dbUtils.dbUtils import query_existing_phone_user, query_existing_openid_user, \
+    query_teacher_class_sessions, query_student_sessions, query_parent_children_sessions
+from app.models import ClassSession
+
+START = datetime(2021, 3, 1)
+END = datetime(2021, 4, 1)
+
+
+def query_plans(app, call):
+    """
+    This function runs call() in an app context and returns the EXPLAIN QUERY PLAN details of every SELECT it ran.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            call()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        connection = db.engine.raw_connection()
+        try:
+            return [' | '.join(row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters))
+                    for statement, parameters in statements]
+        finally:
+            connection.close()
+
+
+def test_user_lookups_use_indexes(app):
+    assert query_plans(app, lambda: query_existing_phone_user('13800000000')) == \
+        ['SEARCH users USING INDEX ix_users_phone_deleted (phone=? AND deleted=?)']
+    assert query_plans(app, lambda: query_existing_openid_user('openid')) == \
+        ['SEARCH users USING INDEX ix_users_openid_deleted (openid=? AND deleted=?)']
+
+
+def test_token_lookups_use_indexes(app):
+    # uq_token_blacklist_jti is the automatic index of the unique constraint in SQLite.
+    plan, = query_plans(app, lambda: load_token_revoke_status('jti'))
+    assert plan.startswith('SEARCH token_blacklist USING INDEX sqlite_autoindex_token_blacklist_1 (jti=?)')
+    assert query_plans(app, lambda: get_user_unrevoked_tokens(1)) == \
+        ['SEARCH token_blacklist USING INDEX ix_token_blacklist_user_id_revoked (user_id=? AND revoked=?)']
+
+
+def test_session_time_window_uses_index(app):
+    plan, = query_plans(app, lambda: ClassSession.query.filter(ClassSession.deleted == False)
+                        .filter(ClassSession.start_time >= START, ClassSession.start_time <= END).all())
+    assert plan == 'SEARCH classSessions USING INDEX ix_classSessions_deleted_start_time ' \
+                   '(deleted=? AND start_time>? AND start_time<?)'
+
+
+def test_session_lists_do_not_scan_tables(app):
+    plans = query_plans(app, lambda: (query_teacher_class_sessions(START, END, 1),
+                                      query_student_sessions(1, START, END),
+                                      query_parent_children_sessions(1, START, END)))
+    assert len(plans) >= 3
+    for plan in plans:
+        assert 'SCAN' not in plan, plan
+        if 'classSessions' in plan:
+            assert 'USING INDEX ix_classSessions_deleted_start_time' in plan, plan
@@ -0,0 +1,85 @@
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from app import db
+from app.dbUtils.dbUtils import find_schedule_conflicts, insert_lazy_class_series
+from app.models import Course, Student, ClassSession, Teaching, TakingClass
+from app.utils.interval_utils import find_overlaps
+from app.utils.utils import Roles
+
+
+def _brute_force(intervals, others):
+    return sorted((item, other) for start, end, item in intervals for other_start, other_end, other in others
+                  if start < other_end and other_start < end)
+
+
+@pytest.mark.parametrize('intervals, others, expected', [
+    # Back to back sessions do not overlap, either way round.
+    ([(0, 60, 'a')], [(60, 120, 'b'), (-60, 0, 'c')], []),
+    # Equal start times overlap.
+    ([(0, 60, 'a')], [(0, 30, 'b'), (0, 90, 'c')], [('a', 'b'), ('a', 'c')]),
+    # Nested intervals overlap, whichever side is the outer one.
+    ([(0, 120, 'a'), (200, 210, 'd')], [(30, 60, 'b'), (190, 240, 'c')], [('a', 'b'), ('d', 'c')]),
+    # Intervals of the same side never pair up.
+    ([(0, 60, 'a'), (0, 60, 'b')], [], []),
+])
+def test_find_overlaps_cases(intervals, others, expected):
+    assert sorted(find_overlaps(intervals, others)) == expected
+    assert _brute_force(intervals, others) == expected
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_find_overlaps_matches_brute_force(seed):
+    rng = random.Random(seed)
+
+    def intervals(side, count):
+        result = []
+        for i in range(count):
+            # Coarse starts and durations make many ties, back to back pairs and empty intervals.
+            start = rng.randrange(0, 50) * 15
+            result.append((start, start + rng.randrange(0, 8) * 15, '%s%d' % (side, i)))
+        return result
+
+    new, existing = intervals('n', rng.randrange(0, 30)), intervals('e', rng.randrange(0, 30))
+    assert sorted(find_overlaps(new, existing)) == _brute_force(new, existing)
+
+
+def test_schedule_conflicts(app, make_user):
+    teacher_id = make_user(Roles.TEACHER)
+    with app.app_context():
+        course = Course(name='Piano', deleted=False)
+        student = Student(real_name='Student', deleted=False)
+        db.session.add_all([course, student])
+        db.session.flush()
+
+        def add_session(start_time, duration, teacher=True):
+            class_session = ClassSession(course_id=course.id, start_time=start_time, duration=duration)
+            db.session.add(class_session)
+            db.session.flush()
+            if teacher:
+                db.session.add(Teaching(session_id=class_session.id, teacher_id=teacher_id, deleted=False))
+            else:
+                db.session.add(TakingClass(session_id=class_session.id, student_id=student.id, deleted=False))
+            return class_session.id
+
+        before = add_session(datetime(2021, 3, 1, 8), 60)  # Ends when the first new session starts
+        same_start = add_session(datetime(2021, 3, 2, 9), 30)
+        nested = add_session(datetime(2021, 3, 3, 9, 15), 15, teacher=False)
+        add_session(datetime(2021, 3, 4, 10), 60)  # Starts when the new session ends
+        # A weekly series of the teacher, its Monday 09:30 occurrence overlaps the first new session.
+        insert_lazy_class_series('series-1', course.id, datetime(2021, 3, 1, 9, 30, tzinfo=timezone.utc),
+                                 datetime(2021, 3, 1, 10, 30, tzinfo=timezone.utc),
+                                 [0], 30, None, teacher_id, [])
+        db.session.commit()
+
+        new_starts = [datetime(2021, 3, day, 9) for day in (1, 2, 3, 4)]
+        conflicts = find_schedule_conflicts(teacher_id, [student.id], new_starts, 60)
+        found = sorted((conflict['start_time_utc'], conflict['conflict_session_id']) for conflict in conflicts
+                       if isinstance(conflict['conflict_session_id'], int))
+        assert found == [('2021-03-02T09:00:00', same_start), ('2021-03-03T09:00:00', nested)]
+        assert before not in {conflict['conflict_session_id'] for conflict in conflicts}
+        assert [conflict['conflict_session_id'] for conflict in conflicts
+                if isinstance(conflict['conflict_session_id'], str)] == ['series-1@20210301T093000Z']
+        assert [conflict['student_id'] for conflict in conflicts if 'student_id' in conflict] == [student.id]
@@ -0,0 +1,173 @@
+"""
+Load test of the wechat login bulkhead: the app is served like one gunicorn gthread worker (a fixed pool of threads),
+logins keep waiting on a slow local jscode2session stub, and the p99 latency of /courses is measured meanwhile.
+The latency tests are benchmarks, run them with python -m pytest -m benchmark -s to see the latencies.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from werkzeug.serving import BaseWSGIServer
+
+from app import create_app, db
+from app.models import Course
+from app.utils.concurrency_utils import Bulkhead, BulkheadFull, wechat_login_bulkhead
+from tests.conftest import TestConfig
+
+WORKER_THREADS = 8  # --threads of boot.sh
+WECHAT_DELAY = 0.5  # Seconds the stub takes to answer jscode2session
+
+
+class GthreadServer(BaseWSGIServer):
+    """
+    A WSGI server handling requests on a fixed pool of threads, like a gunicorn gthread worker.
+    """
+    def __init__(self, app, threads):
+        super().__init__('127.0.0.1', 0, app)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+@pytest.fixture
+def served_app(tmp_path, monkeypatch, wechat_stub, stubbed_wechat_http):
+    class LoadTestConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'load.db')
+        WECHAT_APPID = 'appid'
+        WECHAT_APP_SECRET = 'secret'
+
+    app = create_app(LoadTestConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(Course(name='Course %d' % i, deleted=False) for i in range(20))
+        db.session.commit()
+
+    wechat_stub.delay = WECHAT_DELAY
+    # The bulkhead builds its semaphore from the config of the first app that uses it.
+    monkeypatch.setattr(wechat_login_bulkhead, '_semaphore', None)
+
+    server = GthreadServer(app, WORKER_THREADS)
+    yield app, _serve(server)
+    server.shutdown()
+    server.pool.shutdown()
+    with app.app_context():
+        db.session.remove()
+
+
+def _p99(latencies):
+    latencies = sorted(latencies)
+    return latencies[int(len(latencies) * 0.99) - 1]
+
+
+def _courses_p99(url, logins=0, samples=60):
+    """
+    This function returns the p99 latency of /courses and the login status codes,
+    while `logins` clients keep logging in through wechat.
+    """
+    stop = threading.Event()
+    statuses = []
+
+    def login():
+        with requests.Session() as session:
+            while not stop.is_set():
+                status = session.post(url + '/api/v1.0/wechat/login', json={'code': 'code'}).status_code
+                statuses.append(status)
+                if status == 503:
+                    time.sleep(0.05)  # The mini program retries a rejected login after a short pause.
+
+    clients = [threading.Thread(target=login) for _ in range(logins)]
+    for client in clients:
+        client.start()
+    time.sleep(0.2 if logins else 0)
+
+    latencies = []
+    with requests.Session() as session:
+        for _ in range(samples):
+            start = time.monotonic()
+            assert session.get(url + '/api/v1.0/courses').status_code == 201
+            latencies.append(time.monotonic() - start)
+            time.sleep(0.01)
+    stop.set()
+    for client in clients:
+        client.join()
+    return _p99(latencies), statuses
+
+
+def test_full_bulkhead_rejects_at_once(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'TEST_MAX_CONCURRENCY', 2)
+    bulkhead = Bulkhead('TEST')
+    with app.app_context():
+        with bulkhead, bulkhead:
+            assert bulkhead.in_flight == 2
+            with pytest.raises(BulkheadFull):
+                with bulkhead:
+                    pass
+            assert bulkhead.rejected == 1
+        assert bulkhead.in_flight == 0
+        with bulkhead:
+            assert bulkhead.in_flight == 1
+
+
+def test_logins_beyond_the_bulkhead_are_rejected(served_app, wechat_stub):
+    app, url = served_app
+    admitted = app.config['WECHAT_LOGIN_MAX_CONCURRENCY']
+    logins = admitted + 3
+    barrier = threading.Barrier(logins)
+    responses = []
+    rejected = wechat_login_bulkhead.rejected
+
+    def login():
+        barrier.wait()
+        responses.append(requests.post(url + '/api/v1.0/wechat/login', json={'code': 'code'}))
+
+    threads = [threading.Thread(target=login) for _ in range(logins)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The logins are all in flight together, since the stub holds each one for WECHAT_DELAY.
+    assert sorted(response.status_code for response in responses) == [201] * admitted + [503] * 3
+    assert all(response.json()['message'] == "Too many logins in progress, please try again"
+               for response in responses if response.status_code == 503)
+    assert wechat_stub.hits == admitted
+    assert wechat_login_bulkhead.rejected == rejected + 3
+
+
+@pytest.mark.benchmark
+def test_courses_latency_stays_flat_during_logins(served_app):
+    app, url = served_app
+    idle_p99, _ = _courses_p99(url)
+    busy_p99, statuses = _courses_p99(url, logins=3 * WORKER_THREADS)
+    print('\n/courses p99: %.1f ms idle, %.1f ms with %d clients logging in (%d logins, %d rejected with 503)' % (
+        idle_p99 * 1000, busy_p99 * 1000, 3 * WORKER_THREADS, statuses.count(201), statuses.count(503)))
+
+    assert statuses.count(201) > 0
+    assert statuses.count(503) > 0
+    # A /courses request never waits for a thread held by a login.
+    assert busy_p99 < WECHAT_DELAY / 2
+
+
+@pytest.mark.benchmark
+def test_courses_latency_without_spare_threads(served_app):
+    app, url = served_app
+    # Let every thread wait on wechat, to show what the bulkhead prevents.
+    app.config['WECHAT_LOGIN_MAX_CONCURRENCY'] = WORKER_THREADS
+    busy_p99, statuses = _courses_p99(url, logins=2 * WORKER_THREADS, samples=5)
+    print('\n/courses p99 without spare threads: %.1f ms' % (busy_p99 * 1000))
+    assert busy_p99 >= WECHAT_DELAY / 2
@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+from app import db
+from app.dbUtils.dbUtils import insert_lazy_class_series
+from app.models import Course, Student, ParentHood, CourseCredit, ClassSession, TakingClass
+from app.utils.utils import Roles
+
+TIME_FRAME = {'start_time': '2021-03-01T00:00:00+0000', 'end_time': '2021-03-08T00:00:00+0000'}
+
+
+def test_dashboard_shows_only_the_parents_students(app, client, make_user, auth_header):
+    parent_id = make_user(Roles.PARENT)
+    other_parent_id = make_user(Roles.PARENT)
+    teacher_id = make_user(Roles.TEACHER)
+    headers = auth_header(parent_id)
+    assert client.post('/api/v1.0/parent_dashboard', json=TIME_FRAME, headers=headers).get_json() == {'message': []}
+
+    with app.app_context():
+        piano, violin = Course(name='Piano', deleted=False), Course(name='Violin', deleted=False)
+        first, second, unlinked, other = [Student(real_name=name, deleted=False)
+                                          for name in ('First', 'Second', 'Unlinked', 'Other')]
+        db.session.add_all([piano, violin, first, second, unlinked, other])
+        db.session.flush()
+        db.session.add_all([
+            ParentHood(student_id=first.id, parent_id=parent_id, deleted=False),
+            ParentHood(student_id=second.id, parent_id=parent_id, deleted=False),
+            # A removed link, and a student of another parent.
+            ParentHood(student_id=unlinked.id, parent_id=parent_id, deleted=True),
+            ParentHood(student_id=other.id, parent_id=other_parent_id, deleted=False),
+            CourseCredit(student_id=first.id, course_id=piano.id, credit=10, deleted=False),
+            CourseCredit(student_id=first.id, course_id=violin.id, credit=3, deleted=True),
+            CourseCredit(student_id=other.id, course_id=piano.id, credit=5, deleted=False),
+        ])
+        attended = ClassSession(course_id=piano.id, start_time=datetime(2021, 3, 2, 8), duration=60)
+        later = ClassSession(course_id=piano.id, start_time=datetime(2021, 3, 3, 8), duration=60)
+        outside = ClassSession(course_id=piano.id, start_time=datetime(2021, 3, 10, 8), duration=60)
+        db.session.add_all([attended, later, outside])
+        db.session.flush()
+        db.session.add_all([
+            TakingClass(session_id=attended.id, student_id=first.id, deleted=False, attended=True),
+            TakingClass(session_id=later.id, student_id=first.id, deleted=True),
+            TakingClass(session_id=outside.id, student_id=first.id, deleted=False),
+            TakingClass(session_id=later.id, student_id=second.id, deleted=False),
+            TakingClass(session_id=later.id, student_id=unlinked.id, deleted=False),
+            TakingClass(session_id=attended.id, student_id=other.id, deleted=False),
+        ])
+        # The Monday 09:00 occurrence of a weekly series taken by the second student and the other parent's student.
+        insert_lazy_class_series('series-1', violin.id, datetime(2021, 3, 1, 9, tzinfo=timezone.utc),
+                                 datetime(2021, 3, 1, 10, tzinfo=timezone.utc), [0], 30, None, teacher_id,
+                                 [second.id, other.id])
+        db.session.commit()
+
+        first_result = dict(first.to_dict(), credits=[{'course_name': 'Piano', 'course_credit': 10}],
+                            class_sessions=[dict(attended.to_dict(), attended=True)])
+        second_result = dict(second.to_dict(), credits=[], class_sessions=[
+            {'session_id': 'series-1@20210301T090000Z', 'series_id': 'series-1', 'course_name': 'Violin',
+             'start_time_utc': '2021-03-01T09:00:00', 'duration': 30, 'attendance_call': False,
+             'attended': False},
+            dict(later.to_dict(), attended=False),
+        ])
+
+    response = client.post('/api/v1.0/parent_dashboard', json=TIME_FRAME, headers=headers)
+    assert response.status_code == 201
+    assert response.get_json() == {'message': [first_result, second_result]}
+
+
+def test_dashboard_checks_the_role_and_the_time_frame(client, make_user, auth_header):
+    assert client.post('/api/v1.0/parent_dashboard', json=TIME_FRAME,
+                       headers=auth_header(make_user(Roles.STUDENT))).status_code == 403
+    headers = auth_header(make_user(Roles.PARENT))
+    for body in [{'start_time': TIME_FRAME['start_time']}, dict(TIME_FRAME, end_time='2021-03-08')]:
+        response = client.post('/api/v1.0/parent_dashboard', json=body, headers=headers)
+        assert response.status_code == 400
+        assert response.get_json()['message'] == "Invalid time frame"
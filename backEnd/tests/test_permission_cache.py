@@ -0,0 +1,57 @@
+from app import db
+from app.api.auth.permission_cache import permission_cache, bump_permission_version, MISSING
+from app.models import User
+from app.utils.cache_utils import get_redis
+from app.utils.utils import Roles
+
+
+def test_stale_version_does_not_replace_newer(app, make_user):
+    user_id = make_user()
+    with app.app_context():
+        assert permission_cache.set(user_id, 3) == 3
+        permission_cache.local.clear()
+        assert permission_cache.set(user_id, 2) == 3
+        assert int(get_redis(app).get(permission_cache._key(user_id))) == 3
+        assert permission_cache.get(user_id) == 3
+        assert permission_cache.set(user_id, MISSING) == MISSING
+        assert permission_cache.set(user_id, 4) == MISSING
+
+
+def test_fill_after_bump_keeps_bumped_version(app, make_user):
+    user_id = make_user()
+    with app.app_context():
+        # A request reads the version from the DB, then a role change commits before it fills the cache.
+        stale = db.session.query(User.perm_version).filter(User.id == user_id).scalar()
+        user = User.query.get(user_id)
+        user.roles = Roles.TEACHER
+        bump_permission_version(user)
+        db.session.commit()
+        assert permission_cache.set(user_id, stale) == stale + 1
+        permission_cache.local.clear()
+        assert permission_cache.get(user_id) == stale + 1
+
+
+def test_bump_increments_in_db(app, make_user):
+    user_id = make_user()
+    with app.app_context():
+        first = User.query.get(user_id)
+        bump_permission_version(first)
+        db.session.commit()
+        assert first.perm_version == 1
+        # An object loaded before the bump still gets the next version.
+        db.session.query(User).filter(User.id == user_id).update({User.perm_version: 5})
+        bump_permission_version(first)
+        db.session.commit()
+        assert db.session.query(User.perm_version).filter(User.id == user_id).scalar() == 6
+        assert permission_cache.get(user_id) == 6
+
+
+def test_fallback_mode_skips_shared_store(app, make_user):
+    user_id = make_user()
+    app.extensions['redis_fallback'] = True
+    try:
+        with app.app_context():
+            assert permission_cache.get(user_id) == 0
+            assert get_redis(app).get(permission_cache._key(user_id)) is None
+    finally:
+        del app.extensions['redis_fallback']
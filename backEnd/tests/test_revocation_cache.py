@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from app.api.auth.revocation_cache import revocation_cache, REVOKED, ACTIVE
+from app.utils.cache_utils import get_redis
+
+
+def test_active_status_does_not_overwrite_revocation(app):
+    expires = datetime.utcnow() + timedelta(days=30)
+
+    def loader(jti):
+        # The token is revoked by another request after its active status was read from the DB.
+        revocation_cache.set(jti, True, expires)
+        revocation_cache.local.clear()
+        return False, expires
+
+    with app.app_context():
+        assert revocation_cache.is_revoked('jti-1', loader) is True
+        assert get_redis(app).get(revocation_cache._key('jti-1')) == REVOKED
+        revocation_cache.local.clear()
+        assert revocation_cache.is_revoked('jti-1', lambda jti: (False, expires)) is True
+
+
+def test_active_status_is_cached_briefly(app):
+    expires = datetime.utcnow() + timedelta(days=30)
+    with app.app_context():
+        assert revocation_cache.is_revoked('jti-2', lambda jti: (False, expires)) is False
+        client = get_redis(app)
+        assert client.get(revocation_cache._key('jti-2')) == ACTIVE
+        assert 0 < client.ttl(revocation_cache._key('jti-2')) <= app.config['TOKEN_REVOCATION_ACTIVE_TTL']
+
+        revocation_cache.set('jti-2', True, expires)
+        assert client.ttl(revocation_cache._key('jti-2')) > app.config['TOKEN_REVOCATION_ACTIVE_TTL']
+        assert revocation_cache.is_revoked('jti-2', lambda jti: (False, expires)) is True
+
+
+def test_fallback_mode_skips_shared_store(app):
+    expires = datetime.utcnow() + timedelta(days=30)
+    app.extensions['redis_fallback'] = True
+    try:
+        with app.app_context():
+            assert revocation_cache.is_revoked('jti-3', lambda jti: (False, expires)) is False
+            revocation_cache.set('jti-4', True, expires)
+            assert get_redis(app).get(revocation_cache._key('jti-3')) is None
+            assert get_redis(app).get(revocation_cache._key('jti-4')) is None
+            assert revocation_cache.is_revoked('jti-4', lambda jti: (False, expires)) is True
+    finally:
+        del app.extensions['redis_fallback']
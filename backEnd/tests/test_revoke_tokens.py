@@ -0,0 +1,35 @@
+import pytest
+
+from app.api.auth.auth_utils import revoke_tokens, issue_tokens
+from app import db
+from app.api.auth.revocation_cache import revocation_cache, REVOKED
+from app.models import User, TokenBlacklist
+from app.utils.cache_utils import get_redis
+from app.utils.utils import Roles
+
+
+@pytest.mark.parametrize('user_ids', [5, '5', [5, '6'], [True], {'id': 5}])
+def test_user_ids_must_be_ints(client, make_user, auth_header, user_ids):
+    headers = auth_header(make_user(Roles.ADMIN))
+    response = client.post('/api/v1.0/auth/revoke_tokens', json={'user_ids': user_ids}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_cache_is_written_once_per_batch(app, make_user, monkeypatch):
+    user_id = make_user(Roles.TEACHER)
+    with app.app_context():
+        user = User.query.get(user_id)
+        for _ in range(3):
+            issue_tokens(user)
+
+        set_many = revocation_cache.set_many
+        batches = []
+        monkeypatch.setattr(revocation_cache, 'set_many',
+                            lambda tokens, revoked: batches.append(len(tokens)) or set_many(tokens, revoked))
+        assert revoke_tokens([user_id], batch_size=4) == 6
+        assert batches == [4, 2]
+
+        client = get_redis(app)
+        jtis = [jti for jti, in db.session.query(TokenBlacklist.jti)]
+        assert len(jtis) == 6
+        assert all(client.get(revocation_cache._key(jti)) == REVOKED for jti in jtis)
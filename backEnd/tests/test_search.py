@@ -0,0 +1,77 @@
+import pytest
+
+from app import db
+from app.models import Student
+from app.utils.utils import Roles
+
+
+def _pages(client, url, args, headers, limit):
+    """
+    This function follows the next_cursor of a search from its first page to its last one.
+    """
+    pages = []
+    params = dict(args, limit=limit)
+    while True:
+        response = client.get(url, query_string=params, headers=headers)
+        assert response.status_code == 201
+        body = response.get_json()
+        pages.append(body['message'])
+        if not body['next_cursor']:
+            return pages
+        params = dict(args, limit=limit, cursor=body['next_cursor'])
+
+
+def test_search_users_is_admin_only(client, make_user, auth_header):
+    make_user(Roles.PARENT, real_name='Wang')
+    for roles in (Roles.PARENT, Roles.TEACHER, Roles.PRINCIPLE):
+        response = client.get('/api/v1.0/search_users?q=Wang', headers=auth_header(make_user(roles)))
+        assert response.status_code == 403
+    response = client.get('/api/v1.0/search_users?q=Wang', headers=auth_header(make_user(Roles.ADMIN)))
+    assert response.status_code == 201
+    assert [user['real_name'] for user in response.get_json()['message']] == ['Wang']
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 10])
+def test_search_users_pages_by_match_class(client, make_user, auth_header, limit):
+    headers = auth_header(make_user(Roles.ADMIN))
+    # Created in id order, the ranking puts the exact matches first, then the prefix and the substring matches.
+    substring = make_user(Roles.PARENT, real_name='Li Wang')
+    prefix = make_user(Roles.PARENT, real_name='Wang Fang')
+    exact = make_user(Roles.TEACHER, real_name='wang')
+    nick_name = make_user(Roles.PARENT, real_name='Zhao', nick_name='WANG')
+    phone = make_user(Roles.PARENT, real_name='Chen', phone='wang138')
+    make_user(Roles.PARENT, real_name='Zhang', deleted=True, nick_name='Wang')
+    make_user(Roles.PARENT, real_name='Liu')
+
+    pages = _pages(client, '/api/v1.0/search_users', {'q': 'Wang'}, headers, limit)
+    assert all(len(page) <= limit for page in pages)
+    assert [user['user_id'] for page in pages for user in page] == [exact, nick_name, prefix, phone, substring]
+
+    pages = _pages(client, '/api/v1.0/search_users', {'q': 'Wang', 'role': Roles.PARENT}, headers, limit)
+    assert [user['user_id'] for page in pages for user in page] == [nick_name, prefix, phone, substring]
+
+
+def test_search_users_rejects_bad_args(client, make_user, auth_header):
+    headers = auth_header(make_user(Roles.ADMIN))
+    assert client.get('/api/v1.0/search_users?q=%20', headers=headers).status_code == 400
+    for args in ('limit=0', 'limit=x', 'cursor=x'):
+        response = client.get('/api/v1.0/search_users?q=Wang&' + args, headers=headers)
+        assert response.status_code == 400
+        assert response.get_json()['message'] == "Invalid cursor or limit"
+
+
+def test_search_students_pages_and_sees_new_students(app, client, make_user, auth_header):
+    headers = auth_header(make_user(Roles.TEACHER))
+    assert client.get('/api/v1.0/search_students?q=Ming', headers=headers).get_json()['message'] == []
+
+    with app.app_context():
+        students = [Student(real_name=name, deleted=False) for name in ('Xiao Ming', 'Ming', 'Ming Ming', 'Hong')]
+        db.session.add_all(students + [Student(real_name='Ming', deleted=True)])
+        db.session.commit()
+        substring, exact, prefix, _ = [student.id for student in students]
+
+    pages = _pages(client, '/api/v1.0/search_students', {'q': 'ming'}, headers, 2)
+    assert [len(page) for page in pages] == [2, 1]
+    assert [student['id'] for page in pages for student in page] == [exact, prefix, substring]
+    assert client.get('/api/v1.0/search_students?q=Ming',
+                      headers=auth_header(make_user(Roles.PARENT))).status_code == 403
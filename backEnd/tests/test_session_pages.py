@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import db
+from app.dbUtils.dbUtils import insert_lazy_class_series, resolve_class_session, decode_session_cursor, \
+    SESSION_ROW, SERIES_OCCURRENCE
+from app.models import Course, ClassSession, Teaching
+from app.utils.recurrence_utils import occurrence_id
+from app.utils.utils import Roles
+
+TIME_FRAME = {'start_time': '2021-03-01T00:00:00+0000', 'end_time': '2021-03-08T00:00:00+0000'}
+URLS = ('/api/v1.0/class_sessions', '/api/v1.0/teacher_sessions')
+
+
+@pytest.fixture
+def teacher_sessions(app, make_user, auth_header):
+    """
+    This fixture gives a teacher two daily series at 08:00 in the first week of March, so their occurrences tie,
+    and stored sessions tying with the occurrences and with each other. One occurrence is materialized.
+    """
+    teacher_id = make_user(Roles.TEACHER)
+    with app.app_context():
+        course = Course(name='Piano', deleted=False)
+        db.session.add(course)
+        db.session.flush()
+        start = datetime(2021, 3, 1, 8, tzinfo=timezone.utc)
+        for series_id in ('series-a', 'series-b'):
+            insert_lazy_class_series(series_id, course.id, start, start + timedelta(days=6, hours=1), list(range(7)),
+                                     60, None, teacher_id, [])
+        for start_time in [datetime(2021, 3, 1, 8), datetime(2021, 3, 1, 8), datetime(2021, 3, 2, 7),
+                           datetime(2021, 3, 3, 8), datetime(2021, 3, 3, 9), datetime(2021, 3, 3, 9),
+                           datetime(2021, 3, 6, 8)]:
+            class_session = ClassSession(course_id=course.id, start_time=start_time, duration=60)
+            db.session.add(class_session)
+            db.session.flush()
+            db.session.add(Teaching(session_id=class_session.id, teacher_id=teacher_id, deleted=False))
+        resolve_class_session(occurrence_id('series-b', datetime(2021, 3, 4, 8)))
+        db.session.commit()
+    return auth_header(teacher_id)
+
+
+def _key(session):
+    if isinstance(session['session_id'], int):
+        return session['start_time_utc'], SESSION_ROW, session['session_id']
+    return session['start_time_utc'], SERIES_OCCURRENCE, session['series_id']
+
+
+def _pages(client, url, headers, limit):
+    pages = []
+    cursor = None
+    while True:
+        response = client.post(url, json=dict(TIME_FRAME, limit=limit, cursor=cursor), headers=headers)
+        assert response.status_code == 201
+        page = response.get_json()
+        pages.append((page['message'], page['next_cursor']))
+        cursor = page['next_cursor']
+        if not cursor:
+            return pages
+
+
+@pytest.mark.parametrize('url', URLS)
+def test_unpaged_list_is_in_key_order(client, teacher_sessions, url):
+    sessions = client.post(url, json=TIME_FRAME, headers=teacher_sessions).get_json()['message']
+    # 7 stored sessions, the materialized occurrence, and 2 series * 7 days - 1 materialized occurrences.
+    assert len(sessions) == 7 + 1 + 13
+    assert [_key(session) for session in sessions] == sorted(_key(session) for session in sessions)
+    assert len({session['session_id'] for session in sessions}) == len(sessions)
+    assert occurrence_id('series-b', datetime(2021, 3, 4, 8)) not in {session['session_id'] for session in sessions}
+
+
+@pytest.mark.parametrize('url', URLS)
+@pytest.mark.parametrize('limit', [1, 2, 3, 5, 8, 21, 50])
+def test_pages_have_no_duplicates_or_gaps(client, teacher_sessions, url, limit):
+    everything = client.post(url, json=TIME_FRAME, headers=teacher_sessions).get_json()['message']
+    pages = _pages(client, url, teacher_sessions, limit)
+
+    assert all(len(sessions) == limit for sessions, _ in pages[:-1])
+    assert 0 < len(pages[-1][0]) <= limit
+    assert [session for sessions, _ in pages for session in sessions] == everything
+
+
+def test_cursor_lands_on_sessions_and_occurrences(client, teacher_sessions):
+    # Pages of 2 end on a tie between two sessions, a session and an occurrence, and two occurrences.
+    kinds = set()
+    for sessions, next_cursor in _pages(client, URLS[1], teacher_sessions, 2)[:-1]:
+        start_time, kind, item_id = decode_session_cursor(next_cursor)
+        assert (start_time.strftime('%Y-%m-%dT%H:%M:%S'), kind, item_id) == _key(sessions[-1])
+        kinds.add(kind)
+    assert kinds == {SESSION_ROW, SERIES_OCCURRENCE}
+
+
+@pytest.mark.parametrize('url', URLS)
+@pytest.mark.parametrize('cursor', ['not a cursor', 'WyIyMDIxLTAzLTAxVDA4OjAwOjAwIiwgMSwgInNlcmllcy1hIl0='])
+def test_invalid_cursor_is_rejected(client, teacher_sessions, url, cursor):
+    # The second cursor has both a session id and a series id.
+    response = client.post(url, json=dict(TIME_FRAME, limit=5, cursor=cursor), headers=teacher_sessions)
+    assert response.status_code == 400
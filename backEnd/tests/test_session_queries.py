@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.models import User, Course, Student, ParentHood, ClassSession, Teaching, TakingClass
+from app.utils.utils import Roles
+
+TIME_FRAME = {'start_time': '2021-03-01T00:00:00+0000', 'end_time': '2021-04-01T00:00:00+0000'}
+
+
+def add_sessions(app, teacher_id, student_id, count, first):
+    with app.app_context():
+        for i in range(first, first + count):
+            # Each session has its own course and attendance teacher, so a lazy load of them
+            # can not be answered from the identity map and shows up as a statement.
+            course = Course(name='Course %d' % i, deleted=False)
+            attendance_teacher = User(roles=Roles.TEACHER, real_name='Teacher %d' % i)
+            db.session.add_all([course, attendance_teacher])
+            db.session.flush()
+            class_session = ClassSession(course_id=course.id, start_time=datetime(2021, 3, 1, 8) + timedelta(hours=i),
+                                         duration=60, attendance_call=True, attendance_teacher_id=attendance_teacher.id,
+                                         attendance_time=datetime(2021, 3, 1, 8))
+            db.session.add(class_session)
+            db.session.flush()
+            db.session.add(Teaching(session_id=class_session.id, teacher_id=teacher_id, deleted=False))
+            db.session.add(TakingClass(session_id=class_session.id, student_id=student_id, deleted=False))
+        db.session.commit()
+
+
+def count_statements(app, client, url, body, headers):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.post(url, json=body, headers=headers)
+        # The streamed lists run their queries while the body is read.
+        response.get_data()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert response.status_code == 201
+    return len(statements)
+
+
+@pytest.mark.parametrize('url, role', [
+    ('/api/v1.0/class_sessions', Roles.TEACHER),
+    ('/api/v1.0/teacher_sessions', Roles.TEACHER),
+    ('/api/v1.0/student_sessions', Roles.PARENT),
+    ('/api/v1.0/parent_students_sessions', Roles.PARENT),
+])
+def test_session_list_queries_do_not_grow_with_sessions(app, client, make_user, auth_header, url, role):
+    teacher_id = make_user(Roles.TEACHER, real_name='Teacher')
+    user_id = teacher_id if role == Roles.TEACHER else make_user(Roles.PARENT)
+    with app.app_context():
+        student = Student(real_name='Student', deleted=False)
+        db.session.add(student)
+        db.session.flush()
+        db.session.add(ParentHood(student_id=student.id, parent_id=user_id, deleted=False))
+        db.session.commit()
+        student_id = student.id
+    body = dict(TIME_FRAME, student_id=student_id, limit=500)
+    headers = auth_header(user_id)
+
+    add_sessions(app, teacher_id, student_id, 10, 0)
+    # The first request also fills the revocation and permission caches.
+    count_statements(app, client, url, body, headers)
+    few = count_statements(app, client, url, body, headers)
+
+    add_sessions(app, teacher_id, student_id, 190, 10)
+    many = count_statements(app, client, url, body, headers)
+
+    assert many == few
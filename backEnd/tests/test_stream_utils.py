@@ -0,0 +1,68 @@
+import json
+from datetime import datetime
+
+import pytest
+from flask import jsonify
+
+from app import db
+from app.models import Student, ParentHood, Course, ClassSession, TakingClass
+from app.utils.stream_utils import stream_json_list
+from app.utils.utils import Roles
+
+ITEMS = [{'id': 1, 'real_name': '小明', 'gender': True}, {'id': 2, 'real_name': None, 'dob': '2015-06-01T00:00:00'},
+         {'id': 3, 'nested': {'list': [1, 2.5, 'three']}}]
+
+
+@pytest.mark.parametrize('items', [[], ITEMS[:1], ITEMS])
+def test_streamed_body_matches_jsonify(app, items):
+    with app.test_request_context():
+        streamed = stream_json_list(iter(items))
+        body = streamed.get_data(as_text=True)
+        expected = jsonify(message=items)
+        assert streamed.status_code == 201
+        assert streamed.mimetype == expected.mimetype
+        assert json.loads(body) == json.loads(expected.get_data(as_text=True))
+
+        paged = stream_json_list(iter(items), next_cursor='abc')
+        assert json.loads(paged.get_data(as_text=True)) == {'message': items, 'next_cursor': 'abc'}
+
+
+def test_students_stream_matches_to_dict(app, client, make_user, auth_header):
+    headers = auth_header(make_user(Roles.TEACHER))
+    assert client.get('/api/v1.0/students', headers=headers).get_json() == {'message': [], 'next_cursor': None}
+
+    with app.app_context():
+        db.session.add_all([Student(real_name='Student %d' % i, gender=bool(i % 2), deleted=False,
+                                    dob=datetime(2015, 1, 1 + i) if i % 3 else None) for i in range(5)])
+        db.session.commit()
+        expected = [student.to_dict() for student in Student.query.order_by(Student.id)]
+    assert client.get('/api/v1.0/students', headers=headers).get_json() == {'message': expected, 'next_cursor': None}
+
+
+def test_parent_students_sessions_stream_matches_to_dict(app, client, make_user, auth_header):
+    parent_id = make_user(Roles.PARENT)
+    headers = auth_header(parent_id)
+    body = {'start_time': '2021-03-01T00:00:00+0000', 'end_time': '2021-04-01T00:00:00+0000'}
+    assert client.post('/api/v1.0/parent_students_sessions', json=body, headers=headers).get_json() == \
+        {'message': []}
+
+    with app.app_context():
+        course = Course(name='Piano', deleted=False)
+        students = [Student(real_name='Student %d' % i, deleted=False) for i in range(3)]
+        db.session.add_all([course] + students)
+        db.session.flush()
+        class_session = ClassSession(course_id=course.id, start_time=datetime(2021, 3, 2, 8), duration=60)
+        db.session.add(class_session)
+        db.session.flush()
+        for student in students:
+            db.session.add(ParentHood(student_id=student.id, parent_id=parent_id, deleted=False))
+        db.session.add(TakingClass(session_id=class_session.id, student_id=students[0].id, deleted=False))
+        db.session.commit()
+        expected = []
+        for student in students:
+            result = student.to_dict()
+            result['class_sessions'] = [class_session.to_dict()] if student is students[0] else []
+            expected.append(result)
+
+    response = client.post('/api/v1.0/parent_students_sessions', json=body, headers=headers)
+    assert response.get_json() == {'message': expected}
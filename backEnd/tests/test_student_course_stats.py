@@ -0,0 +1,196 @@
+import threading
+from datetime import datetime
+
+from sqlalchemy import event
+
+from config import Config
+from app import create_app, db
+from app.dbUtils.dbUtils import _add_student_course_stats, _bulk_upsert_add, enroll_students, \
+    rebuild_student_course_stats
+from app.models import StudentCourseStat, Course, Student, ClassSession, TakingClass, ParentHood
+from app.utils.utils import Roles
+
+
+def _stat_rows():
+    return sorted(db.session.query(StudentCourseStat.student_id, StudentCourseStat.course_id, StudentCourseStat.month,
+                                   StudentCourseStat.scheduled, StudentCourseStat.attended,
+                                   StudentCourseStat.credits_charged))
+
+
+def _add_students_and_course(count):
+    course = Course(name='Piano', deleted=False)
+    students = [Student(real_name='Student %d' % i, deleted=False) for i in range(count)]
+    db.session.add(course)
+    db.session.add_all(students)
+    db.session.commit()
+    return course.id, [student.id for student in students]
+
+
+def test_upsert_adds_to_rows_inserted_meanwhile(app):
+    with app.app_context():
+        course_id, (first, second) = _add_students_and_course(2)
+        db.session.add(Course(name='Violin', deleted=False))
+        # Another transaction inserted the row of the first student after the stats were read.
+        db.session.add(StudentCourseStat(student_id=first, course_id=course_id, month=202103,
+                                         scheduled=1, attended=1, credits_charged=1))
+        db.session.flush()
+        _bulk_upsert_add(StudentCourseStat.__table__, [
+            {'student_id': student_id, 'course_id': course_id, 'month': 202103,
+             'scheduled': 2, 'attended': 1, 'credits_charged': 1} for student_id in (first, second)],
+            ('student_id', 'course_id', 'month'), ('scheduled', 'attended', 'credits_charged'))
+        db.session.commit()
+
+        assert _stat_rows() == [(first, course_id, 202103, 3, 2, 2), (second, course_id, 202103, 2, 1, 1)]
+        # The statements before the upsert are kept.
+        assert Course.query.filter_by(name='Violin').count() == 1
+
+
+def test_add_student_course_stats(app):
+    with app.app_context():
+        course_id, (first, second) = _add_students_and_course(2)
+        _add_student_course_stats({(first, course_id, 202103): [1, 0, 0]})
+        _add_student_course_stats({(first, course_id, 202103): [1, 1, 1], (second, course_id, 202103): [1, 1, 1]})
+        db.session.commit()
+        assert _stat_rows() == [(first, course_id, 202103, 2, 1, 1), (second, course_id, 202103, 1, 1, 1)]
+
+
+def _add_session(course_id, start_time, attendance_call=False):
+    class_session = ClassSession(course_id=course_id, start_time=start_time, duration=60,
+                                 attendance_call=attendance_call)
+    db.session.add(class_session)
+    db.session.flush()
+    return class_session.id
+
+
+def _stats_through_the_api(app, client, make_user, auth_header):
+    """
+    This function enrolls three students into two Piano sessions and calls the attendance of the first one through
+    the api, and returns the ids of the parent of the first student, the course, and the students.
+    """
+    parent_id = make_user(Roles.PARENT)
+    headers = auth_header(make_user(Roles.TEACHER))
+    with app.app_context():
+        course_id, student_ids = _add_students_and_course(3)
+        session_ids = [_add_session(course_id, datetime(2021, 3, 1, 8)),
+                       _add_session(course_id, datetime(2021, 4, 1, 8))]
+        db.session.add(ParentHood(student_id=student_ids[0], parent_id=parent_id, deleted=False))
+        db.session.commit()
+    for session_id in session_ids:
+        assert client.post('/api/v1.0/taking_class', json={'class_session_id': session_id, 'student_ids': student_ids},
+                           headers=headers).status_code == 201
+    # Only the first student attended, every student in the call is charged.
+    students = [{'student_id': student_id, 'attended': student_id == student_ids[0]} for student_id in student_ids]
+    assert client.post('/api/v1.0/attendance_call', json={'session_id': session_ids[0], 'student_ids': students},
+                       headers=headers).status_code == 201
+    return parent_id, course_id, student_ids
+
+
+def test_course_stats(app, client, make_user, auth_header):
+    _, course_id, (first, second, third) = _stats_through_the_api(app, client, make_user, auth_header)
+    headers = auth_header(make_user(Roles.TEACHER))
+    body = {'course_id': course_id, 'start_month': '2021-03', 'end_month': '2021-04'}
+
+    response = client.post('/api/v1.0/course_stats', json=body, headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()['message'] == [
+        {'student_id': first, 'student_name': 'Student 0', 'scheduled': 2, 'attended': 1, 'credits_charged': 1},
+        {'student_id': second, 'student_name': 'Student 1', 'scheduled': 2, 'attended': 0, 'credits_charged': 1},
+        {'student_id': third, 'student_name': 'Student 2', 'scheduled': 2, 'attended': 0, 'credits_charged': 1},
+    ]
+    response = client.post('/api/v1.0/course_stats', json=dict(body, start_month='2021-04'), headers=headers)
+    assert [row['scheduled'] + row['credits_charged'] for row in response.get_json()['message']] == [1, 1, 1]
+
+    assert client.post('/api/v1.0/course_stats', json=dict(body, end_month='2021-4-1'),
+                       headers=headers).status_code == 400
+    assert client.post('/api/v1.0/course_stats', json=body,
+                       headers=auth_header(make_user(Roles.PARENT))).status_code == 403
+
+
+def test_student_stats_of_own_students_only(app, client, make_user, auth_header):
+    parent_id, course_id, (first, second, _) = _stats_through_the_api(app, client, make_user, auth_header)
+    body = {'student_id': first, 'start_month': '2021-01', 'end_month': '2021-12'}
+    expected = [
+        {'course_id': course_id, 'course_name': 'Piano', 'month': '2021-03', 'scheduled': 1, 'attended': 1,
+         'credits_charged': 1},
+        {'course_id': course_id, 'course_name': 'Piano', 'month': '2021-04', 'scheduled': 1, 'attended': 0,
+         'credits_charged': 0},
+    ]
+    for headers in (auth_header(parent_id), auth_header(make_user(Roles.TEACHER))):
+        response = client.post('/api/v1.0/student_stats', json=body, headers=headers)
+        assert response.status_code == 201
+        assert response.get_json()['message'] == expected
+
+    # Another parent, and the parent asking for a student that is not theirs.
+    for headers, student_id in ((auth_header(make_user(Roles.PARENT)), first), (auth_header(parent_id), second)):
+        response = client.post('/api/v1.0/student_stats', json=dict(body, student_id=student_id), headers=headers)
+        assert response.status_code == 403
+        assert response.get_json()['message'] == "Not a parent of the student"
+    assert client.post('/api/v1.0/student_stats', json=dict(body, start_month=None),
+                       headers=auth_header(parent_id)).status_code == 400
+
+
+def test_rebuild_matches_the_incremental_stats(app, client, make_user, auth_header):
+    _, course_id, (first, second, third) = _stats_through_the_api(app, client, make_user, auth_header)
+    with app.app_context():
+        incremental = _stat_rows()
+        # A zero row, e.g. of an enrollment that was removed, is kept by the rebuild.
+        db.session.add(StudentCourseStat(student_id=first, course_id=course_id, month=202105, scheduled=0,
+                                         attended=0, credits_charged=0))
+        # An attendance call from before the credit ledger charged every student in the call, attended or not.
+        session_id = _add_session(course_id, datetime(2021, 6, 1, 8), attendance_call=True)
+        db.session.add_all([
+            TakingClass(session_id=session_id, student_id=first, deleted=False, attended=True),
+            TakingClass(session_id=session_id, student_id=second, deleted=False, attended=False),
+            TakingClass(session_id=session_id, student_id=third, deleted=True, attended=False),
+        ])
+        db.session.commit()
+
+        assert rebuild_student_course_stats() == len(incremental) + 3
+        db.session.commit()
+        assert _stat_rows() == sorted(incremental + [(first, course_id, 202105, 0, 0, 0),
+                                                     (first, course_id, 202106, 1, 1, 1),
+                                                     (second, course_id, 202106, 1, 0, 1)])
+
+
+def test_rebuild_does_not_lose_concurrent_increments(tmp_path):
+    # Two connections are needed, so the database is a file instead of the in-memory one of the other tests.
+    class FileConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % (tmp_path / 'stats.db')
+        SQLALCHEMY_TRACK_MODIFICATIONS = False
+        REDIS_FAKE = True
+
+    file_app = create_app(FileConfig)
+    with file_app.app_context():
+        db.create_all()
+        course_id, (first, second) = _add_students_and_course(2)
+        session_ids = [_add_session(course_id, datetime(2021, 3, 1, 8)),
+                       _add_session(course_id, datetime(2021, 3, 2, 8))]
+        enroll_students(session_ids[:1], [first, second], None)
+        db.session.commit()
+
+        def enroll():
+            with file_app.app_context():
+                enroll_students(session_ids[1:], [first, second], None)
+                db.session.commit()
+
+        enrolling = threading.Thread(target=enroll)
+
+        def enroll_while_rebuilding(conn, cursor, statement, parameters, context, executemany):
+            # Another transaction enrolls the students once the rebuild has read the taking class rows.
+            # It has to wait for the rebuild to commit, the join only gives it the time to get through otherwise.
+            if 'FROM "takingClasses"' in statement and enrolling.ident is None:
+                enrolling.start()
+                enrolling.join(0.5)
+
+        event.listen(db.engine, 'after_cursor_execute', enroll_while_rebuilding)
+        try:
+            rebuild_student_course_stats()
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'after_cursor_execute', enroll_while_rebuilding)
+        enrolling.join()
+
+        assert _stat_rows() == [(first, course_id, 202103, 2, 0, 0), (second, course_id, 202103, 2, 0, 0)]
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,35 @@
+from app import db
+from app.models import Student
+from app.utils.utils import Roles
+
+
+def _add_student(app):
+    with app.app_context():
+        student = Student(real_name='Student', deleted=False)
+        db.session.add(student)
+        db.session.commit()
+        return student.id
+
+
+def test_polling_enqueues_one_job(app, client, tasks, make_user, auth_header, run_job, monkeypatch):
+    headers = auth_header(make_user(Roles.TEACHER))
+    student_id = _add_student(app)
+    queue = app.task_queue
+
+    for _ in range(3):
+        response = client.get('/api/v1.0/student_qr_code?student_id=%d' % student_id, headers=headers)
+        assert response.status_code == 202
+    assert len(queue.calls) == 1
+    job = queue.calls[0]
+    assert job.func_name == 'app.tasks.generate_student_qr_code'
+
+    monkeypatch.setattr(tasks, 'request_wechat_qr_code', lambda scene, page: b'\x89PNG\r\n\x1a\n' + scene.encode())
+    run_job(job, lambda: tasks.generate_student_qr_code(*job.args))
+
+    response = client.get('/api/v1.0/student_qr_code?student_id=%d' % student_id, headers=headers)
+    assert response.status_code == 200
+    assert response.data.endswith(b'student_id=%d' % student_id)
+    # Once the job is done, the QR code can be generated again.
+    assert client.post('/api/v1.0/student_qr_code', json={'student_id': student_id},
+                       headers=headers).status_code == 202
+    assert len(queue.calls) == 2
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from app import db
+from app.models import TokenBlacklist
+
+
+def _add_expired_tokens(app, count):
+    with app.app_context():
+        expires = datetime.utcnow() - timedelta(days=1)
+        db.session.add_all(TokenBlacklist(jti=str(uuid4()), token_type='access', user_id=1, revoked=False,
+                                          expires=expires) for _ in range(count))
+        db.session.commit()
+
+
+def test_prune_tokens_keeps_rescheduling(app, tasks, run_job):
+    from app.utils.task_utils import schedule_prune_tokens
+    queue = app.task_queue
+    first = schedule_prune_tokens(app, delay=0)
+
+    _add_expired_tokens(app, 3)
+    assert run_job(first, tasks.prune_tokens) == 3
+    second = queue.calls[-1]
+    assert second.id != first.id
+    assert second.func_name == 'app.tasks.prune_tokens'
+    assert queue.fetch_job(second.id).get_status() == 'scheduled'
+
+    _add_expired_tokens(app, 2)
+    assert run_job(second, tasks.prune_tokens) == 2
+    third = queue.calls[-1]
+    assert third.id not in (first.id, second.id)
+    assert queue.fetch_job(third.id).get_status() == 'scheduled'
+    assert second.meta == {'deleted': 2, 'batches': 1, 'finished': True}
+
+
+def test_prune_tokens_superseded_run_stops(app, tasks, run_job):
+    from app.utils.task_utils import schedule_prune_tokens
+    queue = app.task_queue
+    old = schedule_prune_tokens(app)
+    new = schedule_prune_tokens(app, delay=0)
+
+    _add_expired_tokens(app, 1)
+    assert run_job(old, tasks.prune_tokens) == 0
+    assert queue.calls[-1] is new
+
+    assert run_job(new, tasks.prune_tokens) == 1
+    assert len(queue.calls) == 3
+
+
+def test_reconcile_credits_keeps_rescheduling(app, tasks, run_job):
+    from app.utils.task_utils import schedule_reconcile_credits
+    queue = app.task_queue
+    first = schedule_reconcile_credits(app, delay=0)
+
+    assert run_job(first, tasks.reconcile_credits) == []
+    second = queue.calls[-1]
+    assert second.id != first.id
+    assert second.func_name == 'app.tasks.reconcile_credits'
+
+    assert run_job(second, tasks.reconcile_credits) == []
+    third = queue.calls[-1]
+    assert third.id not in (first.id, second.id)
+    assert queue.fetch_job(third.id).get_status() == 'scheduled'
+
+
+def test_rebuild_stats_enqueued_once_while_pending(app, tasks, run_job):
+    from app.utils.task_utils import enqueue_rebuild_stats
+    job = enqueue_rebuild_stats(app)
+    assert job.func_name == 'app.tasks.rebuild_stats'
+    assert enqueue_rebuild_stats(app) is None
+
+    assert run_job(job, tasks.rebuild_stats) == 0
+    assert enqueue_rebuild_stats(app) is not None
+    assert len(app.task_queue.calls) == 2
+
+
+def test_prune_db_keeps_recently_revoked_tokens(app):
+    from app.api.auth.auth_utils import prune_db
+    now = datetime.utcnow()
+    with app.app_context():
+        def token(expires_in, revoked_ago=None):
+            return TokenBlacklist(jti=str(uuid4()), token_type='access', user_id=1, revoked=revoked_ago is not None,
+                                  expires=now + expires_in,
+                                  revoke_time=None if revoked_ago is None else now - revoked_ago)
+        kept = [token(timedelta(days=300)), token(timedelta(days=300), revoked_ago=timedelta(days=1))]
+        pruned = [token(timedelta(days=-1)), token(timedelta(days=-1), revoked_ago=timedelta(days=1)),
+                  token(timedelta(days=300), revoked_ago=timedelta(days=60))]
+        db.session.add_all(kept + pruned)
+        db.session.commit()
+        kept_ids = sorted(token.id for token in kept)
+
+        progress = []
+        assert prune_db(batch_size=1, revoked_age=30 * 24 * 3600,
+                        progress=lambda deleted, batches: progress.append((deleted, batches))) == 3
+        assert progress[-1] == (3, 3)
+        assert sorted(token_id for token_id, in db.session.query(TokenBlacklist.id)) == kept_ids
@@ -0,0 +1,52 @@
+import json
+import threading
+import time
+
+from app.utils.cache_utils import get_redis
+from app.utils.wechat_utils import WechatAccessTokenManager
+
+
+def test_concurrent_calls_fetch_the_token_once(app, wechat_stub, stubbed_wechat_http):
+    wechat_stub.delay = 0.2
+    manager = WechatAccessTokenManager()
+    barrier = threading.Barrier(8)
+    tokens = []
+
+    def get_token():
+        with app.app_context():
+            barrier.wait()
+            tokens.append(manager.get_token())
+
+    threads = [threading.Thread(target=get_token) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert wechat_stub.hits == 1
+    assert tokens == ['token-1'] * 8
+
+
+def test_token_is_refreshed_within_the_margin(app, wechat_stub, stubbed_wechat_http):
+    with app.app_context():
+        margin = app.config['WECHAT_TOKEN_REFRESH_MARGIN']
+        client = get_redis(app)
+
+        # A token further than the margin from its expiration is used as it is.
+        client.set(WechatAccessTokenManager.token_key,
+                   json.dumps({'access_token': 'fresh', 'expires_at': time.time() + margin + 60}))
+        assert WechatAccessTokenManager().get_token() == 'fresh'
+        assert wechat_stub.hits == 0
+
+        # A token still valid but within the margin is refreshed ahead of its expiration.
+        client.set(WechatAccessTokenManager.token_key,
+                   json.dumps({'access_token': 'expiring', 'expires_at': time.time() + margin - 60}))
+        manager = WechatAccessTokenManager()
+        assert manager.get_token() == 'token-1'
+        assert wechat_stub.hits == 1
+        assert json.loads(client.get(WechatAccessTokenManager.token_key))['access_token'] == 'token-1'
+
+        # The new token is kept until it gets within the margin again.
+        assert manager.get_token() == 'token-1'
+        assert WechatAccessTokenManager().get_token() == 'token-1'
+        assert wechat_stub.hits == 1
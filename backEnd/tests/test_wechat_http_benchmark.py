@@ -0,0 +1,72 @@
+"""
+Benchmark of the outbound wechat client against a local stub: throughput and p99 latency of concurrent callers
+with a healthy upstream, and with an injected upstream slowdown. Run with python -m pytest -m benchmark -s to see the results.
+"""
+import threading
+import time
+
+import pytest
+import requests
+
+from app.utils.http_client import OutboundClient, UpstreamUnavailable
+
+CALLERS = 8  # Request threads of a worker
+DURATION = 1.0  # Seconds each case runs
+SLOW_DELAY = 1.0  # Seconds the slowed down stub takes to answer
+
+
+def _run(app, call):
+    """
+    This function runs call() from CALLERS threads for DURATION seconds,
+    and returns the calls per second and the p99 latency in ms.
+    """
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + DURATION
+
+    def caller():
+        with app.app_context():
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                try:
+                    call()
+                except (UpstreamUnavailable, requests.RequestException):
+                    pass
+                with lock:
+                    latencies.append(time.monotonic() - start)
+
+    threads = [threading.Thread(target=caller) for _ in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return len(latencies) / DURATION, latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000
+
+
+@pytest.mark.benchmark
+def test_throughput_under_upstream_slowdown(app, wechat_stub, monkeypatch):
+    monkeypatch.setitem(app.config, 'WECHAT_HTTP_READ_TIMEOUT', 0.2)
+    monkeypatch.setitem(app.config, 'WECHAT_HTTP_RETRY_BACKOFF', 0.01)
+    url = wechat_stub.url + '/cgi-bin/token'
+    pooled = OutboundClient('WECHAT_HTTP')
+    results = {
+        'healthy, new connection per call': _run(app, lambda: requests.get(url)),
+        'healthy, pooled client': _run(app, lambda: pooled.get('cgi-bin/token', url)),
+    }
+    wechat_stub.delay = SLOW_DELAY
+    bounded = OutboundClient('WECHAT_HTTP')
+    results['slow, no timeout'] = _run(app, lambda: requests.get(url))
+    results['slow, pooled client'] = _run(app, lambda: bounded.get('cgi-bin/token', url))
+
+    print()
+    for case, (throughput, p99) in results.items():
+        print('%-35s %8.1f calls/s %8.1f ms p99' % (case, throughput, p99))
+    print(bounded.metrics_snapshot()['cgi-bin/token'])
+
+    slow_throughput, slow_p99 = results['slow, no timeout']
+    bounded_throughput, bounded_p99 = results['slow, pooled client']
+    # Timeouts and the open circuit free the callers long before the upstream answers.
+    assert bounded_p99 < SLOW_DELAY * 1000
+    assert bounded_throughput > 10 * slow_throughput
+    assert bounded.metrics_snapshot()['cgi-bin/token']['circuit'] == 'open'